@@ -0,0 +1,103 @@
+"""按水平条带并行执行逐像素和小卷积核的处理阶段
+
+查表、提亮、3x3模糊、锐化、颜色转换这类阶段，每个输出像素只依赖输入中同一位置附近几行的像素，
+画面可以切成互不重叠的水平条带分别处理。原来只有OpenCV自身的线程池（若启用）能把它们并行，
+树莓派的4个核心大多空闲。
+
+BandScheduler 持有一组常驻的工作线程（线程名 band，可以用 CAMERA_CPU_AFFINITY 的 band 角色绑核），
+每帧把条带分给它们，调用线程自己处理第一个条带：
+  - 条带数 = min(线程数, 行数 // min_rows)，画面太小时不拆分
+  - 每个阶段声明卷积核需要的上下文行数（halo），一串阶段在每个条带上连续执行，
+    条带的输入向上下各多取 后续所有阶段halo之和 行，每个阶段之后裁掉已不再需要的行
+  - 条带在画面上下边缘处与整幅画面的边缘重合，边界填充方式相同；条带之间的边缘由多取的真实像素覆盖，
+    所以结果与单线程处理整幅画面逐位相同
+OpenCV的函数执行期间释放GIL，多个条带真正并行。
+"""
+
+import logging
+import queue
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    """一次 map 调用：等待所有条带完成，保存第一个异常"""
+
+    def __init__(self, function, count):
+        self.function = function
+        self.remaining = count
+        self.lock = threading.Lock()
+        self.done = threading.Event()
+        self.error = None
+
+    def run(self, index):
+        try:
+            self.function(index)
+        except BaseException as e:
+            self.error = self.error or e
+        with self.lock:
+            self.remaining -= 1
+            if self.remaining == 0:
+                self.done.set()
+
+
+class BandScheduler:
+    """常驻线程池上的条带调度器，threads 包括调用线程本身"""
+
+    def __init__(self, threads, min_rows=32, name="band"):
+        self.threads = max(1, int(threads))
+        self.min_rows = max(1, int(min_rows))
+        self.name = name
+        self.tasks = queue.SimpleQueue()
+        self.workers = []
+        self.lock = threading.Lock()
+        self.stats = {"jobs": 0, "bands": 0, "errors": 0}
+
+    def _start(self):
+        # 第一次使用时才创建线程，只导入模块或未启用时没有额外线程
+        with self.lock:
+            while len(self.workers) < self.threads - 1:
+                worker = threading.Thread(target=self._worker, name=self.name, daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def _worker(self):
+        while True:
+            job, index = self.tasks.get()
+            if job is None:
+                return
+            job.run(index)
+
+    def split(self, rows):
+        """把 rows 行分成若干条带，返回 [(起始行, 结束行)]，行数不足时只有一个条带"""
+        count = max(1, min(self.threads, rows // self.min_rows))
+        bounds = [rows * i // count for i in range(count + 1)]
+        return list(zip(bounds[:-1], bounds[1:]))
+
+    def map(self, function, count):
+        """并行执行 function(0..count-1)，调用线程执行第0个，全部完成后返回；任一条带出错时重新抛出"""
+        if count <= 1:
+            if count == 1:
+                function(0)
+            return
+        if len(self.workers) < self.threads - 1:
+            self._start()
+        job = _Job(function, count)
+        for index in range(1, count):
+            self.tasks.put((job, index))
+        job.run(0)
+        job.done.wait()
+        self.stats["jobs"] += 1
+        self.stats["bands"] += count
+        if job.error is not None:
+            self.stats["errors"] += 1
+            raise job.error
+
+    def close(self):
+        for _ in self.workers:
+            self.tasks.put((None, None))
+        self.workers = []
+
+    def state(self):
+        return dict(self.stats, threads=self.threads, min_rows=self.min_rows, workers=len(self.workers))
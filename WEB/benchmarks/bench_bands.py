@@ -0,0 +1,146 @@
+"""条带并行（band_parallel.py）在1到4个线程下的加速比与逐位一致性
+
+对每张处理图（白天、三种夜视模式）以及一串只含逐像素和卷积核阶段的 kernels 图
+（查表→锐化(3x3)→5x5高斯模糊→BGR/HSV往返转换），分别用单线程和 --threads 中的每个线程数执行同一组帧：
+  - 每帧耗时的中位数和相对单线程的加速比
+  - 输出是否与单线程逐位相同（不同时返回非零退出码）
+夜视的平滑参数和时域降噪在每种线程数开始前重置，保证各次运行的输入状态相同；
+文字叠加含时间戳，比较时不执行（帧率置0，且跳过序号为10的倍数的帧）。
+
+OpenCV自身的线程池会与条带线程争用核心，默认 --cv-threads 1，只测条带并行本身。
+
+用法:
+    python benchmarks/bench_bands.py                                   # 640x480，1-4线程
+    python benchmarks/bench_bands.py --resolutions 640x480,1296x972 --threads 1,2,4 --json bands.json
+    python benchmarks/bench_bands.py --graphs night-normal,kernels --cv-threads 0
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+import band_parallel  # noqa: E402
+import camera_server as cs  # noqa: E402
+import processing_graph  # noqa: E402
+from bench_stages import synthetic_sequence  # noqa: E402
+
+GRAPHS = ("day", "night-simple", "night-normal", "night-enhanced", "kernels")
+
+
+def kernels_graph():
+    """只含可条带化阶段的处理图，halo之和为3行"""
+    Stage = processing_graph.Stage
+    return processing_graph.ProcessingGraph("kernels", [
+        Stage("lut", lambda ctx, frame: cv2.LUT(frame, cs.color_adjust_lut, dst=ctx.output(frame.shape)), halo=0),
+        Stage("sharpen", lambda ctx, frame: cs.apply_sharpening(frame), inputs=("lut",), halo=1),
+        Stage("blur5", lambda ctx, frame: cv2.GaussianBlur(frame, (5, 5), 0, dst=ctx.output(frame.shape)),
+              inputs=("sharpen",), halo=2),
+        Stage("hsv", lambda ctx, frame: cv2.cvtColor(cv2.cvtColor(frame, cv2.COLOR_BGR2HSV), cv2.COLOR_HSV2BGR,
+                                                      dst=ctx.output(frame.shape)), inputs=("blur5",), halo=0)
+    ])
+
+
+def frame_indexes(count):
+    """跳过10的倍数，文字叠加不执行"""
+    indexes = []
+    index = 1
+    while len(indexes) < count:
+        if index % 10:
+            indexes.append(index)
+        index += 1
+    return indexes
+
+
+def reset_state():
+    cs.night_vision_state.update(brightness_factor=1.6, brightness_offset=12, blend_factor=None)
+    cs.night_denoiser.reset()
+    cs.night_vision_buffer["contrast"] = None
+
+
+def run_graph(graph, frames, threads, min_rows, iterations):
+    """返回 (每帧耗时列表, 输出列表)"""
+    scheduler = band_parallel.BandScheduler(threads, min_rows) if threads > 1 else None
+    engine = processing_graph.ProcessingEngine(scheduler)
+    reset_state()
+    times, outputs = [], []
+    for index in frame_indexes(iterations):
+        frame = frames[index % len(frames)]
+        start = time.perf_counter()
+        output = engine.run(graph, frame, index)
+        times.append((time.perf_counter() - start) * 1000)
+        outputs.append(output)
+    if scheduler is not None:
+        scheduler.close()
+    return times, outputs
+
+
+def run(args):
+    cv2.setNumThreads(args.cv_threads)
+    cs.fps_stats["current"] = 0
+    graphs = dict(cs.processing_graphs, kernels=kernels_graph())
+    names = args.graphs.split(",") if args.graphs else list(GRAPHS)
+    unknown = [name for name in names if name not in graphs]
+    if unknown:
+        raise SystemExit(f"未知的处理图: {', '.join(unknown)}，可选: {', '.join(GRAPHS)}")
+    thread_counts = [int(v) for v in args.threads.split(",")]
+
+    results = {}
+    mismatches = 0
+    print(f"OpenCV线程数 {cv2.getNumThreads()}，CPU核心 {os.cpu_count()}")
+    print(f"{'处理图@分辨率':32s} {'线程':>4s} {'条带':>4s} {'中位(ms)':>9s} {'加速':>7s} {'逐位一致':>8s}")
+    for resolution in args.resolutions.split(","):
+        width, height = (int(v) for v in resolution.split("x"))
+        frames = {"day": synthetic_sequence(width, height), "night": synthetic_sequence(width, height, dark=True)}
+        for name in names:
+            kind = "day" if name in ("day", "kernels") else "night"
+            reference = None
+            single_ms = None
+            for threads in thread_counts:
+                # 预热一轮，之后取多轮中中位耗时最小的一轮
+                run_graph(graphs[name], frames[kind], threads, args.min_rows, args.warmup)
+                rounds = [run_graph(graphs[name], frames[kind], threads, args.min_rows, args.iterations)
+                          for _ in range(args.repeat)]
+                times, outputs = min(rounds, key=lambda item: statistics.median(item[0]))
+                median = statistics.median(times)
+                if reference is None:
+                    reference, single_ms = outputs, median
+                exact = all(np.array_equal(a, b) for a, b in zip(reference, outputs))
+                mismatches += not exact
+                bands = len(band_parallel.BandScheduler(threads, args.min_rows).split(height))
+                results[f"{name}@{resolution}@{threads}"] = {
+                    "threads": threads, "bands": bands, "median_ms": median,
+                    "speedup": single_ms / median if median else None, "bit_exact": exact
+                }
+                print(f"{name + '@' + resolution:32s} {threads:4d} {bands:4d} {median:9.3f} "
+                      f"{single_ms / median:6.2f}x {'是' if exact else '否':>8s}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"cv_threads": args.cv_threads, "cpu_count": os.cpu_count(), "results": results}, f, indent=2)
+    if mismatches:
+        print(f"\n{mismatches} 组结果与单线程不一致")
+    return 1 if mismatches else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="条带并行的加速比与逐位一致性")
+    parser.add_argument("--resolutions", default="640x480", help="逗号分隔的分辨率列表")
+    parser.add_argument("--graphs", help=f"逗号分隔的处理图，默认全部: {', '.join(GRAPHS)}")
+    parser.add_argument("--threads", default="1,2,3,4", help="逗号分隔的线程数，第一个作为比较基准")
+    parser.add_argument("--min-rows", type=int, default=32, help="每个条带的最少行数")
+    parser.add_argument("--iterations", type=int, default=60)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="重复轮数，取中位耗时最小的一轮")
+    parser.add_argument("--cv-threads", type=int, default=1, help="OpenCV线程数，0为关闭OpenCV内部并行")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    cs.logger.setLevel("WARNING")
+    sys.exit(run(parser.parse_args()))
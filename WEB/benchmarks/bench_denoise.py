@@ -0,0 +1,147 @@
+"""夜视降噪方法的耗时与降噪效果对比
+
+比较不降噪、原来隔帧的3x3高斯模糊，以及不同分辨率比例下的时域降噪（temporal_denoise.py）：
+  - 每帧耗时（毫秒）
+  - 时域噪声：静止区域每个像素随时间的标准差的中位数，越小画面越稳定
+  - PSNR：与参考画面比较，合成画面使用无噪声原图，录制视频使用各像素的时间中位数
+    （要求录像时摄像头固定，画面大部分静止）
+
+用法:
+    python benchmarks/bench_denoise.py                               # 合成低光画面
+    python benchmarks/bench_denoise.py --video 夜间录像.mp4 --frames 200
+    python benchmarks/bench_denoise.py --alpha 0.2 --scales 1.0,0.5,0.25 --json denoise.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import temporal_denoise  # noqa: E402
+
+
+def synthetic_low_light(count, width, height, noise=9.0, seed=0):
+    """返回 (带噪声的帧, 无噪声的原图)：暗背景上的细纹理，加一个移动的物体"""
+    rng = np.random.default_rng(seed)
+    texture = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 1.5)
+    texture = cv2.normalize(texture, None, 10, 60, cv2.NORM_MINMAX)
+    noisy, clean = [], []
+    box = max(8, width // 10)
+    for index in range(count):
+        frame = texture.copy()
+        x = (index * 5) % max(1, width - box)
+        cv2.rectangle(frame, (x, height // 2), (x + box, height // 2 + box), (70, 70, 70), -1)
+        clean.append(frame)
+        sensor_noise = rng.normal(0, noise, frame.shape)
+        noisy.append(np.clip(frame + sensor_noise, 0, 255).astype(np.uint8))
+    return noisy, clean
+
+
+def recorded_low_light(path, count, width, height):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, (width, height)))
+    capture.release()
+    if not frames:
+        raise SystemExit(f"无法读取视频: {path}")
+    reference = np.median(np.stack(frames), axis=0).astype(np.uint8)
+    return frames, [reference] * len(frames)
+
+
+def gaussian_method():
+    counter = [0]
+
+    def run(frame):
+        counter[0] += 1
+        return cv2.GaussianBlur(frame, (3, 3), 0) if counter[0] % 2 == 0 else frame
+    return run
+
+
+def temporal_method(alpha, scale):
+    denoiser = temporal_denoise.TemporalDenoiser(alpha=alpha, scale=scale)
+    return denoiser.process
+
+
+def static_mask(clean_frames):
+    """参考画面中始终不变的像素"""
+    stack = np.stack(clean_frames).astype(np.int16)
+    return (stack.max(axis=0) - stack.min(axis=0)).max(axis=2) < 3
+
+
+def evaluate(method, frames, clean, warmup, mask):
+    times = []
+    outputs = []
+    for index, frame in enumerate(frames):
+        start = time.perf_counter()
+        output = method(frame)
+        elapsed = (time.perf_counter() - start) * 1000
+        if index >= warmup:
+            times.append(elapsed)
+            # 降噪器的输出缓冲区会被下一帧覆盖，计时之外复制保存
+            outputs.append(output.copy())
+
+    stack = np.stack(outputs).astype(np.float32)
+    temporal_std = stack.std(axis=0).mean(axis=2)
+    references = np.stack(clean[warmup:]).astype(np.float32)
+    mse = float(np.mean((stack - references) ** 2))
+    return {
+        "ms_per_frame": statistics.median(times),
+        "temporal_noise": float(np.median(temporal_std[mask])) if mask.any() else None,
+        "psnr_db": 10 * np.log10(255.0 ** 2 / mse) if mse > 0 else float("inf")
+    }
+
+
+def run(args):
+    width, height = (int(v) for v in args.resolution.split("x"))
+    if args.video:
+        frames, clean = recorded_low_light(args.video, args.frames, width, height)
+    else:
+        frames, clean = synthetic_low_light(args.frames, width, height, args.noise)
+    mask = static_mask(clean)
+
+    methods = {"none": lambda frame: frame, "gaussian_every_2nd": gaussian_method()}
+    for scale in (float(v) for v in args.scales.split(",")):
+        methods[f"temporal_scale_{scale:g}"] = temporal_method(args.alpha, scale)
+
+    results = {name: evaluate(method, frames, clean, args.warmup, mask) for name, method in methods.items()}
+    baseline_noise = results["none"]["temporal_noise"]
+
+    print(f"{len(frames)} 帧 {width}x{height} ({'录制视频' if args.video else '合成画面'}), alpha={args.alpha}")
+    print(f"{'方法':24s} {'耗时(ms)':>9s} {'时域噪声':>9s} {'噪声降低':>9s} {'PSNR(dB)':>9s}")
+    for name, item in results.items():
+        reduction = ""
+        if baseline_noise and item["temporal_noise"] is not None:
+            item["noise_reduction_db"] = 20 * np.log10(baseline_noise / max(item["temporal_noise"], 1e-6))
+            reduction = f"{item['noise_reduction_db']:8.1f}dB"
+        noise = f"{item['temporal_noise']:9.2f}" if item["temporal_noise"] is not None else f"{'-':>9s}"
+        print(f"{name:24s} {item['ms_per_frame']:9.3f} {noise} {reduction:>9s} {item['psnr_db']:9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"resolution": args.resolution, "alpha": args.alpha, "video": args.video,
+                       "results": results}, f, indent=2)
+    return results
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="夜视降噪方法对比")
+    parser.add_argument("--video", help="录制的低光视频，不指定时使用合成画面")
+    parser.add_argument("--frames", type=int, default=120)
+    parser.add_argument("--warmup", type=int, default=20, help="不计入统计的前若干帧（累加器收敛）")
+    parser.add_argument("--resolution", default="640x480")
+    parser.add_argument("--alpha", type=float, default=0.25)
+    parser.add_argument("--scales", default="1.0,0.5")
+    parser.add_argument("--noise", type=float, default=9.0, help="合成画面的噪声标准差")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    run(parser.parse_args())
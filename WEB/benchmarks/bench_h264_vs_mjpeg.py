@@ -0,0 +1,122 @@
+"""对比 MJPEG 与 H.264(fMP4) 两条输出路径的CPU开销和数据量
+
+用法:
+    python benchmarks/bench_h264_vs_mjpeg.py                       # 合成画面，640x480
+    python benchmarks/bench_h264_vs_mjpeg.py --video 录像.mp4       # 使用录制的视频
+    python benchmarks/bench_h264_vs_mjpeg.py --bitrate 500000 --gop 50 --json result.json
+
+MJPEG按每个观看者一份计算带宽，H.264同样是每个观看者一份，
+但码率只有MJPEG的一小部分，结果中给出两者每秒的字节数之比。
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import h264_stream  # noqa: E402
+
+
+def synthetic_frames(count, width, height, seed=0):
+    """生成带纹理背景、移动物体和传感器噪声的合成画面"""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 6)
+    background = cv2.normalize(background, None, 20, 220, cv2.NORM_MINMAX)
+    for index in range(count):
+        frame = background.copy()
+        x = (index * 6) % max(1, width - 80)
+        cv2.rectangle(frame, (x, height // 3), (x + 80, height // 3 + 80), (40, 200, 40), -1)
+        noise = rng.integers(-6, 7, frame.shape, dtype=np.int16)
+        yield np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8)
+
+
+def video_frames(path, count, width, height):
+    capture = cv2.VideoCapture(path)
+    produced = 0
+    while produced < count:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        produced += 1
+        yield cv2.resize(frame, (width, height))
+    capture.release()
+
+
+def run(args):
+    if args.video:
+        frames = list(video_frames(args.video, args.frames, args.width, args.height))
+    else:
+        frames = list(synthetic_frames(args.frames, args.width, args.height))
+    if not frames:
+        raise SystemExit("没有可用的帧")
+
+    # MJPEG路径：与 camera_server.encode_and_cache_frame 相同的参数
+    mjpeg_bytes = 0
+    start = time.process_time()
+    for frame in frames:
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, args.quality])
+        mjpeg_bytes += len(buffer)
+    mjpeg_cpu = time.process_time() - start
+
+    # H.264路径：编码+fMP4封装
+    streamer = h264_stream.H264Streamer(args.width, args.height, fps=args.fps, bitrate=args.bitrate, gop=args.gop)
+    start = time.process_time()
+    for index, frame in enumerate(frames):
+        streamer.encode(frame, index / args.fps)
+    streamer.close()
+    h264_cpu = time.process_time() - start
+    h264_bytes = streamer.stats["bytes"] + len(streamer.init_segment or b"")
+
+    count = len(frames)
+    result = {
+        "frames": count,
+        "resolution": f"{args.width}x{args.height}",
+        "fps": args.fps,
+        "mjpeg": {
+            "quality": args.quality,
+            "cpu_ms_per_frame": mjpeg_cpu / count * 1000,
+            "bytes_per_frame": mjpeg_bytes / count,
+            "mbit_per_second": mjpeg_bytes / count * args.fps * 8 / 1e6
+        },
+        "h264": {
+            "bitrate": args.bitrate,
+            "gop": args.gop,
+            "cpu_ms_per_frame": h264_cpu / count * 1000,
+            "bytes_per_frame": h264_bytes / count,
+            "mbit_per_second": h264_bytes / count * args.fps * 8 / 1e6
+        }
+    }
+    result["bytes_ratio"] = result["mjpeg"]["bytes_per_frame"] / max(1, result["h264"]["bytes_per_frame"])
+    result["cpu_ratio"] = result["h264"]["cpu_ms_per_frame"] / max(1e-9, result["mjpeg"]["cpu_ms_per_frame"])
+
+    print(f"{count} 帧 {result['resolution']} @ {args.fps}fps")
+    for name in ("mjpeg", "h264"):
+        item = result[name]
+        print(f"  {name:6s} CPU {item['cpu_ms_per_frame']:6.2f} ms/帧  "
+              f"{item['bytes_per_frame'] / 1024:7.1f} KB/帧  {item['mbit_per_second']:6.2f} Mbit/s (每个观看者)")
+    print(f"  MJPEG数据量是H.264的 {result['bytes_ratio']:.1f} 倍，H.264的CPU开销是MJPEG的 {result['cpu_ratio']:.2f} 倍")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="MJPEG与H.264输出路径的CPU和数据量对比")
+    parser.add_argument("--video", help="录制的视频文件，不指定时使用合成画面")
+    parser.add_argument("--frames", type=int, default=250)
+    parser.add_argument("--width", type=int, default=640)
+    parser.add_argument("--height", type=int, default=480)
+    parser.add_argument("--fps", type=int, default=25)
+    parser.add_argument("--quality", type=int, default=85, help="MJPEG质量")
+    parser.add_argument("--bitrate", type=int, default=800000, help="H.264码率")
+    parser.add_argument("--gop", type=int, default=25, help="H.264关键帧间隔")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    run(parser.parse_args())
@@ -0,0 +1,124 @@
+"""测量空闲模式与有客户端时摄像头服务的CPU占用
+
+以合成摄像头启动 camera_server.py，分别在没有客户端和有一个MJPEG客户端时统计进程CPU，
+并测量空闲状态下第一个订阅者收到新帧的耗时。
+
+用法:
+    python benchmarks/bench_idle_cpu.py                  # 合成摄像头，每个阶段测量10秒
+    python benchmarks/bench_idle_cpu.py --seconds 30 --json idle.json
+    python benchmarks/bench_idle_cpu.py --no-idle        # 关闭空闲模式作为对照
+
+在树莓派上测量真实摄像头时加 --source picamera2。
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "camera_server.py")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+
+
+def process_cpu_seconds(pid):
+    """读取进程累计CPU时间（用户态+内核态）"""
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+
+
+def measure_cpu(pid, seconds):
+    start_cpu = process_cpu_seconds(pid)
+    start = time.time()
+    time.sleep(seconds)
+    return (process_cpu_seconds(pid) - start_cpu) / (time.time() - start) * 100
+
+
+def get_status(port):
+    with urllib.request.urlopen(f"http://127.0.0.1:{port}/status", timeout=5) as response:
+        return json.load(response)
+
+
+def wait_for(predicate, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            if predicate():
+                return True
+        except OSError:
+            pass
+        time.sleep(0.2)
+    return False
+
+
+def read_mjpeg(port, stop_event, result):
+    """MJPEG客户端：记录第一帧到达的耗时和画面的新鲜程度，之后持续读取"""
+    connect_time = time.time()
+    response = urllib.request.urlopen(f"http://127.0.0.1:{port}/video_feed", timeout=10)
+    frames = 0
+    while not stop_event.is_set():
+        line = response.readline()
+        if not line:
+            break
+        if line.startswith(b"X-Frame-Timestamp:") and "first_frame_delay" not in result:
+            result["first_frame_delay"] = time.time() - connect_time
+            result["first_frame_age"] = time.time() - float(line.split(b":", 1)[1])
+        if line.startswith(b"--frame"):
+            frames += 1
+    result["frames"] = frames
+    response.close()
+
+
+def run(args):
+    env = dict(os.environ, CAMERA_SOURCE=args.source, CAMERA_PORT=str(args.port), CAMERA_FRAME_BUS="0",
+               CAMERA_IDLE_MODE="0" if args.no_idle else "1")
+    server = subprocess.Popen([sys.executable, SERVER_PATH], env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    result = {"source": args.source, "idle_mode": not args.no_idle, "seconds": args.seconds}
+    try:
+        if not wait_for(lambda: get_status(args.port)["camera_status"] == "running", 30):
+            raise SystemExit("摄像头服务未能启动")
+        if not args.no_idle and not wait_for(lambda: get_status(args.port)["idle"]["idle"], 30):
+            raise SystemExit("服务没有进入空闲模式")
+
+        result["idle_cpu_percent"] = measure_cpu(server.pid, args.seconds)
+
+        stop_event = threading.Event()
+        client = {}
+        thread = threading.Thread(target=read_mjpeg, args=(args.port, stop_event, client), daemon=True)
+        thread.start()
+        time.sleep(2)  # 等待恢复正常帧率
+        result["active_cpu_percent"] = measure_cpu(server.pid, args.seconds)
+        result["active_fps"] = get_status(args.port)["fps"]["current"]
+        stop_event.set()
+        thread.join(timeout=5)
+        result["first_frame_delay_ms"] = client.get("first_frame_delay", 0) * 1000
+        result["first_frame_age_ms"] = client.get("first_frame_age", 0) * 1000
+        result["idle_status"] = get_status(args.port)["idle"]
+    finally:
+        server.terminate()
+        server.wait(timeout=10)
+
+    print(f"空闲模式: {'开启' if result['idle_mode'] else '关闭'}")
+    print(f"  无客户端 CPU: {result['idle_cpu_percent']:.1f}%")
+    print(f"  一个客户端 CPU: {result['active_cpu_percent']:.1f}% ({result['active_fps']:.1f} fps)")
+    print(f"  第一帧到达 {result['first_frame_delay_ms']:.1f}ms，画面采集于 {result['first_frame_age_ms']:.1f}ms 前")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    return result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="空闲模式与有客户端时的CPU占用对比")
+    parser.add_argument("--source", default="synthetic", help="摄像头来源: synthetic 或 picamera2")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--seconds", type=float, default=10.0, help="每个阶段的测量时间")
+    parser.add_argument("--no-idle", action="store_true", help="关闭空闲模式作为对照")
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    run(parser.parse_args())
@@ -0,0 +1,144 @@
+"""MJPEG多客户端发送方式的开销对比
+
+在进程内用socketpair模拟N个客户端（读取线程持续读空），比较每帧每客户端的发送耗时：
+  - per_client_copy_chunked: 原来的方式，每个客户端拼接一次 分段头+JPEG+结尾，
+    再经werkzeug的分块编码写出（长度行、数据、CRLF三次写入）
+  - shared_chunk_chunked:    分段每帧只拼接一次，仍经werkzeug分块编码写出（CAMERA_MJPEG_DIRECT=0）
+  - shared_chunk_direct:     共享分段直接sendall到客户端socket（默认）
+
+用法:
+    python benchmarks/bench_mjpeg_send.py
+    python benchmarks/bench_mjpeg_send.py --clients 1,4,8 --resolution 1296x972 --frames 300
+
+端到端的对比（包括服务进程CPU）可以用 load_test.py:
+    python benchmarks/load_test.py --mjpeg 6 --env CAMERA_MJPEG_DIRECT=0
+    python benchmarks/load_test.py --mjpeg 6 --env CAMERA_MJPEG_DIRECT=1
+"""
+
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+import time
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import camera_server as cs  # noqa: E402
+
+
+def make_entries(width, height, count=8):
+    """编码若干帧合成画面，返回与 store_encoded_frame 相同结构的缓存条目"""
+    rng = np.random.default_rng(0)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 3)
+    entries = []
+    for index in range(count):
+        frame = np.roll(background, index * 4, axis=1)
+        data = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+        entry = {"time": time.time(), "data": data, "seq": index, "capture_time": time.time(), "hops": 0}
+        entry["chunk"] = cs.build_part_header(entry) + data + b'\r\n'
+        entries.append(entry)
+    return entries
+
+
+def werkzeug_chunked_write(sock, data):
+    # 与werkzeug WSGIRequestHandler.write 在分块编码下的写入顺序一致（wfile无缓冲，每次写入即sendall）
+    sock.sendall(hex(len(data))[2:].encode())
+    sock.sendall(b"\r\n")
+    sock.sendall(data)
+    sock.sendall(b"\r\n")
+
+
+def send_per_client_copy_chunked(sock, entry):
+    werkzeug_chunked_write(sock, cs.build_part_header(entry) + entry["data"] + b'\r\n')
+
+
+def send_shared_chunk_chunked(sock, entry):
+    werkzeug_chunked_write(sock, entry["chunk"])
+
+
+def send_shared_chunk_direct(sock, entry):
+    sock.sendall(entry["chunk"])
+
+
+METHODS = {
+    "per_client_copy_chunked": send_per_client_copy_chunked,
+    "shared_chunk_chunked": send_shared_chunk_chunked,
+    "shared_chunk_direct": send_shared_chunk_direct,
+}
+
+
+def drain(sock):
+    buffer = bytearray(1 << 20)
+    try:
+        while sock.recv_into(buffer):
+            pass
+    except OSError:
+        pass
+
+
+def run_method(method, entries, clients, frames):
+    """返回 (每帧每客户端的CPU微秒, 每帧每客户端的耗时微秒)"""
+    pairs = [socket.socketpair() for _ in range(clients)]
+    readers = [threading.Thread(target=drain, args=(reader,), daemon=True) for _, reader in pairs]
+    for thread in readers:
+        thread.start()
+
+    try:
+        for entry in entries:
+            for sender, _ in pairs:
+                method(sender, entry)
+
+        cpu_start = time.thread_time()
+        wall_start = time.perf_counter()
+        for index in range(frames):
+            entry = entries[index % len(entries)]
+            for sender, _ in pairs:
+                method(sender, entry)
+        cpu = time.thread_time() - cpu_start
+        wall = time.perf_counter() - wall_start
+    finally:
+        for sender, reader in pairs:
+            sender.close()
+        for thread in readers:
+            thread.join(timeout=2)
+        for _, reader in pairs:
+            reader.close()
+
+    sends = frames * clients
+    return cpu / sends * 1e6, wall / sends * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description="MJPEG多客户端发送方式对比")
+    parser.add_argument("--clients", default="1,4,8", help="逗号分隔的客户端数量列表")
+    parser.add_argument("--resolution", default="640x480")
+    parser.add_argument("--frames", type=int, default=200)
+    parser.add_argument("--json", help="把结果写入JSON文件")
+    args = parser.parse_args()
+
+    cs.logger.setLevel("WARNING")
+    width, height = (int(v) for v in args.resolution.split("x"))
+    entries = make_entries(width, height)
+    average_size = sum(len(entry["data"]) for entry in entries) / len(entries)
+
+    print(f"{args.resolution}, 平均JPEG {average_size / 1024:.1f}KB, {args.frames} 帧")
+    print(f"{'方法':26s} {'客户端':>6s} {'CPU(us/帧/客户端)':>18s} {'耗时(us/帧/客户端)':>18s}")
+    results = []
+    for clients in (int(v) for v in args.clients.split(",")):
+        for name, method in METHODS.items():
+            cpu_us, wall_us = run_method(method, entries, clients, args.frames)
+            results.append({"method": name, "clients": clients, "cpu_us": cpu_us, "wall_us": wall_us})
+            print(f"{name:26s} {clients:6d} {cpu_us:18.1f} {wall_us:18.1f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"resolution": args.resolution, "jpeg_bytes": average_size, "results": results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""图像处理各阶段的微基准测试与性能回归检查
+
+直接调用 camera_server.py 中的处理函数，在合成画面（以及可选的录制视频）上
+按多个分辨率分别计时，结果可以保存为基准JSON，之后的运行与基准比较，
+某个阶段的中位耗时超过容差时返回非零退出码。
+
+用法:
+    python benchmarks/bench_stages.py                                  # 运行并打印结果
+    python benchmarks/bench_stages.py --save-baseline                  # 记录基准（在目标树莓派上运行）
+    python benchmarks/bench_stages.py --check --tolerance 0.2          # 与基准比较，回归超过20%时失败
+    python benchmarks/bench_stages.py --video 夜间录像.mp4 --stages night_vision_enhanced,detect_motion
+    python benchmarks/bench_stages.py --stages local_contrast_full,local_contrast_half,local_contrast_quarter
+
+pipeline_day 和 night_vision_* 执行完整的处理图（含文字叠加），各阶段的耗时见 /status 的 pipeline 字段。
+
+detect_low_light_metadata 为按请求元数据（Lux）估计光线水平后的低光判断，对比 detect_low_light 的像素统计。
+
+analysis_full 与 analysis_lores 比较在主画面上和在分析流亮度图（由主画面缩小，包含缩小本身的耗时）上
+做有效性、光线和运动检测的总耗时。
+
+local_contrast_* 阶段比较CLAHE在不同处理分辨率下的耗时，降分辨率阶段额外输出
+与全分辨率结果比较的PSNR，用于权衡 CAMERA_PROCESSING_SCALE 的画质损失与速度收益。
+
+基准与机器相关，应在部署的树莓派型号上记录和比较。
+"""
+
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+
+import cv2
+import numpy as np
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, ".."))
+
+import camera_server as cs  # noqa: E402
+import light_estimation  # noqa: E402
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "baseline_stages.json")
+DEFAULT_RESOLUTIONS = "320x240,640x480,1296x972"
+SEQUENCE_LENGTH = 16
+# 低于此绝对差值(毫秒)的变化视为计时噪声，不判定为回归
+NOISE_FLOOR_MS = 0.1
+
+
+def synthetic_sequence(width, height, dark=False, seed=0):
+    """生成带纹理背景、移动物体和传感器噪声的帧序列，dark=True时模拟夜间画面"""
+    rng = np.random.default_rng(seed)
+    background = cv2.GaussianBlur(rng.integers(0, 255, (height, width, 3), dtype=np.uint8), (0, 0), 5)
+    low, high, noise_level = (5, 45, 8) if dark else (30, 220, 4)
+    background = cv2.normalize(background, None, low, high, cv2.NORM_MINMAX)
+    box = max(8, width // 8)
+    frames = []
+    for index in range(SEQUENCE_LENGTH):
+        frame = background.copy()
+        x = (index * width // SEQUENCE_LENGTH) % max(1, width - box)
+        cv2.rectangle(frame, (x, height // 3), (x + box, height // 3 + box), (high, high, high), -1)
+        noise = rng.integers(-noise_level, noise_level + 1, frame.shape, dtype=np.int16)
+        frames.append(np.clip(frame.astype(np.int16) + noise, 0, 255).astype(np.uint8))
+    return frames
+
+
+def recorded_sequence(path, width, height):
+    capture = cv2.VideoCapture(path)
+    frames = []
+    while len(frames) < SEQUENCE_LENGTH:
+        ok, frame = capture.read()
+        if not ok:
+            break
+        frames.append(cv2.resize(frame, (width, height)))
+    capture.release()
+    return frames
+
+
+def run_graph(name):
+    """直接执行指定的处理图，不经过按夜视状态和帧率的自动选择"""
+    graph = cs.processing_graphs[name]
+    return lambda frame: cs.processing_engine.run(graph, frame, cs.frame_counter)
+
+
+def force_motion_check():
+    # 跳过运动检测的时间间隔限制，每次调用都执行完整检测
+    cs.last_motion_time = 0
+    cs.motion_detected = False
+
+
+def analyze(image):
+    """分析线程对每张图做的检测（运动检测跳过时间间隔限制）"""
+    cs.is_valid_frame(image)
+    cs.detect_low_light(image)
+    force_motion_check()
+    cs.detect_motion(image)
+
+
+LIGHT_ESTIMATOR = light_estimation.LightEstimator()
+LUX_METADATA = {"Lux": 120.0, "ExposureTime": 33000, "AnalogueGain": 2.0, "DigitalGain": 1.0}
+
+
+def detect_low_light_metadata(frame):
+    level, _, _ = LIGHT_ESTIMATOR.estimate(LUX_METADATA, frame)
+    return cs.detect_low_light(frame, level)
+
+
+# 阶段名 -> (输入画面类型, 每次调用前的准备函数, 被测函数)
+STAGES = {
+    "adjust_colors_fast": ("day", None, cs.adjust_colors_fast),
+    "pipeline_day": ("day", None, run_graph("day")),
+    "night_vision_simple": ("night", None, run_graph("night-simple")),
+    "night_vision_normal": ("night", None, run_graph("night-normal")),
+    "night_vision_enhanced": ("night", None, run_graph("night-enhanced")),
+    "temporal_denoise": ("night", None, lambda frame: cs.night_denoiser.process(frame, cs.motion_mask)),
+    "local_contrast_full": ("night", None, lambda frame: cs.apply_local_contrast(frame, 1.0)),
+    "local_contrast_half": ("night", None, lambda frame: cs.apply_local_contrast(frame, 0.5)),
+    "local_contrast_quarter": ("night", None, lambda frame: cs.apply_local_contrast(frame, 0.25)),
+    "detect_low_light": ("day", None, cs.detect_low_light),
+    "detect_low_light_metadata": ("day", None, detect_low_light_metadata),
+    "detect_motion": ("day", force_motion_check, cs.detect_motion),
+    "is_valid_frame": ("day", None, cs.is_valid_frame),
+    "analysis_full": ("day", None, analyze),
+    "analysis_lores": ("day", None, lambda frame: analyze(cs.extract_lores_luma(frame))),
+    "overlay": ("day", None, lambda frame: cs.draw_overlay(frame, 25.0)),
+    "encode_and_cache_frame": ("day", None, lambda frame: cs.encode_and_cache_frame(frame, time.time())),
+}
+
+# 降分辨率处理的阶段 -> 全分辨率参考阶段，结果中附带与参考输出比较的PSNR
+QUALITY_REFERENCE = {
+    "local_contrast_half": "local_contrast_full",
+    "local_contrast_quarter": "local_contrast_full",
+}
+
+
+def psnr(output, reference):
+    mse = float(np.mean((output.astype(np.float32) - reference.astype(np.float32)) ** 2))
+    return 10 * np.log10(255.0 ** 2 / mse) if mse > 0 else float("inf")
+
+
+def quality_against_reference(name, frames):
+    """在同一组输入上比较降分辨率阶段与参考阶段的输出，返回平均PSNR(dB)"""
+    function = STAGES[name][2]
+    reference = STAGES[QUALITY_REFERENCE[name]][2]
+    return statistics.fmean(psnr(function(frame), reference(frame)) for frame in frames)
+
+
+def time_stage(function, prepare, frames, iterations, warmup):
+    """返回每次调用耗时(毫秒)的列表；frame_counter随调用递增，覆盖隔帧处理的分支"""
+    samples = []
+    for index in range(warmup + iterations):
+        frame = frames[index % len(frames)]
+        cs.frame_counter += 1
+        if prepare is not None:
+            prepare()
+        start = time.perf_counter()
+        function(frame)
+        elapsed = (time.perf_counter() - start) * 1000
+        if index >= warmup:
+            samples.append(elapsed)
+    return samples
+
+
+def machine_info():
+    return {
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "python": platform.python_version(),
+        "opencv": cv2.__version__,
+        "numpy": np.__version__,
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads()
+    }
+
+
+def run(args):
+    resolutions = [tuple(int(v) for v in item.split("x")) for item in args.resolutions.split(",")]
+    stages = args.stages.split(",") if args.stages else list(STAGES)
+    unknown = [name for name in stages if name not in STAGES]
+    if unknown:
+        raise SystemExit(f"未知的阶段: {', '.join(unknown)}，可选: {', '.join(STAGES)}")
+
+    results = {}
+    for width, height in resolutions:
+        sources = {"synthetic": {"day": synthetic_sequence(width, height),
+                                 "night": synthetic_sequence(width, height, dark=True)}}
+        if args.video:
+            recorded = recorded_sequence(args.video, width, height)
+            if recorded:
+                sources["recorded"] = {"day": recorded, "night": recorded}
+
+        for source, frames_by_kind in sources.items():
+            for name in stages:
+                kind, prepare, function = STAGES[name]
+                # 重复多轮取中位耗时最小的一轮，降低后台负载造成的波动
+                rounds = []
+                for _ in range(args.repeat):
+                    samples = sorted(time_stage(function, prepare, frames_by_kind[kind], args.iterations, args.warmup))
+                    rounds.append(samples)
+                samples = min(rounds, key=statistics.median)
+                results[f"{name}@{width}x{height}@{source}"] = {
+                    "median_ms": statistics.median(samples),
+                    "p90_ms": samples[int(len(samples) * 0.9) - 1],
+                    "mean_ms": statistics.fmean(samples),
+                    "iterations": len(samples),
+                    "rounds": args.repeat
+                }
+                if name in QUALITY_REFERENCE:
+                    results[f"{name}@{width}x{height}@{source}"]["psnr_db"] = \
+                        quality_against_reference(name, frames_by_kind[kind])
+    return results
+
+
+def compare(results, baseline, tolerance):
+    """返回 (比较行, 回归列表)"""
+    rows = []
+    regressions = []
+    for key, result in results.items():
+        base = baseline.get(key)
+        if base is None:
+            rows.append((key, result["median_ms"], None, None))
+            continue
+        delta = (result["median_ms"] - base["median_ms"]) / base["median_ms"] if base["median_ms"] else 0.0
+        rows.append((key, result["median_ms"], base["median_ms"], delta))
+        if delta > tolerance and result["median_ms"] - base["median_ms"] > NOISE_FLOOR_MS:
+            regressions.append((key, base["median_ms"], result["median_ms"], delta))
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="图像处理阶段微基准与回归检查")
+    parser.add_argument("--resolutions", default=DEFAULT_RESOLUTIONS, help="逗号分隔的分辨率列表")
+    parser.add_argument("--stages", help=f"逗号分隔的阶段列表，默认全部: {', '.join(STAGES)}")
+    parser.add_argument("--video", help="录制的视频文件，作为额外的输入来源")
+    parser.add_argument("--iterations", type=int, default=60)
+    parser.add_argument("--warmup", type=int, default=10)
+    parser.add_argument("--repeat", type=int, default=3, help="重复轮数，取中位耗时最小的一轮")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基准JSON文件")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基准")
+    parser.add_argument("--check", action="store_true", help="与基准比较，有回归时返回非零退出码")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="允许的中位耗时增长比例")
+    parser.add_argument("--json", help="把本次结果写入JSON文件")
+    args = parser.parse_args()
+
+    # 基准测试期间不需要服务日志
+    cs.logger.setLevel("WARNING")
+
+    results = run(args)
+    info = machine_info()
+
+    baseline = {}
+    if os.path.exists(args.baseline) and not args.save_baseline:
+        with open(args.baseline) as f:
+            stored = json.load(f)
+        baseline = stored.get("results", {})
+        if stored.get("machine", {}).get("machine") != info["machine"]:
+            print(f"警告: 基准记录于 {stored.get('machine', {}).get('machine')}，当前为 {info['machine']}，比较结果仅供参考")
+
+    rows, regressions = compare(results, baseline, args.tolerance)
+    print(f"{'阶段@分辨率@来源':48s} {'中位(ms)':>10s} {'基准(ms)':>10s} {'变化':>8s}")
+    for key, median, base, delta in rows:
+        base_text = f"{base:10.3f}" if base is not None else f"{'-':>10s}"
+        delta_text = f"{delta * 100:+7.1f}%" if delta is not None else f"{'-':>8s}"
+        print(f"{key:48s} {median:10.3f} {base_text} {delta_text}")
+
+    quality = [(key, result) for key, result in results.items() if "psnr_db" in result]
+    if quality:
+        print(f"\n{'降分辨率阶段@分辨率@来源':48s} {'加速':>8s} {'PSNR(dB)':>10s}")
+        for key, result in quality:
+            name, rest = key.split("@", 1)
+            reference = results.get(f"{QUALITY_REFERENCE[name]}@{rest}")
+            speedup = f"{reference['median_ms'] / result['median_ms']:7.2f}x" if reference else f"{'-':>8s}"
+            print(f"{key:48s} {speedup} {result['psnr_db']:10.2f}")
+
+    report = {"machine": info, "created": time.strftime("%Y-%m-%d %H:%M:%S"), "results": results}
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"基准已保存到 {args.baseline}")
+
+    if args.check:
+        if not baseline:
+            print(f"没有可比较的基准 ({args.baseline})，请先使用 --save-baseline 记录")
+            return 2
+        if regressions:
+            print(f"\n{len(regressions)} 个阶段超过容差 {args.tolerance * 100:.0f}%:")
+            for key, base, current, delta in regressions:
+                print(f"  {key}: {base:.3f}ms -> {current:.3f}ms ({delta * 100:+.1f}%)")
+            return 1
+        print(f"\n所有阶段均在容差 {args.tolerance * 100:.0f}% 以内")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,205 @@
+"""摄像头服务的端到端功能检查
+
+以合成摄像头启动 camera_server.py，通过HTTP验证容易回归的行为，任一检查失败时返回非零退出码：
+  - worker-forward: 多进程模式下带查询串的GET（调试接口、/stats/history）和带JSON的POST经工作进程转发后，
+                    与单进程模式的结果一致
+  - camera-recovery: 注入连续捕获错误和初始化失败后经 running -> restarting -> running 恢复；
+                     捕获线程卡在摄像头调用中时监督线程不被阻塞，按退避重试（不直接进入failed），卡住结束后恢复
+
+用法:
+    python benchmarks/check_service.py                       # 全部检查
+    python benchmarks/check_service.py --checks worker-forward
+    python benchmarks/check_service.py --verbose             # 同时输出服务日志
+"""
+
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "camera_server.py")
+
+CHECKS = {}
+
+
+def check(name):
+    def register(function):
+        CHECKS[name] = function
+        return function
+    return register
+
+
+class CheckFailed(Exception):
+    pass
+
+
+def expect(condition, message):
+    if not condition:
+        raise CheckFailed(message)
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class Server:
+    """以合成摄像头运行的服务实例，退出with时终止（多进程模式下连同工作进程）"""
+
+    def __init__(self, verbose=False, **env):
+        self.port = free_port()
+        self.base_url = f"http://127.0.0.1:{self.port}"
+        self.env = dict(os.environ, CAMERA_SOURCE="synthetic", CAMERA_PORT=str(self.port), CAMERA_FRAME_BUS="0",
+                        CAMERA_CONTROL_SOCKET=f"/tmp/camera_check_{self.port}.sock")
+        self.env.update({key: str(value) for key, value in env.items()})
+        self.verbose = verbose
+        self.process = None
+
+    def __enter__(self):
+        output = None if self.verbose else subprocess.DEVNULL
+        self.process = subprocess.Popen([sys.executable, SERVER_PATH], env=self.env, stdout=output, stderr=output)
+        if self.wait_for_state("running", 30) is None:
+            self.__exit__(None, None, None)
+            raise CheckFailed("摄像头服务未就绪")
+        return self
+
+    def __exit__(self, *exc):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+            self.process.wait()
+
+    def request(self, path, method="GET", body=None, timeout=15):
+        """返回 (状态码, 解析后的JSON或文本)"""
+        data = json.dumps(body).encode() if body is not None else None
+        req = urllib.request.Request(self.base_url + path, data=data, method=method,
+                                     headers={"Content-Type": "application/json"} if data is not None else {})
+        try:
+            with urllib.request.urlopen(req, timeout=timeout) as response:
+                status, payload = response.status, response.read()
+        except urllib.error.HTTPError as e:
+            status, payload = e.code, e.read()
+        try:
+            return status, json.loads(payload)
+        except ValueError:
+            return status, payload.decode("utf-8", "replace")
+
+    def wait_for_state(self, state, timeout):
+        """等待 /status 的 camera_status 变为 state，返回状态快照，超时返回None"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            try:
+                status, body = self.request("/status", timeout=2)
+                if status == 200 and body.get("camera_status") == state:
+                    return body
+            except OSError:
+                pass
+            time.sleep(0.2)
+        return None
+
+
+# 带查询串的GET和带JSON的POST，两种模式下的状态码和关键字段应相同
+FORWARDED_REQUESTS = [
+    ("GET", "/debug/profile?seconds=0.5&top=3", None, lambda body: body.get("samples", 0) > 0),
+    ("GET", "/debug/resources?window=30", None, lambda body: "samples" in body),
+    ("GET", "/debug/light?window=%35", None, lambda body: "samples" in body),
+    ("GET", "/stats/history", None, lambda body: "fps" in body.get("metrics", {}).get("second", ())),
+    ("GET", "/stats/history?metric=fps,latency_ms&window=60&step=0", None,
+     lambda body: set(body.get("results", ())) == {"fps", "latency_ms"}),
+    ("GET", "/stats/history?metric=fps&window=3600", None, lambda body: body.get("step") == 12),
+    ("GET", "/stats/history?metric=unknown", None, lambda body: body.get("status") == "error"),
+    ("POST", "/set_night_vision_strength", {"strength": 0.7}, lambda body: body.get("strength") == 0.7),
+    ("POST", "/set_night_vision_strength", {"strength": 5}, lambda body: body.get("status") == "error"),
+]
+
+
+def run_forwarded_requests(server):
+    results = []
+    for method, path, body, valid in FORWARDED_REQUESTS:
+        status, payload = server.request(path, method, body)
+        expect(isinstance(payload, dict) and valid(payload), f"{method} {path} 返回 {status}: {str(payload)[:200]}")
+        results.append(status)
+    return results
+
+
+@check("worker-forward")
+def check_worker_forward(args):
+    with Server(args.verbose) as server:
+        expected = run_forwarded_requests(server)
+    with Server(args.verbose, CAMERA_WORKERS=2) as server:
+        # 每个请求发送多次，覆盖不同的工作进程
+        for _ in range(3):
+            actual = run_forwarded_requests(server)
+            expect(actual == expected, f"多进程模式状态码 {actual}，单进程模式 {expected}")
+
+
+def watch_camera_states(server, until, timeout):
+    """每0.1秒记录一次摄像头状态，直到 until(状态) 为真，返回 (经过的状态列表, 最后的状态)"""
+    states = []
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        # 捕获线程卡住时 /status 也必须及时应答
+        status, body = server.request("/status", timeout=2)
+        expect(status == 200, f"/status 返回 {status}")
+        camera = body["camera"]
+        if not states or states[-1] != camera["state"]:
+            states.append(camera["state"])
+        if until(camera):
+            return states, camera
+        time.sleep(0.1)
+    raise CheckFailed(f"{timeout}秒内未达到预期状态，经过的状态: {' -> '.join(states)}")
+
+
+@check("camera-recovery")
+def check_camera_recovery(args):
+    with Server(args.verbose, CAMERA_IDLE_MODE=0) as server:
+        recoveries = server.request("/status")[1]["camera"]["recovery_count"]
+
+        # 连续捕获错误触发重启，第一次重新初始化失败，按退避重试后恢复
+        server.request("/debug/inject_fault", "POST", {"fault": "init_fail", "count": 1})
+        server.request("/debug/inject_fault", "POST", {"fault": "error", "count": 6})
+        states, camera = watch_camera_states(
+            server, lambda c: c["state"] == "running" and c["recovery_count"] > recoveries, 30)
+        expect("restarting" in states, f"连续错误后未进入restarting: {' -> '.join(states)}")
+        recoveries = camera["recovery_count"]
+
+        # 捕获线程卡在摄像头调用中（持有摄像头锁）超过帧超时：监督线程不能跟着卡住，
+        # 卡住期间的初始化尝试按退避重试，未达到尝试次数上限前保持restarting，捕获线程恢复后重新初始化成功
+        server.request("/debug/inject_fault", "POST", {"fault": "stall", "seconds": 20})
+        states, camera = watch_camera_states(
+            server, lambda c: c["state"] == "running" and c["recovery_count"] > recoveries, 90)
+        expect(states[-2:] == ["restarting", "running"], f"卡住后的恢复过程: {' -> '.join(states)}")
+        expect("failed" not in states, f"卡住期间进入了failed: {' -> '.join(states)}")
+        expect(camera["recovery_count"] == recoveries + 1, f"恢复次数 {camera['recovery_count']}")
+
+
+def run(args):
+    names = args.checks.split(",") if args.checks else list(CHECKS)
+    unknown = [name for name in names if name not in CHECKS]
+    if unknown:
+        raise SystemExit(f"未知的检查: {', '.join(unknown)}，可选: {', '.join(CHECKS)}")
+    failures = 0
+    for name in names:
+        start = time.time()
+        try:
+            CHECKS[name](args)
+            print(f"{name:24s} 通过 ({time.time() - start:.1f}秒)")
+        except CheckFailed as e:
+            failures += 1
+            print(f"{name:24s} 失败: {e}")
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="摄像头服务的端到端功能检查")
+    parser.add_argument("--checks", help=f"逗号分隔的检查，默认全部: {', '.join(CHECKS)}")
+    parser.add_argument("--verbose", action="store_true", help="输出服务日志")
+    sys.exit(run(parser.parse_args()))
@@ -0,0 +1,457 @@
+"""摄像头服务多客户端压力测试
+
+以合成摄像头启动 camera_server.py（或连接已运行的实例），同时打开多个MJPEG、快照和WebSocket客户端，
+其中一部分MJPEG客户端限速以模拟慢速链路。输出JSON报告：
+  - 每个客户端实际收到的帧率、帧间隔抖动、延迟分位数（由 X-Frame-Timestamp 计算）、503拒绝次数
+  - 服务进程的CPU和RSS
+  - 按客户端类型汇总的结果
+
+用法:
+    python benchmarks/load_test.py --mjpeg 4 --slow 2 --snapshot 2 --ws 2 --duration 20
+    python benchmarks/load_test.py --mjpeg 8 --max-clients 8 --json report.json
+    python benchmarks/load_test.py --mjpeg 6 --env CAMERA_IDLE_MODE=0 --env CAMERA_H264=1   # 比较不同服务配置
+    python benchmarks/load_test.py --mjpeg 3 --control 4 --env CAMERA_WORKERS=2             # 多进程模式，CPU包含工作进程
+    python benchmarks/load_test.py --url http://树莓派IP:8000 --mjpeg 4                     # 测试已运行的实例（无服务端CPU数据）
+    python benchmarks/load_test.py --mjpeg 4 --topology default: \
+        --topology 'pinned:CAMERA_CPU_AFFINITY=capture=3;analysis=2;*=0-1|CAMERA_CV_THREADS=enhance=2;encode=1'
+                                                    # 依次运行多种线程拓扑（见 thread_tuning.py）并对比
+
+--topology 的格式为 "名称:变量=值|变量=值"，每种拓扑单独启动一次本地服务，报告中附带服务端
+/debug/threads 读回的实际亲和性和优先级。
+
+延迟基于服务端写入的采集时间，测试远程实例时要求两端时钟已同步。
+"""
+
+import argparse
+import json
+import os
+import statistics
+import struct
+import subprocess
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+try:
+    import simple_websocket
+except ImportError:
+    simple_websocket = None
+
+SERVER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "camera_server.py")
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK")
+# 与 camera_server.WS_FRAME_HEADER 一致: 采集时间戳, 上游延迟, 转发跳数, 过期标记
+WS_FRAME_HEADER = struct.Struct("<ddHB5x")
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class ClientStats:
+    """单个客户端的统计"""
+
+    def __init__(self, client_id, kind, rate_limit=None):
+        self.client_id = client_id
+        self.kind = kind
+        self.rate_limit = rate_limit
+        self.arrivals = []
+        self.latencies = []
+        self.bytes = 0
+        self.rejected = 0
+        self.errors = 0
+        self.stale = 0
+
+    def record(self, size, capture_time=None, stale=False):
+        now = time.time()
+        self.arrivals.append(now)
+        self.bytes += size
+        if capture_time:
+            self.latencies.append(now - capture_time)
+        if stale:
+            self.stale += 1
+
+    def report(self, duration):
+        intervals = [b - a for a, b in zip(self.arrivals, self.arrivals[1:])]
+        latencies_ms = [value * 1000 for value in self.latencies]
+        return {
+            "id": self.client_id,
+            "kind": self.kind,
+            "rate_limit_kbps": self.rate_limit / 1024 if self.rate_limit else None,
+            "frames": len(self.arrivals),
+            "fps": len(self.arrivals) / duration,
+            "kbytes_per_second": self.bytes / 1024 / duration,
+            "jitter_ms": statistics.pstdev(intervals) * 1000 if len(intervals) > 1 else None,
+            "max_gap_ms": max(intervals) * 1000 if intervals else None,
+            "latency_ms": {
+                "p50": percentile(latencies_ms, 0.5),
+                "p90": percentile(latencies_ms, 0.9),
+                "p99": percentile(latencies_ms, 0.99),
+                "max": max(latencies_ms) if latencies_ms else None
+            },
+            "stale_frames": self.stale,
+            "rejected_503": self.rejected,
+            "errors": self.errors
+        }
+
+
+def read_limited(response, length, rate_limit, stats_start):
+    """读取length字节；rate_limit为字节/秒时按该速率分块读取，模拟慢速链路"""
+    if not rate_limit:
+        return response.read(length)
+    chunks = []
+    remaining = length
+    chunk_size = max(1024, int(rate_limit / 20))
+    while remaining > 0:
+        chunk = response.read(min(chunk_size, remaining))
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+        stats_start[1] += len(chunk)
+        # 按累计字节数节流
+        ahead = stats_start[1] / rate_limit - (time.time() - stats_start[0])
+        if ahead > 0:
+            time.sleep(ahead)
+    return b"".join(chunks)
+
+
+def mjpeg_client(base_url, stats, stop_event):
+    while not stop_event.is_set():
+        try:
+            response = urllib.request.urlopen(f"{base_url}/video_feed", timeout=10)
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                stats.rejected += 1
+            else:
+                stats.errors += 1
+            time.sleep(1.0)
+            continue
+        except OSError:
+            stats.errors += 1
+            time.sleep(1.0)
+            continue
+
+        throttle = [time.time(), 0]
+        try:
+            while not stop_event.is_set():
+                line = response.readline()
+                if not line:
+                    break
+                if not line.startswith(b"--frame"):
+                    continue
+                headers = {}
+                while True:
+                    line = response.readline().strip()
+                    if not line:
+                        break
+                    key, _, value = line.partition(b":")
+                    headers[key.strip().lower()] = value.strip()
+                length = int(headers.get(b"content-length", 0))
+                if not length:
+                    continue
+                data = read_limited(response, length, stats.rate_limit, throttle)
+                capture_time = float(headers.get(b"x-frame-timestamp", 0) or 0)
+                stats.record(len(data), capture_time, headers.get(b"x-frame-stale") == b"1")
+        except OSError:
+            stats.errors += 1
+        finally:
+            response.close()
+
+
+def snapshot_client(base_url, stats, stop_event, interval):
+    while not stop_event.is_set():
+        start = time.time()
+        try:
+            with urllib.request.urlopen(f"{base_url}/snapshot.jpg", timeout=10) as response:
+                data = response.read()
+                capture_time = float(response.headers.get("X-Frame-Timestamp", 0) or 0)
+                stats.record(len(data), capture_time, response.headers.get("X-Frame-Stale") == "1")
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                stats.rejected += 1
+            else:
+                stats.errors += 1
+        except OSError:
+            stats.errors += 1
+        time.sleep(max(0.0, interval - (time.time() - start)))
+
+
+def control_client(base_url, stats, stop_event):
+    """不间断地请求 /status 和 /debug，模拟状态页面的突发请求；fps 为每秒完成的请求数"""
+    paths = ["/status", "/debug"]
+    index = 0
+    while not stop_event.is_set():
+        try:
+            with urllib.request.urlopen(f"{base_url}{paths[index % len(paths)]}", timeout=10) as response:
+                stats.record(len(response.read()))
+        except urllib.error.HTTPError as e:
+            if e.code == 503:
+                stats.rejected += 1
+            else:
+                stats.errors += 1
+        except OSError:
+            stats.errors += 1
+        index += 1
+
+
+def ws_client(base_url, stats, stop_event):
+    ws_url = base_url.replace("http://", "ws://", 1) + "/ws/video_feed"
+    while not stop_event.is_set():
+        try:
+            ws = simple_websocket.Client(ws_url)
+        except Exception:
+            stats.rejected += 1
+            time.sleep(1.0)
+            continue
+        try:
+            while not stop_event.is_set():
+                message = ws.receive(timeout=2.0)
+                if message is None:
+                    continue
+                capture_time, _, _, stale = WS_FRAME_HEADER.unpack_from(message)
+                stats.record(len(message) - WS_FRAME_HEADER.size, capture_time, bool(stale))
+        except simple_websocket.ConnectionClosed:
+            pass
+        except Exception:
+            stats.errors += 1
+        finally:
+            ws.close()
+
+
+def child_pids(pid):
+    children = []
+    for task in os.listdir(f"/proc/{pid}/task"):
+        try:
+            with open(f"/proc/{pid}/task/{task}/children", "r") as f:
+                children.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return children
+
+
+def read_process_usage(pid):
+    """返回服务进程及其子进程（多进程模式下的HTTP工作进程）合计的 (累计CPU秒数, RSS MB)"""
+    cpu, rss = read_single_process_usage(pid)
+    for child in child_pids(pid):
+        try:
+            child_cpu, child_rss = read_single_process_usage(child)
+        except OSError:
+            continue
+        cpu += child_cpu
+        rss += child_rss
+    return cpu, rss
+
+
+def read_single_process_usage(pid):
+    with open(f"/proc/{pid}/stat", "r") as f:
+        fields = f.read().rsplit(")", 1)[1].split()
+    cpu = (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    rss = 0.0
+    with open(f"/proc/{pid}/status", "r") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                rss = int(line.split()[1]) / 1024
+                break
+    return cpu, rss
+
+
+def monitor_server(pid, stop_event, samples, interval=1.0):
+    last_cpu, _ = read_process_usage(pid)
+    last_time = time.time()
+    while not stop_event.wait(interval):
+        try:
+            cpu, rss = read_process_usage(pid)
+        except OSError:
+            return
+        now = time.time()
+        samples.append({"cpu_percent": (cpu - last_cpu) / (now - last_time) * 100, "rss_mb": rss})
+        last_cpu, last_time = cpu, now
+
+
+def wait_until_ready(base_url, timeout):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{base_url}/status", timeout=2) as response:
+                status = json.load(response)
+            if status.get("camera_status") in ("running", "connected"):
+                return status
+        except (OSError, ValueError):
+            pass
+        time.sleep(0.3)
+    return None
+
+
+def fetch_json(url):
+    try:
+        with urllib.request.urlopen(url, timeout=2) as response:
+            return json.load(response)
+    except (OSError, ValueError):
+        return None
+
+
+def summarize(reports):
+    by_kind = {}
+    for report in reports:
+        by_kind.setdefault(report["kind"], []).append(report)
+    summary = {}
+    for kind, items in by_kind.items():
+        p90s = [item["latency_ms"]["p90"] for item in items if item["latency_ms"]["p90"] is not None]
+        summary[kind] = {
+            "clients": len(items),
+            "fps_mean": statistics.fmean(item["fps"] for item in items),
+            "fps_min": min(item["fps"] for item in items),
+            "latency_p90_ms_max": max(p90s) if p90s else None,
+            "rejected_503": sum(item["rejected_503"] for item in items),
+            "errors": sum(item["errors"] for item in items)
+        }
+    return summary
+
+
+def run(args, extra_env=None, write_json=True):
+    server = None
+    base_url = args.url.rstrip("/") if args.url else f"http://127.0.0.1:{args.port}"
+    env_overrides = dict(item.split("=", 1) for item in args.env)
+    env_overrides.update(extra_env or {})
+
+    if not args.url:
+        env = dict(os.environ, CAMERA_SOURCE="synthetic", CAMERA_PORT=str(args.port),
+                   CAMERA_MAX_CLIENTS=str(args.max_clients), CAMERA_FRAME_BUS="0")
+        env.update(env_overrides)
+        server = subprocess.Popen([sys.executable, SERVER_PATH], env=env,
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    try:
+        status = wait_until_ready(base_url, 30)
+        if status is None:
+            raise SystemExit("摄像头服务未就绪")
+
+        stop_event = threading.Event()
+        clients = []
+        threads = []
+
+        def start(kind, target, *extra, rate_limit=None):
+            stats = ClientStats(len(clients), kind, rate_limit)
+            clients.append(stats)
+            thread = threading.Thread(target=target, args=(base_url, stats, stop_event) + extra, daemon=True)
+            threads.append(thread)
+            thread.start()
+
+        for index in range(args.mjpeg):
+            slow = index < args.slow
+            start("mjpeg_slow" if slow else "mjpeg", mjpeg_client, rate_limit=args.slow_rate * 1024 if slow else None)
+        for _ in range(args.snapshot):
+            start("snapshot", snapshot_client, 1.0 / args.snapshot_rate)
+        for _ in range(args.control):
+            start("control", control_client)
+        if args.ws and simple_websocket is None:
+            print("未安装simple-websocket，跳过WebSocket客户端")
+        elif args.ws:
+            for _ in range(args.ws):
+                start("ws", ws_client)
+
+        server_samples = []
+        if server is not None:
+            threading.Thread(target=monitor_server, args=(server.pid, stop_event, server_samples), daemon=True).start()
+
+        start_time = time.time()
+        time.sleep(args.duration)
+        duration = time.time() - start_time
+        stop_event.set()
+        for thread in threads:
+            thread.join(timeout=3)
+
+        reports = [stats.report(duration) for stats in clients]
+        report = {
+            "config": {
+                "duration": duration,
+                "mjpeg": args.mjpeg, "slow": args.slow, "slow_rate_kbps": args.slow_rate,
+                "snapshot": args.snapshot, "snapshot_rate": args.snapshot_rate, "ws": args.ws,
+                "control": args.control,
+                "max_clients": args.max_clients if not args.url else None,
+                "env": env_overrides, "url": base_url
+            },
+            "server": {
+                "cpu_percent_mean": statistics.fmean(s["cpu_percent"] for s in server_samples) if server_samples else None,
+                "cpu_percent_max": max(s["cpu_percent"] for s in server_samples) if server_samples else None,
+                "rss_mb_max": max(s["rss_mb"] for s in server_samples) if server_samples else None
+            },
+            "summary": summarize(reports),
+            "clients": reports
+        }
+        report["server"]["thread_tuning"] = fetch_json(f"{base_url}/debug/threads")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    for kind, item in report["summary"].items():
+        latency = f"{item['latency_p90_ms_max']:.1f}ms" if item["latency_p90_ms_max"] is not None else "-"
+        print(f"{kind:11s} x{item['clients']:<3d} 平均 {item['fps_mean']:5.1f} fps, 最低 {item['fps_min']:5.1f} fps, "
+              f"p90延迟最大 {latency}, 503拒绝 {item['rejected_503']}, 错误 {item['errors']}")
+    if report["server"]["cpu_percent_mean"] is not None:
+        print(f"服务端 CPU 平均 {report['server']['cpu_percent_mean']:.1f}% (最高 {report['server']['cpu_percent_max']:.1f}%), "
+              f"RSS最高 {report['server']['rss_mb_max']:.1f}MB")
+
+    if args.json and write_json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+
+def compare_topologies(args):
+    """依次以每种线程拓扑启动服务运行同样的负载，输出对比表"""
+    reports = {}
+    for spec in args.topology:
+        name, _, env_spec = spec.partition(":")
+        extra_env = dict(item.split("=", 1) for item in env_spec.split("|") if item)
+        print(f"== {name} {extra_env or ''}")
+        reports[name] = run(args, extra_env, write_json=False)
+        print()
+
+    print(f"{'拓扑':12s} {'平均fps':>8s} {'最低fps':>8s} {'p90延迟':>9s} {'CPU平均':>8s} {'CPU最高':>8s} 调优错误")
+    for name, report in reports.items():
+        video = report["summary"].get("mjpeg") or report["summary"].get("ws") or {}
+        server = report["server"]
+        tuning = server.get("thread_tuning") or {}
+        latency = video.get("latency_p90_ms_max")
+
+        def number(value, unit=""):
+            return f"{value:.1f}{unit}" if value is not None else "-"
+        print(f"{name:12s} {number(video.get('fps_mean')):>8s} {number(video.get('fps_min')):>8s} "
+              f"{number(latency, 'ms'):>9s} {number(server['cpu_percent_mean'], '%'):>8s} "
+              f"{number(server['cpu_percent_max'], '%'):>8s} {len(tuning.get('errors', []))}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"topologies": reports}, f, indent=2)
+    return reports
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="摄像头服务多客户端压力测试")
+    parser.add_argument("--url", help="测试已运行的实例，不指定时以合成摄像头启动本地服务")
+    parser.add_argument("--port", type=int, default=8097)
+    parser.add_argument("--mjpeg", type=int, default=4, help="MJPEG客户端数")
+    parser.add_argument("--slow", type=int, default=0, help="其中限速的MJPEG客户端数")
+    parser.add_argument("--slow-rate", type=float, default=200.0, help="限速客户端的速率(KB/s)")
+    parser.add_argument("--snapshot", type=int, default=0, help="快照客户端数")
+    parser.add_argument("--snapshot-rate", type=float, default=2.0, help="每个快照客户端每秒请求数")
+    parser.add_argument("--ws", type=int, default=0, help="WebSocket客户端数")
+    parser.add_argument("--control", type=int, default=0, help="不间断请求 /status 和 /debug 的客户端数")
+    parser.add_argument("--max-clients", type=int, default=5, help="本地服务的 CAMERA_MAX_CLIENTS")
+    parser.add_argument("--env", action="append", default=[], help="传给本地服务的环境变量，如 CAMERA_IDLE_MODE=0")
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--topology", action="append", default=[],
+                        help="要对比的线程拓扑 \"名称:变量=值|变量=值\"，可重复；只对本地服务有效")
+    parser.add_argument("--json", help="把报告写入JSON文件")
+    args = parser.parse_args()
+    if args.topology and not args.url:
+        compare_topologies(args)
+    else:
+        run(args)
@@ -0,0 +1,118 @@
+"""传感器曝光控制的闭环仿真
+
+用合成摄像头（SyntheticCamera 的曝光模型）和 ExposureController 模拟光线从白天渐暗到夜间、
+再恢复到白天的过程，按仿真时间（不实际等待）输出帧率、曝光时间、增益、软件增益和画面亮度。
+传感器在收到新参数后延迟若干帧才生效，与真实摄像头一致。
+
+每个光线阶段结束时检查：
+  - 最终亮度（乘以软件增益后）与目标亮度相差不超过 --tolerance
+  - 白天阶段帧率不低于25fps（原来固定60000us曝光时只有约16fps）
+不满足时以非零状态退出。
+
+用法:
+    python benchmarks/sim_exposure.py
+    python benchmarks/sim_exposure.py --phases 1.0,0.3,0.05,0.01,0.3,1.0 --seconds 8 --latency 3
+"""
+
+import argparse
+import os
+import sys
+from collections import deque
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import camera_server as cs  # noqa: E402
+import exposure_control  # noqa: E402
+
+
+def make_camera(controller):
+    camera = cs.SyntheticCamera()
+    config = camera.create_video_configuration(main={"size": (320, 240), "format": "RGB888"},
+                                               controls={"FrameRate": 30.0})
+    config["controls"].update(controller.controls())
+    camera.configure(config)
+    camera.start()
+    return camera
+
+
+def run_phase(camera, controller, light, seconds, latency, clock, report_interval):
+    """运行一个光线阶段，返回 (仿真结束时间, 阶段最后一秒的统计)"""
+    camera.scene_light = light
+    camera.set_controls({})
+    pending = deque()
+    end = clock + seconds
+    next_report = clock
+    tail = []
+    while clock < end:
+        # 跳过合成摄像头的实时节流，仿真时间按当前帧率前进
+        camera.next_frame_time = 0
+        frame = camera.capture_array()
+        clock += 1.0 / camera.frame_rate
+        brightness = float(frame[::8, ::8].mean())
+
+        # 传感器在 latency 帧之后才应用新参数
+        while pending and pending[0][0] <= camera.frame_index:
+            camera.set_controls(pending.popleft()[1])
+        controls = controller.update(brightness, now=clock)
+        if controls is not None:
+            pending.append((camera.frame_index + latency, controls))
+
+        output = min(brightness * controller.software_gain, 255.0)
+        if clock >= end - 1.0:
+            tail.append((camera.frame_rate, output, controller.at_limit()))
+        if clock >= next_report:
+            next_report += report_interval
+            print(f"{clock:7.2f} {light:6.3f} {controller.profile:>6s} {camera.frame_rate:6.1f} "
+                  f"{int(controller.exposure):8d} {controller.gain:6.2f} {controller.software_gain:6.2f} "
+                  f"{brightness:7.1f} {output:7.1f}")
+    fps = sum(item[0] for item in tail) / len(tail)
+    output = sum(item[1] for item in tail) / len(tail)
+    return clock, {"light": light, "profile": controller.profile, "fps": fps, "output": output,
+                   "at_limit": all(item[2] for item in tail)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="传感器曝光控制闭环仿真")
+    parser.add_argument("--phases", default="1.0,0.2,0.05,0.01,0.002,0.01,0.05,0.2,1.0",
+                        help="逗号分隔的场景亮度序列，1.0为白天（同 CAMERA_SYNTHETIC_LIGHT）")
+    parser.add_argument("--seconds", type=float, default=6.0, help="每个阶段的仿真时长")
+    parser.add_argument("--latency", type=int, default=3, help="传感器应用新参数的延迟帧数")
+    parser.add_argument("--target", type=float, default=110.0)
+    parser.add_argument("--tolerance", type=float, default=0.15, help="允许的亮度相对误差")
+    parser.add_argument("--report", type=float, default=0.5, help="输出间隔(仿真秒)")
+    args = parser.parse_args()
+
+    cs.logger.setLevel("WARNING")
+    controller = exposure_control.ExposureController(target=args.target)
+    camera = make_camera(controller)
+
+    print(f"{'时间':>7s} {'光线':>6s} {'档案':>6s} {'帧率':>6s} {'曝光us':>8s} {'增益':>6s} {'软增益':>6s} "
+          f"{'原始亮度':>7s} {'输出亮度':>7s}")
+    clock = 0.0
+    summaries = []
+    for light in (float(v) for v in args.phases.split(",")):
+        clock, summary = run_phase(camera, controller, light, args.seconds, args.latency, clock, args.report)
+        summaries.append(summary)
+
+    print()
+    print(f"{'光线':>6s} {'档案':>6s} {'帧率':>6s} {'输出亮度':>8s} 结果")
+    failed = False
+    for summary in summaries:
+        problems = []
+        if summary["at_limit"]:
+            # 传感器和软件增益都已用满，光线不足以达到目标亮度
+            if summary["output"] > args.target * (1 + args.tolerance):
+                problems.append("增益已用满但画面过亮")
+        elif abs(summary["output"] - args.target) > args.target * args.tolerance:
+            problems.append("亮度未收敛")
+        if summary["profile"] == "day" and summary["fps"] < 25:
+            problems.append("白天帧率不足")
+        failed = failed or bool(problems)
+        print(f"{summary['light']:6.3f} {summary['profile']:>6s} {summary['fps']:6.1f} {summary['output']:8.1f} "
+              f"{'; '.join(problems) or ('OK(增益已用满)' if summary['at_limit'] else 'OK')}")
+    print(f"\n参数下发 {controller.updates} 次, 档案切换 {controller.profile_changes} 次")
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,37 +1,81 @@
+import time
+
+# 记录进程启动时间，用于统计冷启动耗时（开始监听、首个真实帧）
+process_start_time = time.time()
+
 from flask import Flask, Response, request
-from picamera2 import Picamera2
+from werkzeug.serving import make_server
 import cv2
-import time
 import threading
 import numpy as np
 import os
 import signal
 import sys
 import logging
+import math
 import socket
+import struct
 import subprocess
+import urllib.request
+from collections import deque
+from multiprocessing.connection import Client, Listener
+
+import band_parallel
+import exposure_control
+import frame_bus
+import light_estimation
+import log_pipeline
+import mjpeg_multicast
+import processing_graph
+import resource_monitor
+import sampling_profiler
+import stats_history
+import status_events
+import temporal_denoise
+import thread_tuning
+
+try:
+    import simple_websocket
+except ImportError:
+    simple_websocket = None
+
+# PyAV是可选依赖，未安装时不提供H.264流
+try:
+    import h264_stream
+except ImportError:
+    h264_stream = None
 
 # 使用当前用户的主目录
 home_dir = os.path.expanduser("~")
 log_file = os.path.join(home_dir, "camera_server.log")
+if os.environ.get("CAMERA_MODE") == "worker":
+    # 多进程模式下每个HTTP工作进程写自己的日志文件，避免多个进程同时轮转同一个文件
+    log_file = os.path.join(home_dir, f"camera_server_worker{os.environ.get('CAMERA_WORKER_INDEX', '0')}.log")
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.StreamHandler(),
-        logging.FileHandler(log_file)
-    ]
-)
+log_max_bytes = int(os.environ.get("CAMERA_LOG_MAX_BYTES", str(5 * 1024 * 1024)))  # 日志文件轮转大小
+log_backup_count = int(os.environ.get("CAMERA_LOG_BACKUPS", "3"))
+log_rate_burst = int(os.environ.get("CAMERA_LOG_BURST", "5"))            # 每个调用位置每个窗口最多输出的条数，0表示不限流
+log_rate_interval = float(os.environ.get("CAMERA_LOG_INTERVAL", "10"))    # 限流窗口(秒)
+
+# 日志经队列交给后台线程写入控制台和文件，捕获线程不会被SD卡写入阻塞（见 log_pipeline.py）
+log_pipe = log_pipeline.setup_logging(log_file, max_bytes=log_max_bytes, backup_count=log_backup_count,
+                                      burst=log_rate_burst, interval=log_rate_interval)
 logger = logging.getLogger('camera_server')
 
 app = Flask(__name__)
+# picamera2 会加载libcamera，导入较慢，改为在后台捕获线程中导入
+Picamera2 = None
 picam2 = None
 camera_lock = threading.Lock()
 running = True
 last_client_time = time.time()
 active_clients = 0
-max_clients = 5
+max_clients = int(os.environ.get("CAMERA_MAX_CLIENTS", "5"))
+server_port = int(os.environ.get("CAMERA_PORT", "8000"))
+# MJPEG流直接写入客户端socket（每帧一次send），关闭后经werkzeug的分块编码逐次写入
+mjpeg_direct_send = os.environ.get("CAMERA_MJPEG_DIRECT", "1") == "1"
+mjpeg_send_timeout = 10.0  # 直接发送时单次写入的超时(秒)，超时视为客户端已断开
+mjpeg_send_buffer = int(os.environ.get("CAMERA_MJPEG_SNDBUF", "65536"))  # 直接发送时的socket发送缓冲区，0为系统默认
 clients_lock = threading.Lock()
 health_check_interval = 30
 
@@ -39,29 +83,221 @@ health_check_interval = 30
 last_frame_time = 0
 frame_timeout = 5  # 5秒没有新帧就重启摄像头
 
+# 运行模式: "camera" 直接采集摄像头; "relay" 不打开摄像头，从上游实例订阅一次后转发给本机的客户端
+server_mode = os.environ.get("CAMERA_MODE", "camera")
+# 中继上游地址: http://主机:8000/video_feed (MJPEG), ws://主机:8000/ws/video_feed, bus://camera_processed (帧总线)
+relay_upstream = os.environ.get("CAMERA_RELAY_UPSTREAM", "")
+relay_stats = {
+    "state": "connecting",
+    "upstream": relay_upstream,
+    "frames": 0,
+    "reconnects": 0,
+    "hops": 0,           # 本节点距源头摄像头的转发次数
+    "last_error": ""
+}
+relay_hop_latencies = deque(maxlen=300)     # 本跳增加的延迟(秒)
+relay_origin_latencies = deque(maxlen=300)  # 从源头采集到本节点收到的延迟(秒)
+relay_reconnect_event = threading.Event()
+
+# 多进程模式: CAMERA_WORKERS>0 时本进程只负责采集、处理和编码，编码帧写入共享内存环（见 frame_bus.py），
+# 由本进程启动的N个HTTP工作进程（CAMERA_MODE=worker）共享监听端口提供服务，
+# 控制和状态类请求经本地Unix socket转发回采集进程执行
+worker_count = int(os.environ.get("CAMERA_WORKERS", "0"))
+control_socket_path = os.environ.get("CAMERA_CONTROL_SOCKET", "/tmp/camera_control.sock")
+control_authkey = bytes.fromhex(os.environ["CAMERA_CONTROL_KEY"]) if os.environ.get("CAMERA_CONTROL_KEY") else os.urandom(16)
+control_timeout = 90.0        # 等待采集进程应答的超时(秒)，需大于 /debug/profile 的最长分析时间
+encoded_ring_name = "camera_jpeg"
+encoded_ring_writer = None    # EncodedFrameWriter，多进程模式下由采集进程创建
+worker_processes = {}         # 工作进程序号 -> subprocess.Popen
+worker_reports = {}           # 工作进程PID -> 最近一次上报的状态
+worker_report_interval = 1.0  # 工作进程上报客户端数量的间隔(秒)
+status_cache_period = 1.0     # 工作进程缓存状态页应答的时间(秒)，突发的状态请求不会打到采集进程
+
+# /events 状态推送（见 status_events.py）：每个周期生成一次快照，所有订阅者共享同一份序列化结果
+events_interval = float(os.environ.get("CAMERA_EVENTS_INTERVAL", "1.0"))
+status_broadcaster = None
+ip_address_cache = {"ip": None, "time": 0.0}
+IP_ADDRESS_TTL = 60.0  # 网络重连后IP可能变化，定期重新获取
+STATUS_CACHED_PATHS = {"/status"}
+worker_status_cache = {}      # 路径 -> (缓存时间, 应答)
+# 工作进程本地处理的端点，其余请求转发给采集进程
+WORKER_LOCAL_ENDPOINTS = {"index", "video_feed", "snapshot", "ws_video_feed", "status_events_endpoint", "debug_info"}
+# 依赖采集进程内H.264编码器的持续流，无法按请求/应答转发
+WORKER_UNSUPPORTED_ENDPOINTS = {"h264_video_feed", "ws_h264_video_feed", "hls_playlist",
+                                "hls_init_segment", "hls_segment", "hls_part"}
+
+# WebSocket视频帧消息头: 采集时间戳, 上游节点的延迟, 转发跳数, 过期标记
+WS_FRAME_HEADER = struct.Struct("<ddHB5x")
+
+# 摄像头来源: "picamera2" 使用真实摄像头，"synthetic" 使用合成画面（无摄像头测试、压测）
+camera_source = os.environ.get("CAMERA_SOURCE", "picamera2")
+# 合成画面的场景亮度：1.0为白天（10ms曝光、增益1.0时画面正常），越小越暗；
+# 不设置时画面亮度不随曝光变化
+synthetic_scene_light = float(os.environ["CAMERA_SYNTHETIC_LIGHT"]) if os.environ.get("CAMERA_SYNTHETIC_LIGHT") else None
+SYNTHETIC_REFERENCE_EXPOSURE = 10000  # 场景亮度1.0时画面正常的 曝光时间(us) x 模拟增益
+SYNTHETIC_DAYLIGHT_LUX = 7000  # 场景亮度1.0时元数据中的Lux，与OV5647标定下合成画面的光线水平一致
+
+# 传感器曝光/增益自适应（见 exposure_control.py），关闭时使用固定的曝光时间和增益
+sensor_exposure_enabled = os.environ.get("CAMERA_SENSOR_EXPOSURE", "1") == "1"
+exposure_controller = exposure_control.ExposureController() if sensor_exposure_enabled else None
+
+# 摄像头生命周期状态机
+CAMERA_STARTING = "starting"
+CAMERA_RUNNING = "running"
+CAMERA_DEGRADED = "degraded"
+CAMERA_RESTARTING = "restarting"
+CAMERA_FAILED = "failed"
+camera_state = {
+    "state": CAMERA_STARTING,
+    "since": time.time(),
+    "consecutive_errors": 0,       # 连续捕获错误次数
+    "restart_attempts": 0,         # 本轮恢复中的初始化尝试次数
+    "next_retry_time": 0,          # 下次初始化尝试的时间
+    "recovery_count": 0,           # 成功恢复的次数
+    "recovery_started": None,      # 本轮恢复开始时间
+    "last_recovery_duration": 0.0, # 上次恢复耗时(秒)
+    "total_recovery_time": 0.0,    # 累计恢复耗时(秒)
+    "last_error": ""
+}
+camera_state_lock = threading.Lock()
+camera_restart_event = threading.Event()  # 通知监督线程重启摄像头
+camera_generation = 0              # 每次释放摄像头时递增，用于丢弃旧摄像头返回的帧
+detached_cameras = []              # 捕获线程卡在其调用中时被丢弃的摄像头，等捕获线程交还后再停止并关闭
+camera_error_threshold = 5         # 连续捕获错误达到此值时请求重启
+camera_backoff_initial = 1.0       # 初始退避时间(秒)
+camera_backoff_max = 60.0          # 最大退避时间(秒)
+camera_max_restart_attempts = 6    # 连续失败达到此值后进入failed状态
+camera_lock_timeout = 3.0          # 监督线程和档案切换等待camera_lock的最长时间(秒)，捕获线程卡住时不跟着卡住
+
+# 合成摄像头的故障注入配置，可通过环境变量 CAMERA_FAULTS 设置，
+# 例如 "init_fail=2,error_every=300,stall_every=1000,stall_seconds=8"
+synthetic_faults = {
+    "init_fail": 0,
+    "error_every": 0,
+    "stall_every": 0,
+    "stall_seconds": 8.0,
+    "pending_errors": 0,
+    "pending_stall": False
+}
+synthetic_faults_lock = threading.Lock()
+
+# 无客户端时的空闲模式：降低传感器帧率，跳过增强和编码，只保留光线检测和健康检查
+idle_mode_enabled = os.environ.get("CAMERA_IDLE_MODE", "1") == "1"
+idle_frame_rate = float(os.environ.get("CAMERA_IDLE_FPS", "5"))  # 空闲时的传感器帧率
+idle_enter_delay = 5.0  # 最后一个订阅者离开后等待多久进入空闲模式(秒)
+normal_frame_duration_limits = (33333, 60000)  # 正常工作时的帧间隔范围(微秒)，介于16-30fps
+
+# 采集档案：分辨率和目标帧率，可通过 /capture_profile 在运行时切换（原来固定为640x480@25）
+CAPTURE_PROFILES = {
+    "drive": {"size": (320, 240), "fps": 30.0},      # 遥控行驶，延迟和CPU占用最低
+    "standard": {"size": (640, 480), "fps": 25.0},
+    "inspect": {"size": (1296, 972), "fps": 10.0},   # 停车检查细节，OV5647的2x2合并全视场模式
+}
+# CAMERA_PROFILES 增加或覆盖档案，例如 "drive=424x240@30,hd=1280x720@15"
+for _item in filter(None, os.environ.get("CAMERA_PROFILES", "").split(",")):
+    _name, _spec = _item.split("=", 1)
+    _size, _fps = _spec.split("@")
+    CAPTURE_PROFILES[_name.strip()] = {"size": tuple(int(v) for v in _size.lower().split("x")), "fps": float(_fps)}
+capture_profile_name = os.environ.get("CAMERA_PROFILE", "standard")
+if capture_profile_name not in CAPTURE_PROFILES:
+    logger.warning(f"未知的采集档案 {capture_profile_name}，使用standard")
+    capture_profile_name = "standard"
+capture_profile_lock = threading.Lock()  # 串行化档案切换
+capture_profile_stats = {"switches": 0, "last_switch_ms": None, "last_error": ""}
+
+# 指定了固定尺寸（?size=WxH）的客户端：每个尺寸每帧只缩放编码一次，由请求该尺寸的所有客户端共享
+scaled_frames = {}  # (宽, 高) -> 缩放后的编码帧条目
+scaled_frames_lock = threading.Lock()
+MAX_CLIENT_SIZE = (1920, 1080)
+MAX_SCALED_SIZES = 4  # 同时缓存的缩放尺寸数
+idle_state = {
+    "idle": False,
+    "since": time.time(),
+    "last_subscriber_time": time.time(),
+    "idle_frames": 0,             # 空闲期间采集的帧数
+    "wakeups": 0,                 # 被订阅者唤醒的次数
+    "last_wake_latency": None     # 上次唤醒到新帧编码完成的耗时(秒)
+}
+idle_raw_frame = None  # 空闲模式下最近采集的原始帧 (帧, 采集时间)，订阅者到来时立即处理
+processing_lock = threading.Lock()  # 串行化帧处理和编码（捕获线程与空闲唤醒）
+
 # 监控摄像头性能的变量
-frame_times = []  # 用于FPS计算的帧时间列表
+frame_times = deque(maxlen=10)  # 最近10帧的时间，用于计算当前FPS
 fps_stats = {"current": 0, "min": 0, "max": 0, "avg": 0}
 stats_lock = threading.Lock()
-latest_frame = None  # 存储最新的帧
+latest_frame = None  # 存储最新的处理后帧（只读引用，用于生成过期标记帧和H.264编码）
+latest_frame_capture_time = None  # latest_frame的采集时间
 frame_lock = threading.Lock()  # 用于保护latest_frame
 
+# 共享内存帧总线，供同一台机器上的视觉程序零拷贝读取原始帧（见 frame_bus.py）；
+# 只在读取端的心跳不超过 idle_enter_delay 时复制帧，没有读取端时每帧只检查一次心跳
+frame_bus_enabled = os.environ.get("CAMERA_FRAME_BUS", "1") == "1"
+frame_bus_raw_enabled = os.environ.get("CAMERA_FRAME_BUS_RAW", "0") == "1"  # 是否同时发布未处理的帧
+frame_bus_slots = int(os.environ.get("CAMERA_FRAME_BUS_SLOTS", "4"))
+frame_bus_writers = {}  # 总线名称 -> FrameBusWriter
+
+# UDP组播分发（见 mjpeg_multicast.py），格式为 "组地址:端口"，为空时不启用
+multicast_target = os.environ.get("CAMERA_MULTICAST", "")
+multicast_ttl = int(os.environ.get("CAMERA_MULTICAST_TTL", "1"))
+multicast_interface = os.environ.get("CAMERA_MULTICAST_IF", "") or None
+multicast_stats = {}
+
+# H.264输出（见 h264_stream.py，需要PyAV），提供fMP4流和LL-HLS，比MJPEG节省大量带宽
+h264_enabled = os.environ.get("CAMERA_H264", "0") == "1"
+h264_bitrate = int(os.environ.get("CAMERA_H264_BITRATE", "800000"))
+h264_gop = int(os.environ.get("CAMERA_H264_GOP", "25"))               # 关键帧间隔(帧)，即HLS分段长度
+h264_part_frames = int(os.environ.get("CAMERA_H264_PART_FRAMES", "5"))  # 每个LL-HLS部分分段的帧数
+h264_max_segments = int(os.environ.get("CAMERA_H264_SEGMENTS", "6"))    # 内存中保留的HLS分段数
+h264_idle_timeout = 10.0  # 超过此时间没有H.264观看者时停止编码
+h264_streamer = None
+h264_last_access = 0.0
+
 # 用于控制图像处理复杂度的标志
 reduce_processing = False  # 默认使用完整处理
 processing_level = 1  # 默认中等处理级别
 max_processing_level = 2  # 最高处理级别
 previous_processing_level = 1  # 上一次的处理级别
 frame_counter = 0  # 帧计数器，用于控制处理频率
+# 增强夜视中CLAHE等低频处理的分辨率比例：固定数值(1.0/0.5/0.25)，或auto由adjust_performance按处理级别选择
+processing_scale_setting = os.environ.get("CAMERA_PROCESSING_SCALE", "auto")
+processing_scale_by_level = {0: 0.25, 1: 0.5, 2: 1.0}
+# 逐像素和小卷积核阶段按水平条带并行的线程数（含捕获线程本身），1为不拆分；条带不少于 band_min_rows 行
+band_threads = int(os.environ.get("CAMERA_BAND_THREADS", "1"))
+band_min_rows = int(os.environ.get("CAMERA_BAND_MIN_ROWS", "32"))
+# 线程的CPU亲和性、调度优先级和各处理阶段的OpenCV线程数（见 thread_tuning.py），
+# 由 CAMERA_CPU_AFFINITY、CAMERA_THREAD_PRIORITY、CAMERA_CV_THREADS 配置，未设置时不做任何调整
+thread_tuner = thread_tuning.ThreadTuner.from_env()
 
 # 内存和资源监控
-memory_usage_history = []  # 用于跟踪内存使用趋势
 last_memory_reset = time.time()  # 上次内存重置时间
 memory_reset_needed = False  # 是否需要重置内存
 resource_monitor_interval = 60  # 资源监控间隔(秒)
 last_resource_check = time.time()  # 上次资源检查时间
+resource_sample_interval = float(os.environ.get("CAMERA_RESOURCE_INTERVAL", "5"))  # 后台资源采样间隔(秒)
+resource_sampler = None  # ResourceSampler，在独立的低优先级线程中采样（见 resource_monitor.py）
+
+# 统计历史（见 stats_history.py）：逐帧的阶段耗时，逐秒/逐分钟的帧率、光线、运动、CPU、温度和发送流量，
+# 内存固定（默认约3.3MB，可保存7天的逐分钟历史），通过 /stats/history 查询；工作进程把查询转发给采集进程
+HISTORY_FRAME_METRICS = ("interval_ms", "process_ms", "encode_ms", "latency_ms", "jpeg_kb")
+HISTORY_SECOND_METRICS = ("light_level", "motion_ratio", "cpu_percent", "cpu_temp", "rss_mb", "sent_kbps", "clients")
+stats_history_store = stats_history.StatsHistory(HISTORY_FRAME_METRICS, HISTORY_SECOND_METRICS) \
+    if server_mode != "worker" else None
+last_history_frame_time = None  # 上一次记录逐帧样本的时间，用于计算帧间隔
+traffic_lock = threading.Lock()
+traffic_stats = {"bytes_sent": 0}  # 本进程发送给视频客户端的累计字节数（MJPEG、WebSocket、快照）
+# tracemalloc保留的调用栈层数，0表示不启用；启用后可通过 /debug/memory 查看内存增长来源
+tracemalloc_frames = int(os.environ.get("CAMERA_TRACEMALLOC", "0"))
+allocation_tracker = None
 last_fps_check = time.time()  # 上次FPS检查时间
 processing_adjustment_interval = 5  # 处理级别调整间隔
 
+# 冷启动统计
+service_start_time = process_start_time
+startup_stats = {
+    "time_to_listening": None,   # 从进程启动到HTTP开始监听的秒数
+    "time_to_first_frame": None  # 从进程启动到第一帧真实画面编码完成的秒数
+}
+
 # 缓存管理
 cached_frame = None
 cached_frame_time = 0
@@ -73,22 +309,27 @@ b_lut = np.clip(np.arange(0, 256) * 0.85, 0, 255).astype(np.uint8)  # 降低蓝
 r_lut = np.clip(np.arange(0, 256) * 1.05, 0, 255).astype(np.uint8)  # 轻微增强红色通道
 # 调整亮度和对比度以提高细节可见性但保持稳定
 alpha_beta_lut = np.clip(np.arange(0, 256) * 1.05 + 5, 0, 255).astype(np.uint8)
+# 先按通道调整再调整亮度对比度，合并后的逐通道查找表（BGR）
+color_adjust_lut = np.dstack([alpha_beta_lut[b_lut], alpha_beta_lut, alpha_beta_lut[r_lut]]).reshape(1, 256, 3)
 
 # 将已编码的帧缓存
 encoded_frames_cache = []
 encoded_frames_cache_lock = threading.Lock()
 frame_cache_size = 3
 frame_cache_index = 0
+encoded_frame_seq = 0  # 每编码一帧新画面递增
+frame_ready_condition = threading.Condition()  # 新帧编码完成时通知等待的发送线程
 
 # 添加时间戳缓存变量
 last_timestamp = ""
 last_timestamp_update = 0
 timestamp_update_interval = 1.0  # 时间戳每秒更新一次，但每帧都显示
 
-# 帧间平滑过渡变量
-previous_frame = None
-transition_alpha = 0.8  # 增加当前帧权重，减少前一帧权重以提高响应速度
-use_frame_blending = True  # 可以动态控制是否使用帧混合
+# 夜视时域降噪（见 temporal_denoise.py），替代标准/增强夜视模式中隔帧的高斯模糊
+temporal_denoise_enabled = os.environ.get("CAMERA_TEMPORAL_DENOISE", "1") == "1"
+temporal_denoise_alpha = float(os.environ.get("CAMERA_DENOISE_ALPHA", "0.25"))  # 当前帧权重，越小降噪越强
+temporal_denoise_scale = float(os.environ.get("CAMERA_DENOISE_SCALE", "1.0"))   # 降噪处理的分辨率比例
+night_denoiser = temporal_denoise.TemporalDenoiser(temporal_denoise_alpha, temporal_denoise_scale)
 
 # 创建一个固定的锐化核，避免每次重新计算
 sharpening_kernel = np.array([[-0.1, -0.1, -0.1],
@@ -114,6 +355,48 @@ last_motion_time = 0          # 上次检测到运动的时间
 reduced_processing_until = 0  # 降低处理复杂度直到此时间
 motion_detection_interval = 0.5  # 运动检测间隔(秒)
 motion_frame_buffer = None    # 用于运动检测的前一帧缓存
+motion_mask = None            # 最近一次运动检测得到的运动区域掩码，时域降噪用它重置运动区域
+last_motion_ratio = 0.0       # 最近一次运动检测中变化像素的比例
+
+# 低分辨率分析流：光线、运动和画面有效性检测只使用小尺寸的亮度图，在独立的分析线程中按
+# analysis_fps 运行，主画面只做增强和编码。摄像头提供lores流（YUV420）时直接取其亮度平面，
+# 否则（CAMERA_LORES_SIZE为空、传感器不支持）由主画面缩小得到
+lores_size_setting = os.environ.get("CAMERA_LORES_SIZE", "160x120")
+lores_size = tuple(int(v) for v in lores_size_setting.lower().split("x")) if lores_size_setting else None
+analysis_fps = float(os.environ.get("CAMERA_ANALYSIS_FPS", "10"))
+# 光线平滑和夜视切换确认按两次检测的实际间隔计算，改变 analysis_fps 不影响响应速度；
+# 数值等于原来每帧（25fps）检测一次时的 98%旧值+2%新值、连续5帧和连续3次确认
+LIGHT_SMOOTHING_TAU = 0.04 / -math.log(0.98)  # 光线水平指数平滑的时间常数，约2秒
+LIGHT_CONFIRM_SECONDS = 0.16                   # 平滑后的低光判断需持续多久才改变
+NIGHT_SWITCH_CONFIRM_SECONDS = 0.12            # 夜视开关前低光判断需持续多久
+DEFAULT_ANALYSIS_SIZE = (160, 120)  # 不使用lores流时由主画面缩小到的尺寸
+# lores流的YUV420为有限范围（亮度16-235），换算到与BGR转灰度一致的0-255，光线阈值才能通用
+LIMITED_TO_FULL_RANGE = np.clip((np.arange(256) - 16) * 255.0 / 219.0, 0, 255).round().astype(np.uint8)
+camera_has_lores = False      # 当前摄像头配置是否包含lores流
+lores_lock = threading.Lock()
+lores_event = threading.Event()  # 有新的分析用亮度图时通知分析线程
+lores_state = {"luma": None, "metadata": None, "seq": 0, "analyzed_seq": 0, "capture_time": None, "last_publish": 0.0}
+analysis_stats = {
+    "source": None,               # "sensor": 摄像头的lores流, "downscale": 由主画面缩小
+    "size": None,
+    "runs": 0,
+    "skipped": 0,                 # 分析线程来不及处理而被新图覆盖的次数
+    "last_ms": 0.0,
+    "avg_ms": 0.0,
+    "valid": None,                # 最近一次画面有效性检测结果
+    "invalid_frames": 0
+}
+
+# 光线水平的来源（见 light_estimation.py）："auto" 优先用元数据中的Lux，其次按实际曝光量换算分析流亮度，
+# 都不可用时退回像素统计；"exposure" 不使用Lux（镜头与调优文件的照度标定不符时）；"pixels" 为原来的像素统计
+light_source_setting = os.environ.get("CAMERA_LIGHT_SOURCE", "auto")
+light_estimator = light_estimation.LightEstimator(
+    lux_per_level=float(os.environ.get("CAMERA_LUX_PER_LEVEL", light_estimation.DEFAULT_LUX_PER_LEVEL)),
+    use_lux=light_source_setting == "auto") \
+    if light_source_setting != "pixels" else None
+light_history = deque(maxlen=3600)  # 光线检测的输入和判断，每秒最多一条，夜视切换时额外记录
+light_history_lock = threading.Lock()
+light_state = {"time": None, "level": None, "source": None, "inputs": {}, "last_record": 0.0}
 
 # 创建夜视模式查找表
 # 提高暗部和中间亮度区域，使暗处细节更加可见
@@ -122,10 +405,17 @@ night_mode_lut = np.clip(np.power(np.arange(0, 256) / 255.0, 0.7) * 255 + 15, 0,
 
 # 创建夜视静态缓存对象，避免重复创建
 night_vision_buffer = {
-    "green_mask": None,
-    "reduced": None,
-    "last_frame_shape": None,
-    "frames_since_reset": 0
+    "clahe": None,
+    "contrast": None  # apply_local_contrast 降分辨率处理的缓冲区
+}
+
+# 夜视处理在帧之间保持的状态：平滑过渡的亮度和绿色混合参数，以及当前的处理模式
+night_vision_state = {
+    "brightness_factor": 1.6,
+    "brightness_offset": 12,
+    "blend_factor": None,
+    "mode": "normal",            # simple、normal、enhanced，对应同名的处理图
+    "mode_change_time": time.time()
 }
 
 def signal_handler(sig, frame):
@@ -144,132 +434,593 @@ signal.signal(signal.SIGINT, signal_handler)
 signal.signal(signal.SIGTERM, signal_handler)
 
 def get_ip_address():
+    """本机IP地址(非回环地址)，缓存 IP_ADDRESS_TTL 秒，状态请求不必每次创建UDP套接字"""
+    now = time.time()
+    if ip_address_cache["ip"] is not None and now - ip_address_cache["time"] < IP_ADDRESS_TTL:
+        return ip_address_cache["ip"]
     try:
-        # 获取本机IP地址(非回环地址)
         s = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
         s.connect(("8.8.8.8", 80))
         ip = s.getsockname()[0]
         s.close()
-        return ip
     except Exception as e:
         logger.error(f"获取IP地址失败: {e}")
         return "127.0.0.1"
+    ip_address_cache.update(ip=ip, time=now)
+    return ip
+
+def load_camera_modules():
+    """在后台导入摄像头相关的重量级模块，避免阻塞HTTP服务启动"""
+    global Picamera2
+
+    if Picamera2 is not None:
+        return True
+
+    try:
+        import_start = time.time()
+        from picamera2 import Picamera2 as picamera2_class
+        Picamera2 = picamera2_class
+        logger.info(f"picamera2模块导入完成，耗时 {(time.time() - import_start)*1000:.0f}ms")
+        return True
+    except Exception as e:
+        logger.error(f"导入picamera2模块失败: {e}")
+        return False
+
+def create_placeholder_frame(message="Camera starting..."):
+    """生成占位帧JPEG，在摄像头预热完成前发送给客户端"""
+    frame = np.full((480, 640, 3), 40, dtype=np.uint8)
+    cv2.putText(frame, message, (150, 240), cv2.FONT_HERSHEY_SIMPLEX,
+                0.9, (255, 255, 255), 2, cv2.LINE_AA)
+    _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 70])
+    return buffer.tobytes()
+
+class SyntheticCamera:
+    """合成摄像头，接口与Picamera2保持一致，用于无摄像头环境下的测试和压测
+
+    支持通过 synthetic_faults 注入故障：
+      init_fail     - 接下来N次configure失败
+      error_every   - 每N帧抛出一次捕获异常
+      stall_every   - 每N帧卡住一次，持续 stall_seconds 秒
+      pending_errors / pending_stall - 由 /debug/inject_fault 注入的一次性故障
+
+    曝光模型：帧间隔不短于曝光时间；设置了场景亮度（CAMERA_SYNTHETIC_LIGHT）时，
+    画面亮度按 场景亮度 x 曝光时间 x 模拟增益 / SYNTHETIC_REFERENCE_EXPOSURE 缩放。
+    每次 set_controls 收到的参数记录在 control_log 中，便于检查曝光控制的行为。
+
+    capture_request() 与Picamera2一样返回同一帧的各个流和元数据：配置了lores流时，
+    lores为主画面缩小后的YUV420（I420，有限范围）图像；设置了场景亮度时元数据带有估计的 Lux。
+    """
+
+    def __init__(self):
+        self.size = (640, 480)
+        self.frame_rate = 25.0
+        self.configured_frame_rate = 25.0
+        self.frame_index = 0
+        self.started = False
+        self.next_frame_time = 0
+        self.base_frame = None
+        self.lores_size = None
+        self.controls = {}
+        self.control_log = deque(maxlen=1000)  # (时间, 本次收到的控制参数)
+        self.scene_light = synthetic_scene_light
+        self.exposure_factor = 1.0
+
+    def create_video_configuration(self, main=None, lores=None, buffer_count=4, controls=None, **kwargs):
+        return {"main": dict(main or {}), "lores": dict(lores) if lores else None,
+                "buffer_count": buffer_count, "controls": dict(controls or {})}
+
+    def configure(self, config):
+        with synthetic_faults_lock:
+            if synthetic_faults["init_fail"] > 0:
+                synthetic_faults["init_fail"] -= 1
+                raise RuntimeError("合成故障: 摄像头配置失败")
+        self.size = tuple(config["main"].get("size", self.size))
+        self.lores_size = tuple(config["lores"]["size"]) if config.get("lores") else None
+        self.controls.update(config.get("controls", {}))
+        self.configured_frame_rate = float(self.controls.get("FrameRate", self.frame_rate))
+        self.set_controls({})
+        width, height = self.size
+        # 预先生成渐变背景，每帧只绘制移动的方块
+        gradient = np.linspace(30, 200, width, dtype=np.uint8)
+        self.base_frame = np.dstack([np.tile(gradient, (height, 1))] * 3)
+
+    def set_controls(self, controls):
+        if controls:
+            self.control_log.append((time.time(), dict(controls)))
+        self.controls.update(controls)
+        # 与传感器一样，帧间隔不短于最短帧间隔和曝光时间，曝光时间受最长帧间隔限制
+        min_duration, max_duration = self.controls.get("FrameDurationLimits", (0, 0))
+        exposure = self.controls.get("ExposureTime", 0)
+        if max_duration and exposure > max_duration:
+            exposure = max_duration
+        duration = max(min_duration, exposure)
+        self.frame_rate = min(self.configured_frame_rate, 1e6 / duration) if duration else self.configured_frame_rate
+        if self.scene_light is None:
+            self.exposure_factor = 1.0
+        else:
+            self.exposure_factor = self.scene_light * (exposure or SYNTHETIC_REFERENCE_EXPOSURE) * \
+                self.controls.get("AnalogueGain", 1.0) / SYNTHETIC_REFERENCE_EXPOSURE
+
+    def start(self):
+        self.started = True
+        self.next_frame_time = time.time()
+
+    def stop(self):
+        self.started = False
+
+    def close(self):
+        self.started = False
+
+    def capture_array(self, name="main"):
+        if not self.started:
+            raise RuntimeError("合成摄像头未启动")
+
+        self.frame_index += 1
+        with synthetic_faults_lock:
+            error_every = synthetic_faults["error_every"]
+            stall_every = synthetic_faults["stall_every"]
+            inject_error = synthetic_faults["pending_errors"] > 0 or (error_every and self.frame_index % error_every == 0)
+            if synthetic_faults["pending_errors"] > 0:
+                synthetic_faults["pending_errors"] -= 1
+            inject_stall = synthetic_faults["pending_stall"] or (stall_every and self.frame_index % stall_every == 0)
+            synthetic_faults["pending_stall"] = False
+            stall_seconds = synthetic_faults["stall_seconds"]
+
+        if inject_stall:
+            time.sleep(stall_seconds)
+        if inject_error:
+            raise RuntimeError("合成故障: 捕获帧失败")
+
+        # 按目标帧率节流，模拟传感器出帧节奏
+        self.next_frame_time += 1.0 / self.frame_rate
+        delay = self.next_frame_time - time.time()
+        if delay > 0:
+            time.sleep(delay)
+        else:
+            self.next_frame_time = time.time()
+
+        if abs(self.exposure_factor - 1.0) > 0.01:
+            frame = cv2.convertScaleAbs(self.base_frame, alpha=self.exposure_factor)
+        else:
+            frame = self.base_frame.copy()
+        width, height = self.size
+        x = (self.frame_index * 4) % max(1, width - 60)
+        cv2.rectangle(frame, (x, height // 3), (x + 60, height // 3 + 60), (0, 0, 255), -1)
+        return frame
+
+    def capture_request(self):
+        frame = self.capture_array()
+        arrays = {"main": frame}
+        if self.lores_size is not None:
+            small = cv2.resize(frame, self.lores_size, interpolation=cv2.INTER_AREA)
+            arrays["lores"] = cv2.cvtColor(small, cv2.COLOR_BGR2YUV_I420)
+        metadata = {
+            "ExposureTime": self.controls.get("ExposureTime"),
+            "AnalogueGain": self.controls.get("AnalogueGain"),
+            "DigitalGain": 1.0,
+            "FrameDuration": int(1e6 / self.frame_rate),
+            "SensorTimestamp": int(time.monotonic() * 1e9)
+        }
+        if self.scene_light is not None:
+            metadata["Lux"] = self.scene_light * SYNTHETIC_DAYLIGHT_LUX
+        return SyntheticRequest(arrays, metadata)
+
+class SyntheticRequest:
+    """与Picamera2的CompletedRequest接口一致的已完成请求"""
+
+    def __init__(self, arrays, metadata):
+        self.arrays = arrays
+        self.metadata = metadata
+
+    def make_array(self, name="main"):
+        if name not in self.arrays:
+            raise RuntimeError(f"合成摄像头未配置{name}流")
+        return self.arrays[name]
+
+    def get_metadata(self):
+        return dict(self.metadata)
+
+    def release(self):
+        self.arrays = None
+
+def parse_camera_faults(spec):
+    """解析故障注入配置，例如 "init_fail=2,error_every=300" """
+    faults = {}
+    for item in spec.split(","):
+        if "=" not in item:
+            continue
+        key, value = item.split("=", 1)
+        key = key.strip()
+        if key in synthetic_faults:
+            faults[key] = float(value) if key == "stall_seconds" else int(value)
+    return faults
+
+def create_camera():
+    """根据配置创建摄像头对象"""
+    if camera_source == "synthetic":
+        return SyntheticCamera()
+    return Picamera2()
+
+def set_camera_state(new_state, error=None):
+    """切换摄像头生命周期状态，并维护恢复次数和耗时统计"""
+    now = time.time()
+    with camera_state_lock:
+        old_state = camera_state["state"]
+        if error is not None:
+            camera_state["last_error"] = str(error)
+        if old_state == new_state:
+            return
+
+        if new_state == CAMERA_RESTARTING and old_state in (CAMERA_RUNNING, CAMERA_DEGRADED):
+            camera_state["recovery_started"] = now
+            camera_state["restart_attempts"] = 0
+        elif new_state == CAMERA_RUNNING and camera_state["recovery_started"] is not None:
+            duration = now - camera_state["recovery_started"]
+            camera_state["recovery_count"] += 1
+            camera_state["last_recovery_duration"] = duration
+            camera_state["total_recovery_time"] += duration
+            camera_state["recovery_started"] = None
+            logger.info(f"摄像头已恢复，耗时 {duration:.2f}秒 (累计恢复 {camera_state['recovery_count']} 次)")
+
+        if new_state == CAMERA_RUNNING:
+            camera_state["consecutive_errors"] = 0
+            camera_state["restart_attempts"] = 0
+
+        camera_state["state"] = new_state
+        camera_state["since"] = now
+
+    logger.info(f"摄像头状态: {old_state} -> {new_state}")
+
+def get_camera_state():
+    """返回摄像头状态和恢复统计的副本"""
+    with camera_state_lock:
+        state = dict(camera_state)
+    state["state_duration"] = time.time() - state["since"]
+    state["next_retry_in"] = max(0.0, state["next_retry_time"] - time.time())
+    return state
+
+def request_camera_restart(reason):
+    """请求监督线程重启摄像头，立即返回，不阻塞调用线程"""
+    logger.warning(f"请求重启摄像头: {reason}")
+    with camera_state_lock:
+        camera_state["last_error"] = reason
+        camera_state["next_retry_time"] = 0  # 手动请求时跳过退避等待
+    camera_restart_event.set()
+
+def note_capture_error(error):
+    """记录一次捕获错误，连续错误过多时请求重启"""
+    with camera_state_lock:
+        camera_state["consecutive_errors"] += 1
+        errors = camera_state["consecutive_errors"]
+        state = camera_state["state"]
+
+    if state == CAMERA_RUNNING:
+        set_camera_state(CAMERA_DEGRADED, error)
+    if errors >= camera_error_threshold and state in (CAMERA_RUNNING, CAMERA_DEGRADED):
+        request_camera_restart(f"连续 {errors} 次捕获失败: {error}")
+
+def note_capture_success():
+    """记录一次成功捕获，降级状态下恢复为运行状态"""
+    with camera_state_lock:
+        camera_state["consecutive_errors"] = 0
+        state = camera_state["state"]
+    if state == CAMERA_DEGRADED:
+        set_camera_state(CAMERA_RUNNING)
+
+def publish_stale_frame(message="RECOVERING"):
+    """在恢复期间给最后一帧好画面加上过期标记，客户端继续收到画面而不是断流"""
+    with frame_lock:
+        frame = latest_frame
+
+    if frame is None:
+        return
+
+    try:
+        stale = frame.copy()
+        h, w = stale.shape[:2]
+        cv2.rectangle(stale, (0, 0), (w - 1, h - 1), (0, 0, 255), 4)
+        cv2.putText(stale, message, (10, h - 15), cv2.FONT_HERSHEY_SIMPLEX,
+                    0.7, (0, 0, 255), 2, cv2.LINE_AA)
+        _, buffer = cv2.imencode('.jpg', stale, [cv2.IMWRITE_JPEG_QUALITY, 85])
+
+        store_encoded_frame(buffer.tobytes(), stale=True)
+    except Exception as e:
+        logger.error(f"生成过期标记帧出错: {e}")
+
+def close_camera(camera):
+    """停止并关闭摄像头对象，释放传感器，调用方须确保没有其他线程正在使用它"""
+    try:
+        camera.stop()
+    except Exception as e:
+        logger.error(f"停止摄像头时出错: {e}")
+    try:
+        camera.close()
+        logger.info("摄像头已停止并关闭")
+    except Exception as e:
+        logger.error(f"关闭摄像头时出错: {e}")
+
+def close_detached_cameras():
+    """关闭之前因捕获线程卡住而丢弃的摄像头，须在持有camera_lock时调用（此时捕获线程已不在摄像头调用中）"""
+    while detached_cameras:
+        close_camera(detached_cameras.pop())
+
+def stop_camera():
+    """停止并释放当前摄像头
+
+    捕获线程可能卡在capture_request中并持有camera_lock，因此只等待有限时间。
+    超时后只丢弃引用，不在其他线程正在调用的对象上stop/close；
+    旧摄像头放入 detached_cameras，捕获线程返回后由下一个拿到camera_lock的线程关闭。
+    """
+    global picam2, camera_generation
+
+    if not camera_lock.acquire(timeout=2.0):
+        logger.warning("等待摄像头锁超时，捕获线程可能已卡住，丢弃摄像头，待捕获线程返回后再关闭")
+        camera = picam2
+        picam2 = None
+        camera_generation += 1
+        if camera is not None:
+            detached_cameras.append(camera)
+        return
+    try:
+        close_detached_cameras()
+        camera = picam2
+        picam2 = None
+        camera_generation += 1
+        if camera is not None:
+            close_camera(camera)
+    finally:
+        camera_lock.release()
 
 def reset_camera():
-    """重置摄像头，在出现问题时调用"""
-    global picam2
-    logger.warning("正在重置摄像头...")
+    """重置摄像头，在出现问题时调用
+
+    只向监督线程发送重启请求，实际的停止与重新初始化在后台完成。
+    中继模式下没有摄像头，改为重新连接上游。
+    """
+    if server_mode == "relay":
+        relay_reconnect_event.set()
+        return True
+    request_camera_restart("手动重置")
+    return True
+
+def capture_frame_duration_limits():
+    """当前采集档案下正常工作的帧间隔范围(微秒)，不短于档案目标帧率对应的帧间隔"""
+    if exposure_controller is not None:
+        return exposure_controller.frame_duration_limits()
+    shortest = int(1e6 / CAPTURE_PROFILES[capture_profile_name]["fps"])
+    return (max(normal_frame_duration_limits[0], shortest), max(normal_frame_duration_limits[1], shortest))
+
+def configure_camera(camera):
+    """按当前采集档案配置摄像头（未启动状态），返回配置是否包含lores流"""
+    profile = CAPTURE_PROFILES[capture_profile_name]
+    if exposure_controller is not None:
+        exposure_controller.set_min_frame_duration(1e6 / profile["fps"])
     
-    with camera_lock:
-        if picam2 is not None:
-            try:
-                picam2.stop()
-                logger.info("摄像头已停止")
-            except Exception as e:
-                logger.error(f"停止摄像头时出错: {e}")
-            finally:
-                picam2 = None
+    # 针对OV5647摄像头特性优化的配置
+    config = camera.create_video_configuration(
+        main={
+            "size": profile["size"],
+            "format": "RGB888"
+        },
+        # 分析用的低分辨率流，只使用其亮度平面
+        lores={"size": lores_size, "format": "YUV420"} if lores_size else None,
+        buffer_count=6,  # 对于4GB内存的树莓派，使用6而不是8更合适
+        controls={
+            "FrameDurationLimits": capture_frame_duration_limits(),  # 不短于档案目标帧率的帧间隔
+            "AwbEnable": True,      # 保持自动白平衡
+            "AwbMode": 1,           # 使用日光模式
+            "Brightness": 0.12,     # 稍微提高默认亮度，对OV5647夜视有帮助
+            "Contrast": 1.1,        # 适度增加对比度
+            "Saturation": 1.0,      # 使用标准饱和度
+            "Sharpness": 1.0,       # 使用标准锐度
+            "NoiseReductionMode": 2,  # 增强降噪
+            "FrameRate": profile["fps"],  # 档案的目标帧率
+            "ExposureTime": 60000,  # 更长的曝光时间，OV5647在低光下需要这个
+            "AnalogueGain": 6.0     # OV5647适用的模拟增益
+        }
+    )
+    if exposure_controller is not None:
+        # 由曝光控制器决定曝光时间、增益和帧间隔，重启摄像头或切换档案时沿用收敛后的参数
+        config["controls"].update(exposure_controller.controls())
     
-    # 等待一段时间再重新初始化
-    time.sleep(2)
-    return init_camera()
+    # configure是同步调用，无需额外等待
+    try:
+        camera.configure(config)
+    except Exception as e:
+        if config.get("lores") is None:
+            raise
+        # 传感器/ISP不支持该lores配置时退回到由主画面缩小
+        logger.warning(f"摄像头不支持lores流 {lores_size}，分析改用主画面缩小: {e}")
+        config["lores"] = None
+        camera.configure(config)
+    return config.get("lores") is not None
 
 def init_camera():
-    global picam2, last_frame_time
+    """初始化摄像头，单次尝试；重试和退避由 camera_supervisor 负责"""
+    global picam2, last_frame_time, camera_has_lores
     try:
         if picam2 is not None:
-            try:
-                picam2.stop()
-            except:
-                pass
-            picam2 = None
+            stop_camera()
             
-        attempts = 0
         logger.info("初始化摄像头...")
         
-        for attempt in range(3):  # 尝试3次
+        if camera_source != "synthetic" and not load_camera_modules():
+            return False
+        
+        camera = None
+        try:
+            camera = create_camera()
+            
+            # 初始化夜视模式设置
+            global night_vision_enabled, night_vision_auto
             try:
-                picam2 = Picamera2()
-                
-                # 针对OV5647摄像头特性优化的配置
-                config = picam2.create_video_configuration(
-                    main={
-                        "size": (640, 480),
-                        "format": "RGB888"
-                    },
-                    buffer_count=6,  # 对于4GB内存的树莓派，使用6而不是8更合适
-                    controls={
-                        "FrameDurationLimits": (33333, 60000),  # 更宽松的帧率限制，介于16-30fps
-                        "AwbEnable": True,      # 保持自动白平衡
-                        "AwbMode": 1,           # 使用日光模式
-                        "Brightness": 0.12,     # 稍微提高默认亮度，对OV5647夜视有帮助
-                        "Contrast": 1.1,        # 适度增加对比度
-                        "Saturation": 1.0,      # 使用标准饱和度
-                        "Sharpness": 1.0,       # 使用标准锐度
-                        "NoiseReductionMode": 2,  # 增强降噪
-                        "FrameRate": 25.0,      # 稍低的目标帧率，更适合稳定性
-                        "ExposureTime": 60000,  # 更长的曝光时间，OV5647在低光下需要这个
-                        "AnalogueGain": 6.0     # OV5647适用的模拟增益
-                    }
-                )
-                
-                # 初始化夜视模式设置
-                global night_vision_enabled, night_vision_auto
-                try:
-                    night_vision_enabled = True  # 默认启用夜视功能
-                    night_vision_auto = True     # 默认为自动模式
-                    logger.info("夜视功能已初始化")
-                except Exception as e:
-                    logger.warning(f"初始化夜视功能时出错: {e}")
-                
-                picam2.configure(config)
-                time.sleep(0.5)
-                
-                # 启动摄像头
-                picam2.start()
-                logger.info(f"摄像头初始化成功 (尝试 {attempt+1}/3)")
-                
-                # 丢弃前几帧
-                for _ in range(10):  # 增加丢弃帧数
-                    picam2.capture_array()
-                    time.sleep(0.05)  # 稍微延长间隔，给OV5647更多时间稳定
-                
-                return True
-                
+                night_vision_enabled = True  # 默认启用夜视功能
+                night_vision_auto = True     # 默认为自动模式
+                logger.info("夜视功能已初始化")
             except Exception as e:
-                logger.error(f"摄像头初始化尝试 {attempt+1}/3 失败: {e}")
-                if picam2 is not None:
-                    try:
-                        picam2.stop()
-                    except:
-                        pass
-                    picam2 = None
-                time.sleep(2)
-        
-        return False
+                logger.warning(f"初始化夜视功能时出错: {e}")
+            
+            lores_configured = configure_camera(camera)
+            
+            # 启动摄像头
+            camera.start()
+            
+            # 丢弃前几帧，让OV5647的自动曝光和白平衡收敛
+            # capture_array会阻塞到下一帧，无需额外休眠
+            for _ in range(10):
+                camera.capture_array()
+            
+            # 空闲期间重启摄像头时保持空闲帧率
+            if idle_state["idle"]:
+                camera.set_controls({"FrameDurationLimits": (int(1e6 / idle_frame_rate),) * 2})
+            
+            # 捕获线程卡在旧摄像头的调用中时一直持有camera_lock，不能无限等待，
+            # 否则监督线程随之卡住，状态停在restarting，也不再重试
+            # 失败时状态保持restarting，由监督线程的退避和尝试次数决定何时进入failed
+            if not camera_lock.acquire(timeout=camera_lock_timeout):
+                close_camera(camera)
+                logger.error(f"等待摄像头锁超时，捕获线程仍卡在上一个摄像头的调用中，"
+                             f"{camera_lock_timeout:g}秒内未释放摄像头锁，稍后重试")
+                return False
+            try:
+                close_detached_cameras()
+                picam2 = camera
+                camera_has_lores = lores_configured
+                last_frame_time = time.time()
+            finally:
+                camera_lock.release()
+            analysis_stats["source"] = "sensor" if lores_configured else "downscale"
+            analysis_stats["size"] = lores_size or DEFAULT_ANALYSIS_SIZE
+            profile = CAPTURE_PROFILES[capture_profile_name]
+            logger.info(f"摄像头初始化成功 (采集档案 {capture_profile_name}: "
+                        f"{profile['size'][0]}x{profile['size'][1]}@{profile['fps']:g})")
+            return True
+            
+        except Exception as e:
+            logger.error(f"摄像头初始化失败: {e}")
+            if camera is not None:
+                close_camera(camera)
+            return False
         
     except Exception as e:
         logger.error(f"初始化摄像头过程中发生错误: {e}")
         return False
 
-def adjust_colors_fast(frame):
-    """使用查找表快速调整颜色"""
+def switch_capture_profile(name):
+    """切换采集档案（分辨率和帧率），返回 (是否成功, 说明)
+
+    持有camera_lock在原摄像头对象上 stop/configure/start，捕获线程在此期间等待，不重新创建
+    摄像头也不经过监督线程的重启流程；MJPEG/WebSocket客户端的连接保持不变，切换期间继续等待
+    下一帧。与画面尺寸相关的缓冲区随后丢弃，由下一帧按新尺寸重新分配。
+    摄像头未运行时只记录档案，下次初始化时生效。
+    """
+    global capture_profile_name, camera_has_lores, last_frame_time
+    if name not in CAPTURE_PROFILES:
+        return False, f"未知的采集档案: {name}"
+    
+    with capture_profile_lock:
+        previous = capture_profile_name
+        if name == previous:
+            return True, f"已是采集档案 {name}"
+        capture_profile_name = name
+        profile = CAPTURE_PROFILES[name]
+        start = time.time()
+        if not camera_lock.acquire(timeout=camera_lock_timeout):
+            capture_profile_name = previous
+            capture_profile_stats["last_error"] = "摄像头锁等待超时"
+            logger.error(f"切换采集档案 {previous} -> {name} 失败: 捕获线程未释放摄像头锁")
+            return False, "摄像头忙（捕获线程未释放摄像头锁），请稍后重试"
+        try:
+            camera = picam2
+            if camera is not None:
+                camera.stop()
+                lores_configured = configure_camera(camera)
+                camera.start()
+                if idle_state["idle"]:
+                    camera.set_controls({"FrameDurationLimits": (int(1e6 / idle_frame_rate),) * 2})
+                camera_has_lores = lores_configured
+                # 重新配置期间没有出帧，避免被监督线程判为帧超时
+                last_frame_time = time.time()
+        except Exception as e:
+            # 原摄像头对象状态未知，恢复原档案后交给监督线程完整重启
+            capture_profile_name = previous
+            capture_profile_stats["last_error"] = str(e)
+            logger.error(f"切换采集档案 {previous} -> {name} 失败: {e}")
+            request_camera_restart(f"切换采集档案失败: {e}")
+            return False, f"切换采集档案失败: {e}"
+        finally:
+            camera_lock.release()
+        
+        if camera is not None:
+            analysis_stats["source"] = "sensor" if lores_configured else "downscale"
+        reset_frame_shape_buffers()
+        elapsed_ms = (time.time() - start) * 1000
+        capture_profile_stats["switches"] += 1
+        capture_profile_stats["last_switch_ms"] = round(elapsed_ms, 1)
+        capture_profile_stats["last_error"] = ""
+    
+    message = f"采集档案 {previous} -> {name} ({profile['size'][0]}x{profile['size'][1]}@{profile['fps']:g})"
+    logger.info(f"{message}，耗时 {elapsed_ms:.0f}ms" if camera is not None else f"{message}，摄像头未运行，下次初始化时生效")
+    return True, message
+
+def camera_supervisor():
+    """摄像头生命周期监督线程
+
+    状态机: starting/restarting -> running <-> degraded -> restarting -> ... -> failed
+    初始化失败时按指数退避重试；连续失败达到上限后进入failed状态，
+    之后仍以最大退避间隔继续尝试，手动重置可立即重试。
+    """
+    logger.info("摄像头监督线程已启动")
+    
+    while running:
+        try:
+            state = get_camera_state()
+            
+            if state["state"] in (CAMERA_RUNNING, CAMERA_DEGRADED):
+                # 检查帧超时，捕获线程卡住时也能触发恢复
+                if time.time() - last_frame_time > frame_timeout:
+                    request_camera_restart(f"帧超时 ({time.time() - last_frame_time:.1f}秒没有新帧)")
+                
+                if camera_restart_event.wait(timeout=0.5):
+                    camera_restart_event.clear()
+                    set_camera_state(CAMERA_RESTARTING)
+                    publish_stale_frame()
+                    stop_camera()
+                continue
+            
+            # starting / restarting / failed：到达重试时间后尝试初始化
+            if state["next_retry_in"] > 0:
+                if camera_restart_event.wait(timeout=min(state["next_retry_in"], 0.5)):
+                    camera_restart_event.clear()
+                continue
+            camera_restart_event.clear()
+            
+            if init_camera():
+                set_camera_state(CAMERA_RUNNING)
+                continue
+            
+            with camera_state_lock:
+                camera_state["restart_attempts"] += 1
+                attempts = camera_state["restart_attempts"]
+                backoff = min(camera_backoff_initial * (2 ** (attempts - 1)), camera_backoff_max)
+                camera_state["next_retry_time"] = time.time() + backoff
+            
+            if attempts >= camera_max_restart_attempts:
+                set_camera_state(CAMERA_FAILED, f"连续 {attempts} 次初始化失败")
+            logger.warning(f"摄像头初始化失败 (第 {attempts} 次)，{backoff:.1f}秒后重试")
+            
+        except Exception as e:
+            logger.error(f"摄像头监督线程错误: {e}")
+            time.sleep(1)
+
+def adjust_colors_fast(frame, dst=None):
+    """使用查找表快速调整颜色，dst 为可选的输出数组"""
     try:
         if frame is None or frame.size == 0:
             return None
             
-        # 使用OpenCV的split/LUT/merge操作，这些操作经过高度优化
-        b, g, r = cv2.split(frame)
-        b = cv2.LUT(b, b_lut)
-        r = cv2.LUT(r, r_lut)
-        
-        # 使用优化的合并操作
-        adjusted = cv2.merge([b, g, r])
-        
-        # 使用查找表进行亮度和对比度调整，避免逐像素计算
-        adjusted = cv2.LUT(adjusted, alpha_beta_lut)
-        
-        return adjusted
+        # 通道系数和亮度对比度合并为一张逐通道查找表，一次查表完成，不再拆分和合并通道
+        return cv2.LUT(frame, color_adjust_lut, dst=dst)
     except Exception as e:
         logger.error(f"快速颜色调整出错: {e}")
         return frame
@@ -291,33 +1042,52 @@ def apply_sharpening(frame):
         logger.error(f"锐化处理出错: {e}")
         return frame
 
-def detect_low_light(frame):
-    """超级简化的低光检测算法 - 专注于稳定性和可靠性，增强防闪烁效果"""
+def measure_light_level(frame):
+    """像素统计的光线水平：中心区域的平均亮度，换算到参考曝光下"""
+    # 取中心区域进行分析，减少计算量并关注主体区域
+    h, w = frame.shape[:2]
+    center_y, center_x = h // 2, w // 2
+    size = min(h, w) // 4  # 取中心1/4区域
+    
+    center_roi = frame[center_y-size:center_y+size, center_x-size:center_x+size]
+    
+    # 直接转灰度后计算平均亮度 - 最简单可靠的方法（分析流的亮度图无需转换）
+    gray = center_roi if center_roi.ndim == 2 else cv2.cvtColor(center_roi, cv2.COLOR_BGR2GRAY)
+    avg_brightness = np.mean(gray)
+    if exposure_controller is not None:
+        # 传感器曝光随光线变化，换算到参考曝光下的亮度，光线阈值保持原来的含义
+        avg_brightness *= exposure_controller.brightness_scale()
+    return avg_brightness
+
+def detect_low_light(frame, level=None):
+    """超级简化的低光检测算法 - 专注于稳定性和可靠性，增强防闪烁效果
+
+    level 为已由元数据估计出的光线水平，为None时从画面像素统计
+    """
     global last_light_level, light_threshold
     
     try:
-        if frame is None or frame.size == 0:
-            return False
-            
-        # 取中心区域进行分析，减少计算量并关注主体区域
-        h, w = frame.shape[:2]
-        center_y, center_x = h // 2, w // 2
-        size = min(h, w) // 4  # 取中心1/4区域
-        
-        center_roi = frame[center_y-size:center_y+size, center_x-size:center_x+size]
-        
-        # 直接转灰度后计算平均亮度 - 最简单可靠的方法
-        gray = cv2.cvtColor(center_roi, cv2.COLOR_BGR2GRAY)
-        avg_brightness = np.mean(gray)
+        if level is None:
+            if frame is None or frame.size == 0:
+                return False
+            level = measure_light_level(frame)
+        avg_brightness = level
+        detect_low_light.last_level = level
         
         # 添加更强的平滑，确保稳定过渡
+        now = time.time()
         if not hasattr(detect_low_light, 'smooth_brightness'):
             detect_low_light.smooth_brightness = avg_brightness
             detect_low_light.last_result = False
-            detect_low_light.stability_counter = 0
+            detect_low_light.unstable_since = None
+            detect_low_light.last_time = now
+            detect_low_light.calls = 0
+        detect_low_light.calls += 1
         
-        # 使用更长时间的历史平滑，98%旧值+2%新值，确保超级平稳的过渡
-        detect_low_light.smooth_brightness = detect_low_light.smooth_brightness * 0.98 + avg_brightness * 0.02
+        # 时间常数约2秒的指数平滑，新值的权重按距上次检测的时间计算，与检测频率无关
+        alpha = 1.0 - math.exp(-(now - detect_low_light.last_time) / LIGHT_SMOOTHING_TAU)
+        detect_low_light.last_time = now
+        detect_low_light.smooth_brightness += (avg_brightness - detect_low_light.smooth_brightness) * alpha
         
         last_light_level = detect_low_light.smooth_brightness
         
@@ -328,20 +1098,19 @@ def detect_low_light(frame):
         # 初步判断
         is_low_light_current = detect_low_light.smooth_brightness < current_threshold
         
-        # 状态稳定性增强 - 只有当连续多帧判断结果相同时才改变状态
+        # 状态稳定性增强 - 只有当新的判断结果持续一段时间才改变状态
         if is_low_light_current == detect_low_light.last_result:
-            # 判断结果一致，重置计数器
-            detect_low_light.stability_counter = 0
-        else:
-            # 判断结果不一致，增加计数器
-            detect_low_light.stability_counter += 1
-            # 需要至少5帧一致的判断才改变状态 - 进一步减少频繁切换
-            if detect_low_light.stability_counter >= 5:
-                detect_low_light.last_result = is_low_light_current
-                detect_low_light.stability_counter = 0
-        
-        # 减少日志频率，每90帧记录一次
-        if frame_counter % 90 == 0:
+            # 判断结果一致，重新计时
+            detect_low_light.unstable_since = None
+        elif detect_low_light.unstable_since is None:
+            detect_low_light.unstable_since = now
+        elif now - detect_low_light.unstable_since >= LIGHT_CONFIRM_SECONDS:
+            # 不一致的判断已持续 LIGHT_CONFIRM_SECONDS - 进一步减少频繁切换
+            detect_low_light.last_result = is_low_light_current
+            detect_low_light.unstable_since = None
+        
+        # 减少日志频率，每90次检测记录一次（分析线程按自己的频率调用，不使用帧计数）
+        if detect_low_light.calls % 90 == 0:
             logger.info(f"光线水平: {detect_low_light.smooth_brightness:.1f}, 阈值: {current_threshold}, 低光状态: {detect_low_light.last_result}")
         
         return detect_low_light.last_result
@@ -351,190 +1120,222 @@ def detect_low_light(frame):
         # 出错时保持之前的判断结果
         return hasattr(detect_low_light, 'last_result') and detect_low_light.last_result
 
-def apply_night_vision(frame):
-    """OV5647专用夜视增强 - 防闪烁优化版本"""
-    global night_vision_strength, enable_green_tint, night_vision_buffer, frame_counter
-    global motion_detected, reduced_processing_until
+def get_processing_scale():
+    """当前低频处理使用的分辨率比例"""
+    if processing_scale_setting == "auto":
+        return processing_scale_by_level.get(processing_level, 1.0)
+    return float(processing_scale_setting)
+
+def apply_local_contrast(frame, scale=1.0):
+    """使用CLAHE增强局部对比度
     
-    try:
-        if frame is None or frame.size == 0:
-            return frame
-        
-        # 每隔10帧才清理一次内存计数，减少计数器操作频率
-        if frame_counter % 10 == 0:
-            night_vision_buffer["frames_since_reset"] += 1
-        
-        # 延长清理间隔，仅每1500帧清理一次缓存
-        if night_vision_buffer["frames_since_reset"] > 1500:
-            night_vision_buffer["green_mask"] = None
-            night_vision_buffer["reduced"] = None
-            night_vision_buffer["last_frame_shape"] = None
-            night_vision_buffer["frames_since_reset"] = 0
-        
-        # 添加亮度平滑处理，减少帧间亮度波动
-        if not hasattr(apply_night_vision, 'last_brightness_factor'):
-            apply_night_vision.last_brightness_factor = 1.6
-            apply_night_vision.last_brightness_offset = 12
-        
-        # 目标亮度参数
-        target_brightness_factor = 1.6  # 适中的亮度提升
-        target_brightness_offset = 12
-        
-        # 平滑过渡亮度参数 (90%旧值 + 10%新值)
-        apply_night_vision.last_brightness_factor = apply_night_vision.last_brightness_factor * 0.9 + target_brightness_factor * 0.1
-        apply_night_vision.last_brightness_offset = apply_night_vision.last_brightness_offset * 0.9 + target_brightness_offset * 0.1
-        
-        # 使用平滑后的亮度参数
-        brightness_factor = apply_night_vision.last_brightness_factor
-        brightness_offset = apply_night_vision.last_brightness_offset
-        
-        # 检查当前帧率，根据帧率确定处理级别
-        with stats_lock:
-            current_fps = fps_stats.get("current", 20)
-        
-        # 检查是否检测到运动或是否处于降级处理阶段
-        use_simple_mode = motion_detected or time.time() < reduced_processing_until
-        
-        # 防止处理级别频繁变化
-        if not hasattr(apply_night_vision, 'processing_mode'):
-            apply_night_vision.processing_mode = 'normal'  # 'simple', 'normal', 'enhanced'
-            apply_night_vision.mode_change_time = time.time()
-        
-        current_time = time.time()
-        mode_duration = current_time - apply_night_vision.mode_change_time
-        
-        # 只有当处理模式持续至少2秒后才考虑改变 - 避免频繁切换导致闪烁
-        if mode_duration > 2.0 and not use_simple_mode:
-            # 根据帧率选择处理模式
-            if current_fps < 10 and apply_night_vision.processing_mode != 'simple':
-                apply_night_vision.processing_mode = 'simple'
-                apply_night_vision.mode_change_time = current_time
-                logger.info(f"夜视处理模式切换为简单模式 (当前帧率: {current_fps:.1f})")
-            elif current_fps >= 10 and current_fps < 18 and apply_night_vision.processing_mode != 'normal':
-                apply_night_vision.processing_mode = 'normal'
-                apply_night_vision.mode_change_time = current_time
-                logger.info(f"夜视处理模式切换为标准模式 (当前帧率: {current_fps:.1f})")
-            elif current_fps >= 18 and apply_night_vision.processing_mode != 'enhanced':
-                apply_night_vision.processing_mode = 'enhanced'
-                apply_night_vision.mode_change_time = current_time
-                logger.info(f"夜视处理模式切换为增强模式 (当前帧率: {current_fps:.1f})")
-        
-        # 如果检测到运动，强制使用简单模式
-        processing_mode = 'simple' if use_simple_mode else apply_night_vision.processing_mode
-        
-        # 应用亮度增强 - 对所有模式都执行
-        enhanced = cv2.convertScaleAbs(frame, alpha=brightness_factor, beta=brightness_offset)
-        
-        # 简单模式 - 最基础的处理
-        if processing_mode == 'simple':
-            # 如果需要绿色夜视，使用极简方法
-            if enable_green_tint:
-                # 增强绿色效果：减弱红蓝通道，增强绿色通道
-                enhanced[:,:,2] = (enhanced[:,:,2] * 0.4).astype(np.uint8)  # 红色通道更弱
-                enhanced[:,:,0] = (enhanced[:,:,0] * 0.4).astype(np.uint8)  # 蓝色通道更弱
-                green_boost = np.clip(enhanced[:,:,1] * 1.5, 0, 255).astype(np.uint8)  # 绿色通道增强更多
-                enhanced[:,:,1] = green_boost
-            
-            return enhanced
-        
-        # 标准模式 - 常规处理
-        if processing_mode == 'normal':
-            # 根据帧计数隔帧应用降噪 - 确保稳定性
-            if frame_counter % 2 == 0:  # 每两帧才处理一次
-                enhanced = cv2.GaussianBlur(enhanced, (3, 3), 0)
-            
-            # 绿色夜视处理
-            if enable_green_tint:
-                # 稳定的绿色蒙版处理
-                current_shape = enhanced.shape
-                if (night_vision_buffer["green_mask"] is None or 
-                    night_vision_buffer["last_frame_shape"] != current_shape):
-                    night_vision_buffer["green_mask"] = np.zeros_like(enhanced)
-                    night_vision_buffer["green_mask"][:,:,1] = 160  # 增强绿色通道强度从100提高到160
-                    night_vision_buffer["last_frame_shape"] = current_shape
-                
-                # 增强混合因子，使绿色效果更明显
-                if not hasattr(apply_night_vision, 'blend_factor'):
-                    apply_night_vision.blend_factor = min(night_vision_strength * 0.7, 0.8)  # 增加基础系数和上限
-                else:
-                    # 平滑过渡混合因子
-                    target_blend = min(night_vision_strength * 0.7, 0.8)  # 增加目标混合系数
-                    apply_night_vision.blend_factor = apply_night_vision.blend_factor * 0.9 + target_blend * 0.1
-                
-                # 应用绿色效果
-                enhanced = cv2.addWeighted(enhanced, 1.0, 
-                                         night_vision_buffer["green_mask"], 
-                                         apply_night_vision.blend_factor, 0)
-                
-                # 平滑通道参数过渡，避免突变 - 降低红蓝通道强度
-                if not hasattr(apply_night_vision, 'r_factor') or not hasattr(apply_night_vision, 'b_factor'):
-                    apply_night_vision.r_factor = 0.35  # 减弱红色通道从0.5降到0.35
-                    apply_night_vision.b_factor = 0.35  # 减弱蓝色通道从0.5降到0.35
-                
-                enhanced[:,:,0] = (enhanced[:,:,0] * apply_night_vision.b_factor).astype(np.uint8)
-                enhanced[:,:,2] = (enhanced[:,:,2] * apply_night_vision.r_factor).astype(np.uint8)
-            
-            return enhanced
-        
-        # 增强模式 - 额外应用对比度增强
-        if processing_mode == 'enhanced':
-            # 应用标准模式的所有处理
-            if frame_counter % 2 == 0:
-                enhanced = cv2.GaussianBlur(enhanced, (3, 3), 0)
-            
-            # 绿色夜视效果
-            if enable_green_tint:
-                if (night_vision_buffer["green_mask"] is None or 
-                    night_vision_buffer["last_frame_shape"] != enhanced.shape):
-                    night_vision_buffer["green_mask"] = np.zeros_like(enhanced)
-                    night_vision_buffer["green_mask"][:,:,1] = 180  # 在增强模式下使用更强的绿色强度
-                    night_vision_buffer["last_frame_shape"] = enhanced.shape
-                
-                if not hasattr(apply_night_vision, 'blend_factor'):
-                    apply_night_vision.blend_factor = min(night_vision_strength * 0.7, 0.8)  # 增强混合因子
-                else:
-                    target_blend = min(night_vision_strength * 0.7, 0.8)
-                    apply_night_vision.blend_factor = apply_night_vision.blend_factor * 0.9 + target_blend * 0.1
-                
-                enhanced = cv2.addWeighted(enhanced, 1.0, 
-                                         night_vision_buffer["green_mask"], 
-                                         apply_night_vision.blend_factor, 0)
-                
-                if not hasattr(apply_night_vision, 'r_factor') or not hasattr(apply_night_vision, 'b_factor'):
-                    apply_night_vision.r_factor = 0.3  # 进一步减弱红色
-                    apply_night_vision.b_factor = 0.3  # 进一步减弱蓝色
-                
-                enhanced[:,:,0] = (enhanced[:,:,0] * apply_night_vision.b_factor).astype(np.uint8)
-                enhanced[:,:,2] = (enhanced[:,:,2] * apply_night_vision.r_factor).astype(np.uint8)
-                
-                # 增强模式下额外增强绿色通道
-                green_boost = np.clip(enhanced[:,:,1] * 1.2, 0, 255).astype(np.uint8)
-                enhanced[:,:,1] = green_boost
-            
-            # 每3帧应用一次高级增强，减轻计算负担
-            if frame_counter % 3 == 0:
-                # 使用CLAHE增强局部对比度，只处理亮度通道
-                lab = cv2.cvtColor(enhanced, cv2.COLOR_BGR2LAB)
-                l, a, b = cv2.split(lab)
-                
-                # 固定的CLAHE参数，避免参数变化引起的闪烁
-                clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(2, 2))
-                cl = clahe.apply(l)
-                
-                enhanced_lab = cv2.merge((cl, a, b))
-                enhanced = cv2.cvtColor(enhanced_lab, cv2.COLOR_LAB2BGR)
-            
-            return enhanced
-        
-        # 默认返回简单增强的帧
-        return enhanced
+    scale为1时在全分辨率的LAB亮度通道上处理；scale<1时在缩小的亮度图上计算
+    CLAHE前后的亮度比值作为增益图，放大后乘到全分辨率画面上。
+    对比度调整本身是低频的，细节和边缘仍来自原始分辨率
+    """
+    # 固定的CLAHE参数，避免参数变化引起的闪烁；对象只创建一次
+    clahe = night_vision_buffer["clahe"]
+    if clahe is None:
+        clahe = night_vision_buffer["clahe"] = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(2, 2))
     
-    except Exception as e:
-        logger.error(f"夜视模式处理出错: {e}")
-        return frame  # 发生错误时返回原始帧
+    if scale >= 1.0:
+        lab = cv2.cvtColor(frame, cv2.COLOR_BGR2LAB)
+        l, a, b = cv2.split(lab)
+        cl = clahe.apply(l)
+        return cv2.cvtColor(cv2.merge((cl, a, b)), cv2.COLOR_LAB2BGR)
+    
+    # 缓冲区按分辨率和比例分配一次，之后每帧写入已有数组
+    height, width = frame.shape[:2]
+    buffers = night_vision_buffer["contrast"]
+    if buffers is None or buffers["key"] != (frame.shape, scale):
+        small_shape = (max(1, int(height * scale)), max(1, int(width * scale)))
+        buffers = night_vision_buffer["contrast"] = {
+            "key": (frame.shape, scale),
+            "luma": np.empty((height, width), np.uint8),
+            "small": np.empty(small_shape, np.uint8),
+            "enhanced": np.empty(small_shape, np.uint8),
+            "numerator": np.empty(small_shape, np.float32),
+            "denominator": np.empty(small_shape, np.float32),
+            "gain": np.empty((height, width), np.float32),
+            "gain3": np.empty((height, width, 3), np.float32)
+        }
+    small = buffers["small"]
+    
+    cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY, dst=buffers["luma"])
+    cv2.resize(buffers["luma"], (small.shape[1], small.shape[0]), dst=small, interpolation=cv2.INTER_AREA)
+    clahe.apply(small, dst=buffers["enhanced"])
+    # 增益 = (增强后亮度+1) / (原亮度+1)，加1避免除零并抑制暗部噪声被过度放大
+    cv2.add(buffers["enhanced"], 1.0, dst=buffers["numerator"], dtype=cv2.CV_32F)
+    cv2.add(small, 1.0, dst=buffers["denominator"], dtype=cv2.CV_32F)
+    cv2.divide(buffers["numerator"], buffers["denominator"], dst=buffers["numerator"])
+    cv2.resize(buffers["numerator"], (width, height), dst=buffers["gain"], interpolation=cv2.INTER_LINEAR)
+    cv2.cvtColor(buffers["gain"], cv2.COLOR_GRAY2BGR, dst=buffers["gain3"])
+    # 输出每次新分配：处理后的帧会作为latest_frame被其他线程读取，不能复用
+    return cv2.multiply(frame, buffers["gain3"], dtype=cv2.CV_8U)
+
+def update_night_brightness():
+    """平滑过渡夜视的软件亮度参数，减少帧间亮度波动，返回 (系数, 偏移)"""
+    if exposure_controller is not None:
+        # 传感器曝光和增益已尽量达到目标亮度，软件只补足传感器到达上限后剩余的部分
+        target_factor = exposure_controller.software_gain
+        target_offset = 0
+    else:
+        target_factor = 1.6  # 适中的亮度提升
+        target_offset = 12
+    
+    # 平滑过渡亮度参数 (90%旧值 + 10%新值)
+    night_vision_state["brightness_factor"] = night_vision_state["brightness_factor"] * 0.9 + target_factor * 0.1
+    night_vision_state["brightness_offset"] = night_vision_state["brightness_offset"] * 0.9 + target_offset * 0.1
+    return night_vision_state["brightness_factor"], night_vision_state["brightness_offset"]
+
+def select_night_mode():
+    """按帧率和运动状态选择夜视处理模式: simple、normal 或 enhanced"""
+    with stats_lock:
+        current_fps = fps_stats.get("current", 20)
+    
+    # 检测到运动或处于降级处理阶段时强制使用简单模式
+    if motion_detected or time.time() < reduced_processing_until:
+        return 'simple'
+    
+    # 只有当处理模式持续至少2秒后才考虑改变 - 避免频繁切换导致闪烁
+    current_time = time.time()
+    if current_time - night_vision_state["mode_change_time"] > 2.0:
+        if current_fps < 10:
+            mode, name = 'simple', "简单"
+        elif current_fps < 18:
+            mode, name = 'normal', "标准"
+        else:
+            mode, name = 'enhanced', "增强"
+        if mode != night_vision_state["mode"]:
+            night_vision_state["mode"] = mode
+            night_vision_state["mode_change_time"] = current_time
+            logger.info(f"夜视处理模式切换为{name}模式 (当前帧率: {current_fps:.1f})")
+    return night_vision_state["mode"]
+
+def select_processing_graph():
+    """按夜视状态和夜视处理模式选择本帧的处理图"""
+    if not night_vision_active:
+        return processing_graphs["day"]
+    return processing_graphs["night-" + select_night_mode()]
+
+def temporal_denoise_active():
+    return temporal_denoise_enabled
+
+def adjust_colors_stage(ctx, frame):
+    return adjust_colors_fast(frame, ctx.output(frame.shape))
+
+def denoise_stage(ctx, frame):
+    # 标准和增强模式在提亮之前做时域降噪，避免放大后的噪声
+    return night_denoiser.process(frame, motion_mask)
+
+def brighten_stage(ctx, frame):
+    # 亮度参数每帧在 prepare 中平滑一次（update_night_brightness），按条带执行时各条带使用相同的参数
+    factor, offset = ctx.params
+    return cv2.convertScaleAbs(frame, ctx.output(frame.shape), alpha=factor, beta=offset)
+
+def blur_stage(ctx, frame):
+    # 没有时域降噪时隔帧做轻微的空间降噪
+    return cv2.GaussianBlur(frame, (3, 3), 0, dst=ctx.output(frame.shape))
+
+def green_tint_table(green_level, red_gain, blue_gain, green_gain):
+    """绿色夜视的逐通道查找表（BGR）
+    
+    绿色通道先叠加 green_level x 混合系数（与原来和绿色蒙版 addWeighted 的结果逐值相同），
+    再乘以 green_gain；红蓝通道乘以对应系数后截断。混合系数平滑变化，每帧重新生成（256项）
+    """
+    ramp = np.arange(256, dtype=np.float64)
+    table = np.empty((1, 256, 3), np.uint8)
+    table[0, :, 0] = (ramp * blue_gain).astype(np.uint8)
+    table[0, :, 2] = (ramp * red_gain).astype(np.uint8)
+    green = np.arange(256, dtype=np.uint8).reshape(1, 256)
+    if green_level:
+        target_blend = min(night_vision_strength * 0.7, 0.8)
+        blend = night_vision_state["blend_factor"]
+        # 平滑过渡混合因子
+        blend = target_blend if blend is None else blend * 0.9 + target_blend * 0.1
+        night_vision_state["blend_factor"] = blend
+        green = cv2.addWeighted(green, 1.0, np.full_like(green, green_level), blend, 0)
+    table[0, :, 1] = np.clip(green[0] * green_gain, 0, 255).astype(np.uint8) if green_gain != 1.0 else green[0]
+    return table
+
+def green_tint_stage(ctx, frame):
+    """绿色夜视：增强绿色通道、减弱红蓝通道，一次查表完成，查找表由 green_tint_table 每帧生成"""
+    return cv2.LUT(frame, ctx.params, dst=ctx.output(frame.shape))
+
+def local_contrast_stage(ctx, frame):
+    return apply_local_contrast(frame, ctx.scale)
+
+def overlay_enabled(ctx):
+    # 只在有足够帧率时显示信息，避免低帧率时的额外负担
+    with stats_lock:
+        current_fps = fps_stats.get("current", 0)
+    return current_fps >= 10 or ctx.index % 10 == 0
 
-def check_and_update_night_vision(frame):
-    """检查是否需要启用或关闭夜视模式 - 增强防闪烁的稳定性处理"""
+def overlay_stage(ctx, frame):
+    with stats_lock:
+        current_fps = fps_stats.get("current", 0)
+    draw_overlay(frame, current_fps)
+    return frame
+
+def build_processing_graphs():
+    """白天和三种夜视模式的处理图，切换模式就是换一张图"""
+    Stage = processing_graph.Stage
+    tint_enabled = lambda ctx: enable_green_tint
+    denoise_enabled = lambda ctx: temporal_denoise_active()
+    blur_enabled = lambda ctx: not temporal_denoise_active()
+    overlay = Stage("overlay", overlay_stage, inputs=("image",), output="output", enabled=overlay_enabled,
+                    inplace=True)
+    
+    def night_graph(mode, source, stages):
+        return processing_graph.ProcessingGraph(f"night-{mode}", [
+            Stage("brighten", brighten_stage, inputs=(source,), prepare=lambda ctx: update_night_brightness(),
+                  halo=0),
+            *stages,
+            overlay
+        ])
+    
+    def green_tint(inputs, output, **params):
+        return Stage("green_tint", green_tint_stage, inputs=inputs, output=output, enabled=tint_enabled,
+                     prepare=lambda ctx: green_tint_table(**params), halo=0)
+    
+    # 查表、提亮、绿色效果逐像素处理，3x3模糊需要上下各1行，可以按条带并行；降噪和CLAHE只能整幅处理
+    denoise = Stage("denoise", denoise_stage, output="denoised", enabled=denoise_enabled)
+    blur = Stage("blur", blur_stage, inputs=("brighten",), every=2, enabled=blur_enabled, halo=1)
+    return {
+        "day": processing_graph.ProcessingGraph("day", [
+            Stage("adjust_colors", adjust_colors_stage, output="image", halo=0),
+            overlay
+        ]),
+        # 简单模式：不降噪，只提亮和极简的绿色效果
+        "night-simple": night_graph("simple", "frame", [
+            green_tint(("brighten",), "image", green_level=0, red_gain=0.4, blue_gain=0.4, green_gain=1.5)
+        ]),
+        "night-normal": night_graph("normal", "denoised", [
+            denoise, blur,
+            green_tint(("blur",), "image", green_level=160, red_gain=0.35, blue_gain=0.35, green_gain=1.0)
+        ]),
+        # 增强模式：更强的绿色效果，每3帧额外做一次局部对比度增强
+        "night-enhanced": night_graph("enhanced", "denoised", [
+            denoise, blur,
+            green_tint(("blur",), "tinted", green_level=180, red_gain=0.3, blue_gain=0.3, green_gain=1.2),
+            Stage("local_contrast", local_contrast_stage, inputs=("tinted",), output="image", every=3,
+                  scale=get_processing_scale)
+        ])
+    }
+
+processing_engine = processing_graph.ProcessingEngine(
+    band_parallel.BandScheduler(band_threads, band_min_rows) if band_threads > 1 else None)
+processing_graphs = build_processing_graphs()
+
+def restart_night_denoiser():
+    """夜视从关闭变为开启时调用，时域降噪从下一帧重新累加，不混入上一次夜视期间的旧画面"""
+    night_denoiser.restart()
+
+def check_and_update_night_vision(frame, metadata=None):
+    """检查是否需要启用或关闭夜视模式 - 增强防闪烁的稳定性处理
+
+    metadata 为该帧的摄像头请求元数据，可用时据此估计光线水平，否则统计画面像素
+    """
     global night_vision_enabled, night_vision_auto, night_vision_active
     
     try:
@@ -554,13 +1355,20 @@ def check_and_update_night_vision(frame):
             # 如果之前不是激活状态，现在启用
             if not night_vision_active:
                 with night_vision_lock:
+                    restart_night_denoiser()
                     night_vision_active = True
                     logger.info("夜视模式已手动开启")
             return True
         
         # 自动模式下，通过光线检测决定
-        # 检测光线强度
-        low_light = detect_low_light(frame)
+        # 检测光线强度：优先使用元数据估计，几乎没有计算量
+        level, source, inputs = light_estimator.estimate(metadata, frame) \
+            if light_estimator is not None else (None, None, {})
+        if level is None:
+            source = "pixels"
+        low_light = detect_low_light(frame, level)
+        level = getattr(detect_low_light, "last_level", level)
+        record_light_sample(level, source, inputs, low_light)
         
         # 获取当前状态
         current_status = night_vision_active
@@ -570,31 +1378,29 @@ def check_and_update_night_vision(frame):
         if not hasattr(check_and_update_night_vision, 'last_change_time'):
             check_and_update_night_vision.last_change_time = 0
             
-        if low_light != current_status and current_time - check_and_update_night_vision.last_change_time > 5.0:
-            # 添加状态计数器，确保多次连续检测到同一状态才切换
-            if not hasattr(check_and_update_night_vision, 'state_counter'):
-                check_and_update_night_vision.state_counter = 0
-                check_and_update_night_vision.pending_state = low_light
-            
-            # 如果待处理状态改变，重置计数器
-            if check_and_update_night_vision.pending_state != low_light:
-                check_and_update_night_vision.state_counter = 0
-                check_and_update_night_vision.pending_state = low_light
+        if low_light == current_status:
+            # 判断与当前状态一致，之前待确认的切换作废
+            check_and_update_night_vision.pending_since = None
+        elif current_time - check_and_update_night_vision.last_change_time > 5.0:
+            # 记录开始检测到新状态的时间，确保新状态持续一段时间才切换
+            if getattr(check_and_update_night_vision, 'pending_since', None) is None:
+                check_and_update_night_vision.pending_since = current_time
             else:
-                # 状态一致，增加计数器
-                check_and_update_night_vision.state_counter += 1
-                
-                # 需要连续3次检测到同一状态才真正切换 - 进一步防止临时波动
-                if check_and_update_night_vision.state_counter >= 3:
+                # 需要持续 NIGHT_SWITCH_CONFIRM_SECONDS 检测到同一状态才真正切换 - 进一步防止临时波动
+                if current_time - check_and_update_night_vision.pending_since >= NIGHT_SWITCH_CONFIRM_SECONDS:
                     with night_vision_lock:
+                        if low_light:
+                            restart_night_denoiser()
                         night_vision_active = low_light
                         check_and_update_night_vision.last_change_time = current_time
-                        check_and_update_night_vision.state_counter = 0
+                        check_and_update_night_vision.pending_since = None
                         
                         if low_light:
                             logger.info("检测到持续光线不足，启用夜视模式")
                         else:
                             logger.info("检测到持续光线充足，关闭夜视模式")
+                    record_light_sample(level, source, inputs, low_light,
+                                        event="night_vision_on" if low_light else "night_vision_off")
         
         return night_vision_active
     
@@ -602,9 +1408,32 @@ def check_and_update_night_vision(frame):
         logger.error(f"检查夜视状态出错: {e}")
         return night_vision_active  # 保持当前状态
 
+def record_light_sample(level, source, inputs, low_light, event=None):
+    """把光线检测的输入和判断记入光线历史：每秒最多一条，夜视切换（event）时总是记录"""
+    now = time.time()
+    light_state.update(time=now, level=level, source=source, inputs=inputs)
+    if event is None and now - light_state["last_record"] < 1.0:
+        return
+    light_state["last_record"] = now
+    sample = {
+        "time": now,
+        "source": source,
+        "level": round(float(level), 1) if level is not None else None,
+        "smooth_level": round(float(detect_low_light.smooth_brightness), 1)
+        if hasattr(detect_low_light, "smooth_brightness") else None,
+        "threshold": light_threshold,
+        "low_light": bool(low_light),
+        "night_vision_active": bool(night_vision_active),
+        "event": event
+    }
+    sample.update(inputs)
+    with light_history_lock:
+        light_history.append(sample)
+
 def detect_motion(frame):
     """检测帧中的运动，简化版本仅用于夜视模式调整处理级别"""
-    global motion_detected, motion_frame_buffer, last_motion_time, reduced_processing_until
+    global motion_detected, motion_frame_buffer, motion_mask, last_motion_time, reduced_processing_until
+    global last_motion_ratio
     
     try:
         # 简单的运动检测实现
@@ -614,28 +1443,31 @@ def detect_motion(frame):
         if current_time - last_motion_time < motion_detection_interval:
             return False
             
+        # 将当前帧转换为灰度（分析流的亮度图无需转换）
+        current_gray = frame if frame.ndim == 2 else cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        
         # 初始化运动检测缓冲区
-        if motion_frame_buffer is None or motion_frame_buffer.shape != frame.shape:
+        if motion_frame_buffer is None or motion_frame_buffer.shape != current_gray.shape:
             # 首次运行或帧大小变化，初始化缓冲区
-            motion_frame_buffer = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+            motion_frame_buffer = current_gray.copy()
             motion_detected = False
             return False
         
-        # 将当前帧转换为灰度
-        current_gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
         # 对比当前帧与缓冲帧
         frame_diff = cv2.absdiff(current_gray, motion_frame_buffer)
         
         # 应用阈值
         _, thresholded = cv2.threshold(frame_diff, motion_detection_threshold, 255, cv2.THRESH_BINARY)
         
-        # 减少噪点影响
-        thresholded = cv2.erode(thresholded, None, iterations=2)
-        thresholded = cv2.dilate(thresholded, None, iterations=4)
+        # 减少噪点影响，腐蚀/膨胀次数按640宽度时的2/4次随分辨率缩放
+        scale = frame.shape[1] / 640
+        thresholded = cv2.erode(thresholded, None, iterations=max(1, round(2 * scale)))
+        thresholded = cv2.dilate(thresholded, None, iterations=max(1, round(4 * scale)))
+        motion_mask = thresholded
         
         # 计算非零像素的百分比（移动区域）
         motion_ratio = cv2.countNonZero(thresholded) / (frame.shape[0] * frame.shape[1])
+        last_motion_ratio = motion_ratio
         
         # 更新缓冲帧 (使用当前帧的70%和缓冲帧的30%进行混合，减少噪点影响)
         motion_frame_buffer = cv2.addWeighted(current_gray, 0.7, motion_frame_buffer, 0.3, 0)
@@ -659,45 +1491,12 @@ def detect_motion(frame):
         logger.error(f"运动检测出错: {e}")
         return False
 
-def enhance_frame(frame):
-    """优化的帧增强函数，使用简单可靠的处理流程"""
-    global previous_frame, night_vision_active, frame_counter, motion_detected, reduced_processing_until
-    
-    if frame is None or frame.size == 0:
-        return None
-    
-    try:
-        # 增加帧计数器
-        frame_counter += 1
-        
-        # 更新夜视模式状态
-        night_mode_enabled = check_and_update_night_vision(frame)
-        
-        # 根据夜视模式选择处理流程
-        if night_mode_enabled:
-            # 如果检测到运动或者正在降低处理级别，使用简单处理
-            if motion_detected or time.time() < reduced_processing_until:
-                # 使用简单模式的夜视增强
-                logger.debug("使用简单夜视模式 - 已检测到运动")
-            
-            # 应用夜视模式增强
-            return apply_night_vision(frame)
-        else:
-            # 标准图像处理流程
-            return adjust_colors_fast(frame)
-    
-    except Exception as e:
-        logger.error(f"帧增强处理出错: {e}")
-        return frame  # 返回原始帧，确保不中断
-
 def update_fps_stats(frame_time):
-    """计算并更新FPS统计信息"""
-    global fps_stats, frame_times
+    """计算并更新当前FPS，平均FPS由统计历史每秒更新"""
+    global fps_stats
     with stats_lock:
         # 保留最近10帧的时间，减少计算量
         frame_times.append(frame_time)
-        if len(frame_times) > 10:
-            frame_times.pop(0)
             
         # 计算FPS
         if len(frame_times) > 1:
@@ -711,65 +1510,58 @@ def update_fps_stats(frame_time):
                     fps_stats["min"] = fps
                 if fps > fps_stats["max"]:
                     fps_stats["max"] = fps
-                # 使用简单平均
-                fps_stats["avg"] = fps
+                if stats_history_store is None:
+                    fps_stats["avg"] = fps
+
+def record_frame_stats(now, capture_time=None, process_ms=np.nan, encode_ms=np.nan, jpeg_bytes=None):
+    """把一帧的间隔、各阶段耗时和JPEG大小写入逐帧历史"""
+    global last_history_frame_time
+    if stats_history_store is None:
+        return
+    # 超过1秒的间隔来自空闲模式或摄像头重启，不计入帧间隔
+    interval = now - last_history_frame_time if last_history_frame_time is not None else None
+    interval_ms = interval * 1000 if interval is not None and interval < 1.0 else np.nan
+    last_history_frame_time = now
+    latency_ms = (now - capture_time) * 1000 if capture_time else np.nan
+    stats_history_store.add_frame(now, (interval_ms, process_ms, encode_ms, latency_ms,
+                                        jpeg_bytes / 1024 if jpeg_bytes is not None else np.nan))
+
+def count_bytes_sent(size):
+    with traffic_lock:
+        traffic_stats["bytes_sent"] += size
+
+def draw_overlay(frame, current_fps):
+    """在帧上绘制时间戳和FPS信息"""
+    current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
+    fps_text = f"FPS: {current_fps:.1f}"
+    
+    # 使用更高效的文字渲染方式
+    cv2.putText(frame, current_time, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 
+              0.5, (0, 0, 0), 2, cv2.LINE_AA)  # 黑色外边框
+    cv2.putText(frame, current_time, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 
+              0.5, (255, 255, 255), 1, cv2.LINE_AA)
+    
+    cv2.putText(frame, fps_text, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 
+              0.5, (0, 0, 0), 2, cv2.LINE_AA)
+    cv2.putText(frame, fps_text, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 
+              0.5, (255, 255, 255), 1, cv2.LINE_AA)
+
+def reset_fps_stats():
+    """清空FPS计算用的帧时间，避免空闲期间的长间隔拉低恢复后的帧率统计"""
+    with stats_lock:
+        frame_times.clear()
+        fps_stats["min"] = 0
 
 def process_frame(frame):
-    """处理捕获的帧 - 优化版本，增加运动检测和动态处理"""
-    global frame_counter, night_vision_active, reduced_processing_until, motion_detected, motion_frame_buffer, last_motion_time
+    """按夜视状态选择处理图并执行，每帧只计数一次"""
+    global frame_counter
     
     if frame is None:
         return None
         
     try:
-        # 增加帧计数
         frame_counter += 1
-        
-        # 检测是否有运动（仅在夜视模式下）
-        if night_vision_active and frame_counter % 5 == 0:  # 每5帧检查一次运动
-            try:
-                detect_motion(frame)
-            except Exception as e:
-                logger.error(f"运动检测错误: {e}")
-        
-        # 夜视模式检查
-        is_night_vision = check_and_update_night_vision(frame)
-        
-        # 在夜视模式下，根据运动状态或临时降级标志决定处理级别
-        result_frame = None
-        if is_night_vision:
-            # 如果检测到运动或帧率过低，减少处理复杂度
-            if motion_detected or time.time() < reduced_processing_until:
-                result_frame = apply_night_vision(frame)
-            else:
-                result_frame = apply_night_vision(frame)
-        else:
-            # 标准图像增强
-            result_frame = enhance_frame(frame)
-            
-        # 每隔2帧才添加文字信息，减少处理负担
-        if frame_counter % 2 == 0 and result_frame is not None:
-            # 添加时间戳和FPS信息 (高效版本)
-            with stats_lock:
-                current_fps = fps_stats.get("current", 0)
-                
-            # 只在有足够帧率时显示信息，避免低帧率时的额外负担
-            if current_fps >= 10 or frame_counter % 10 == 0:
-                current_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime())
-                fps_text = f"FPS: {current_fps:.1f}"
-                
-                # 使用更高效的文字渲染方式
-                cv2.putText(result_frame, current_time, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 
-                          0.5, (0, 0, 0), 2, cv2.LINE_AA)  # 黑色外边框
-                cv2.putText(result_frame, current_time, (10, 25), cv2.FONT_HERSHEY_SIMPLEX, 
-                          0.5, (255, 255, 255), 1, cv2.LINE_AA)
-                
-                cv2.putText(result_frame, fps_text, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 
-                          0.5, (0, 0, 0), 2, cv2.LINE_AA)
-                cv2.putText(result_frame, fps_text, (10, 50), cv2.FONT_HERSHEY_SIMPLEX, 
-                          0.5, (255, 255, 255), 1, cv2.LINE_AA)
-        
-        return result_frame
+        return processing_engine.run(select_processing_graph(), frame, frame_counter)
         
     except Exception as e:
         logger.error(f"处理帧出错: {e}")
@@ -782,15 +1574,15 @@ def is_valid_frame(frame):
     
     try:
         # 仅执行基本检查，减少处理时间
-        # 检查帧形状
-        if len(frame.shape) != 3:
+        # 检查帧形状：彩色帧或分析流的亮度图
+        if frame.ndim not in (2, 3):
             return False
         
         # 只检查图像部分区域以加速处理
         # 从中心取样本区域
         h, w = frame.shape[:2]
         center_y, center_x = h // 2, w // 2
-        sample_size = 50  # 采样区域大小
+        sample_size = max(8, min(h, w) * 50 // 480)  # 采样区域大小，480高度时为50
         
         sample = frame[
             max(0, center_y - sample_size):min(h, center_y + sample_size),
@@ -812,154 +1604,414 @@ def is_valid_frame(frame):
         logger.error(f"帧验证错误: {e}")
         return False
 
-def capture_continuous():
-    """优化的帧捕获函数，专注于提高帧率和稳定性，增加资源监控"""
-    global picam2, running, latest_frame, last_frame_time, frame_counter
-    global last_resource_check, memory_reset_needed
+def extract_lores_luma(frame, lores=None):
+    """返回分析用的亮度图：lores流（YUV420）的亮度平面，没有lores流时由主画面缩小得到"""
+    width, height = lores_size or DEFAULT_ANALYSIS_SIZE
+    if lores is not None:
+        # YUV420的前height行是亮度平面，行宽可能按对齐要求大于width
+        return cv2.LUT(lores[:height, :width], LIMITED_TO_FULL_RANGE)
+    # 先最近邻取样到两倍目标尺寸，再2x2区域平均：比在整帧上做区域缩放快得多，仍保留一定的降噪效果
+    sampled = cv2.resize(frame, (width * 2, height * 2), interpolation=cv2.INTER_NEAREST)
+    return cv2.resize(cv2.cvtColor(sampled, cv2.COLOR_BGR2GRAY), (width, height), interpolation=cv2.INTER_AREA)
+
+def publish_lores(frame, lores, metadata, capture_time):
+    """按分析频率把亮度图交给分析线程，返回本次发布的亮度图，未到分析时间时返回None"""
+    now = time.time()
+    if now - lores_state["last_publish"] < 1.0 / analysis_fps:
+        return None
+    luma = extract_lores_luma(frame, lores)
+    with lores_lock:
+        if lores_state["seq"] != lores_state["analyzed_seq"]:
+            analysis_stats["skipped"] += 1
+        lores_state["luma"] = luma
+        lores_state["metadata"] = metadata
+        lores_state["seq"] += 1
+        lores_state["capture_time"] = capture_time
+        lores_state["last_publish"] = now
+    lores_event.set()
+    return luma
+
+def analyze_lores(luma, metadata=None):
+    """在低分辨率亮度图上做画面有效性、光线和运动检测，结果写入夜视和运动检测的全局状态
+
+    metadata 为同一帧的请求元数据，光线水平优先由它估计
+    """
+    valid = is_valid_frame(luma)
+    if not valid:
+        analysis_stats["invalid_frames"] += 1
+        if analysis_stats["valid"]:
+            logger.warning("分析流检测到无效画面（全黑或单色），请检查镜头是否被遮挡")
+    analysis_stats["valid"] = valid
     
-    logger.info("开始后台帧捕获线程")
+    night_mode = check_and_update_night_vision(luma, metadata)
+    # 运动检测只用于夜视模式调整处理级别，detect_motion 自身按 motion_detection_interval 限频
+    if night_mode:
+        detect_motion(luma)
+    return night_mode
+
+def analysis_loop():
+    """分析线程：处理捕获线程发布的最新亮度图，较慢时直接跳过中间的图"""
+    logger.info(f"分析线程已启动，{analysis_fps:g}fps")
+    while running:
+        if not lores_event.wait(1.0):
+            continue
+        lores_event.clear()
+        with lores_lock:
+            luma = lores_state["luma"]
+            metadata = lores_state["metadata"]
+            lores_state["analyzed_seq"] = lores_state["seq"]
+        if luma is None:
+            continue
+        
+        start = time.perf_counter()
+        try:
+            thread_tuner.set_cv_stage("analysis")
+            analyze_lores(luma, metadata)
+        except Exception as e:
+            logger.error(f"画面分析出错: {e}")
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        analysis_stats["runs"] += 1
+        analysis_stats["last_ms"] = elapsed_ms
+        analysis_stats["avg_ms"] = elapsed_ms if analysis_stats["runs"] == 1 else \
+            analysis_stats["avg_ms"] * 0.9 + elapsed_ms * 0.1
+
+def clear_night_vision_buffers():
+    """丢弃处理图的中间缓冲区、增强缓冲区和时域降噪的累积帧，下一帧按当前尺寸重新分配"""
+    processing_engine.clear_buffers()
+    night_vision_buffer["contrast"] = None
+    night_denoiser.reset()
+
+def reset_frame_shape_buffers():
+    """切换采集档案后丢弃与画面尺寸相关的缓冲区和统计"""
+    global idle_raw_frame, motion_frame_buffer
+    with processing_lock:
+        clear_night_vision_buffers()
+        idle_raw_frame = None
+    # 新档案的视场可能不同，旧的前一帧会被误判为运动
+    motion_frame_buffer = None
+    reset_fps_stats()
+    with stats_lock:
+        fps_stats["max"] = 0
+    with scaled_frames_lock:
+        scaled_frames.clear()
+
+def reset_memory_buffers():
+    """清理夜视缓存并执行垃圾回收，由捕获线程在帧之间调用"""
+    global memory_reset_needed, last_memory_reset
+    memory_reset_needed = False
     
-    # 记录性能数据
-    frame_times = []
-    last_perf_check = time.time()
+    # 避免频繁重置，至少间隔5分钟
+    if time.time() - last_memory_reset < 300:
+        return
     
-    # 添加关键模块的导入
     try:
-        import psutil
-        has_psutil = True
-        logger.info("已启用psutil资源监控功能")
-    except ImportError:
-        has_psutil = False
-        logger.warning("未找到psutil模块，资源监控将不可用。请使用 'pip install psutil' 安装")
-    
-    # 定义内联资源监控函数，避免全局函数未定义的问题
-    def inline_monitor_resources():
+        logger.info("执行简化版内存优化...")
+        
+        # 记录触发清理前内存增长最多的位置，便于找到真正的增长来源
+        if allocation_tracker is not None and allocation_tracker.active:
+            logger.info(allocation_tracker.format_top())
+        
+        # 清理夜视缓存
+        clear_night_vision_buffers()
+        
+        # 简单的垃圾收集
+        import gc
+        collected = gc.collect()
+        
+        last_memory_reset = time.time()
+        logger.info(f"内存优化完成，回收对象 {collected} 个")
+    except Exception as e:
+        logger.error(f"重置内存使用出错: {e}")
+
+def resource_monitor_loop():
+    """后台资源采样线程：以较低优先级定期采样，根据内存和温度调整服务"""
+    global resource_sampler, last_resource_check, memory_reset_needed, processing_level, reduce_processing
+    
+    if resource_monitor.psutil is None:
+        logger.warning("未找到psutil模块，系统CPU和内存监控将不可用。请使用 'pip install psutil' 安装")
+    resource_monitor.lower_current_thread_priority()
+    
+    # 保留约1小时的采样
+    resource_sampler = resource_monitor.ResourceSampler(history_size=max(1, int(3600 / resource_sample_interval)))
+    
+    while running:
         try:
-            if not has_psutil:
-                return {"memory_percent": 0, "available_memory_mb": 0, "cpu_temp": 0, "cpu_percent": 0, "reset_needed": False}
-                
-            # 获取内存使用情况
-            memory = psutil.virtual_memory()
-            memory_percent = memory.percent
-            available_memory_mb = memory.available / (1024 * 1024)
+            sample = resource_sampler.sample()
+            current_time = sample["time"]
             
-            # 获取CPU温度
-            cpu_temp = 0
-            try:
-                with open('/sys/class/thermal/thermal_zone0/temp', 'r') as f:
-                    cpu_temp = int(f.read().strip()) / 1000.0
-            except:
-                pass
+            if current_time - last_resource_check >= resource_monitor_interval:
+                last_resource_check = current_time
                 
-            # 获取CPU使用率
-            try:
-                cpu_percent = psutil.cpu_percent(interval=0.1)
-            except:
-                cpu_percent = 0
+                # 内存不足时请求捕获线程执行清理
+                if sample["memory_percent"] is not None and \
+                        (sample["memory_percent"] > 75 or sample["available_memory_mb"] < 400) and \
+                        current_time - last_memory_reset > 300:
+                    logger.warning(f"内存不足 (使用率: {sample['memory_percent']:.1f}%, "
+                                   f"可用: {sample['available_memory_mb']:.0f}MB)，将执行内存优化")
+                    memory_reset_needed = True
                 
-            # 检测内存问题
-            need_reset = False
-            if memory_percent > 75 or available_memory_mb < 400:
-                # 避免频繁重置，至少间隔5分钟
-                current_time = time.time()
-                if current_time - last_memory_reset > 300:
-                    need_reset = True
-                    logger.warning(f"内存不足 (使用率: {memory_percent:.1f}%, 可用: {available_memory_mb:.0f}MB)，将执行内存优化")
-            
-            return {
-                "memory_percent": memory_percent,
-                "available_memory_mb": available_memory_mb,
-                "cpu_temp": cpu_temp,
-                "cpu_percent": cpu_percent,
-                "reset_needed": need_reset
-            }
+                # 如果CPU温度过高，降低处理级别
+                if sample["cpu_temp"] is not None and sample["cpu_temp"] > 75:
+                    processing_level = 0
+                    reduce_processing = True
+                    logger.warning(f"CPU温度过高 ({sample['cpu_temp']:.1f}°C)，降低处理级别以避免过热")
+                
+                if sample["throttle_flags"] and any(not flag.endswith("_occurred") for flag in sample["throttle_flags"]):
+                    logger.warning(f"树莓派当前处于降频/欠压状态: {', '.join(sample['throttle_flags'])}")
         except Exception as e:
             logger.error(f"资源监控出错: {e}")
-            return {"memory_percent": 0, "available_memory_mb": 0, "cpu_temp": 0, "cpu_percent": 0, "reset_needed": False}
+        
+        time.sleep(resource_sample_interval)
+
+def get_total_bytes_sent():
+    """所有进程发送给视频客户端的累计字节数，多进程模式下加上各工作进程最近上报的值"""
+    with traffic_lock:
+        total = traffic_stats["bytes_sent"]
+    return total + sum(report.get("bytes_sent", 0) for report in list(worker_reports.values()))
+
+def stats_history_loop():
+    """每秒向统计历史写入一个样本，并用最近60秒的平均帧率更新 fps_stats["avg"]"""
+    last_bytes = get_total_bytes_sent()
+    last_time = time.time()
     
-    # 定义内联内存重置函数
-    def inline_reset_memory():
+    while running:
+        time.sleep(1.0)
         try:
-            logger.info("执行简化版内存优化...")
-            
-            # 清理夜视缓存
-            global night_vision_buffer
-            night_vision_buffer["green_mask"] = None
-            night_vision_buffer["reduced"] = None
-            night_vision_buffer["last_frame_shape"] = None
-            night_vision_buffer["frames_since_reset"] = 0
+            now = time.time()
+            total_bytes = get_total_bytes_sent()
+            # 工作进程重启后上报的累计值会变小，这一秒按0计
+            sent_kbps = max(total_bytes - last_bytes, 0) * 8 / 1000 / max(now - last_time, 1e-6)
+            last_bytes, last_time = total_bytes, now
             
-            # 简单的垃圾收集
-            import gc
-            gc.collect()
+            resources = resource_sampler.latest() if resource_sampler is not None else None
+            clients = active_clients + sum(report["active_clients"] for report in list(worker_reports.values()))
+            stats_history_store.add_second(now, {
+                "light_level": float(light_state["level"]) if light_state["level"] is not None else float(last_light_level),
+                "motion_ratio": last_motion_ratio,
+                "cpu_percent": resources.get("cpu_percent") if resources else None,
+                "cpu_temp": resources.get("cpu_temp") if resources else None,
+                "rss_mb": resources.get("rss_mb") if resources else None,
+                "sent_kbps": sent_kbps,
+                "clients": clients
+            })
             
-            # 重置标志和时间戳
-            global last_memory_reset
-            last_memory_reset = time.time()
-            logger.info("内存优化完成")
+            average = stats_history_store.seconds.summary("fps", now - 60)
+            with stats_lock:
+                fps_stats["avg"] = average["mean"] if average["count"] else 0
         except Exception as e:
-            logger.error(f"重置内存使用出错: {e}")
+            logger.error(f"记录统计历史出错: {e}")
+
+def deliver_frame(frame, capture_time):
+    """处理一帧原始画面并发布给所有输出，调用方需持有processing_lock"""
+    global latest_frame, latest_frame_capture_time, last_frame_time
+    
+    thread_tuner.set_cv_stage("enhance")
+    process_start = time.perf_counter()
+    processed_frame = process_frame(frame)
+    process_ms = (time.perf_counter() - process_start) * 1000
+    if processed_frame is None:
+        return None
+    
+    # 更新帧数据
+    # process_frame每帧返回新的数组，之后不再修改，保存引用即可，无需复制
+    with frame_lock:
+        latest_frame = processed_frame
+        latest_frame_capture_time = capture_time
+        last_frame_time = time.time()
+        update_fps_stats(time.time())
+    
+    # 发布到共享内存帧总线，同机程序无需经过编码和网络
+    publish_to_frame_bus(processed_frame, frame, capture_time)
+    
+    # 编码缓存
+    thread_tuner.set_cv_stage("encode")
+    encode_start = time.perf_counter()
+    jpeg_bytes = encode_and_cache_frame(processed_frame, capture_time)
+    record_frame_stats(time.time(), capture_time, process_ms, (time.perf_counter() - encode_start) * 1000,
+                       jpeg_bytes)
+    
+    # 记录冷启动后第一帧真实画面的耗时
+    if startup_stats["time_to_first_frame"] is None:
+        startup_stats["time_to_first_frame"] = time.time() - process_start_time
+        logger.info(f"首个真实帧已就绪，距进程启动 {startup_stats['time_to_first_frame']:.2f}秒")
+    
+    return processed_frame
+
+def has_subscribers():
+    """是否有任何输出需要处理后的帧"""
+    now = time.time()
+    if active_clients > 0 or now - idle_state["last_subscriber_time"] < idle_enter_delay:
+        return True
+    if now - h264_last_access < h264_idle_timeout:
+        return True
+    # 组播没有订阅信号，启用后始终视为有订阅者
+    if multicast_target:
+        return True
+    # 帧总线读取端会定期写入心跳
+    return any(now - writer.last_reader_time() < idle_enter_delay for writer in list(frame_bus_writers.values()))
+
+def set_sensor_frame_rate(frame_rate=None):
+    """调整传感器帧率，frame_rate为None时恢复正常的帧间隔范围"""
+    if frame_rate:
+        duration = int(1e6 / frame_rate)
+        limits = (duration, duration)
+    else:
+        limits = capture_frame_duration_limits()
+    try:
+        with camera_lock:
+            if picam2 is not None:
+                picam2.set_controls({"FrameDurationLimits": limits})
+    except Exception as e:
+        logger.warning(f"设置传感器帧率失败: {e}")
+
+def update_sensor_exposure(luma):
+    """按分析流亮度图的平均亮度调整传感器曝光时间和增益，白天/夜间档案切换时同时调整帧间隔"""
+    if exposure_controller is None or luma is None or luma.size == 0:
+        return
+    if time.time() - exposure_controller.last_update < exposure_controller.update_interval:
+        return
+    profile = exposure_controller.profile
+    controls = exposure_controller.update(float(luma.mean()))
+    if controls is None:
+        return
+    if idle_state["idle"]:
+        # 空闲模式下保持空闲帧率，退出空闲时由 set_sensor_frame_rate 恢复档案的帧间隔
+        controls.pop("FrameDurationLimits", None)
+    try:
+        with camera_lock:
+            if picam2 is not None:
+                picam2.set_controls(controls)
+    except Exception as e:
+        logger.warning(f"设置传感器曝光失败: {e}")
+        return
+    if exposure_controller.profile != profile:
+        logger.info(f"曝光档案切换: {profile} -> {exposure_controller.profile}, "
+                    f"曝光 {controls['ExposureTime']}us, 增益 {controls['AnalogueGain']}")
+
+def enter_idle_mode():
+    """没有订阅者时降低传感器帧率，停止增强和编码"""
+    idle_state["idle"] = True
+    idle_state["since"] = time.time()
+    set_sensor_frame_rate(idle_frame_rate)
+    logger.info(f"没有订阅者，进入空闲模式 (传感器 {idle_frame_rate:.0f}fps，跳过增强和编码)")
+
+def exit_idle_mode():
+    """恢复正常帧率和完整处理"""
+    global idle_raw_frame
+    idle_state["idle"] = False
+    set_sensor_frame_rate(None)
+    with processing_lock:
+        idle_raw_frame = None
+    # 空闲期间的帧间隔不应计入FPS统计，否则性能调整会误判为帧率过低
+    reset_fps_stats()
+    logger.info(f"订阅者到来，退出空闲模式 (空闲 {time.time() - idle_state['since']:.0f}秒)")
+
+def wake_from_idle():
+    """订阅者到来时调用：空闲模式下立即处理最近采集的原始帧，
+    不必等待捕获线程在低帧率下完成下一次采集"""
+    global idle_raw_frame
+    if server_mode == "worker":
+        # 工作进程没有摄像头，通知采集进程退出空闲模式
+        try:
+            control_request({"type": "wake"})
+        except Exception as e:
+            logger.warning(f"通知采集进程退出空闲模式失败: {e}")
+        return
+    
+    idle_state["last_subscriber_time"] = time.time()
+    if not idle_state["idle"]:
+        return
+    
+    wake_start = time.time()
+    with processing_lock:
+        pending = idle_raw_frame
+        idle_raw_frame = None
+        if pending is None:
+            return
+        # 空闲期间的原始帧间隔不超过一个空闲帧间隔，处理后作为第一帧发送
+        deliver_frame(*pending)
+    idle_state["wakeups"] += 1
+    idle_state["last_wake_latency"] = time.time() - wake_start
+
+def capture_continuous():
+    """优化的帧捕获函数，专注于提高帧率和稳定性"""
+    global picam2, running, last_frame_time, idle_raw_frame
+    
+    logger.info("开始后台帧捕获线程")
+    
+    last_perf_check = time.time()
     
     while running:
         try:
-            if picam2 is None:
-                if not init_camera():
-                    time.sleep(1)
-                    continue
+            # 摄像头由监督线程负责初始化和恢复，未就绪时等待，客户端继续收到缓存帧
+            if picam2 is None or camera_state["state"] not in (CAMERA_RUNNING, CAMERA_DEGRADED):
+                time.sleep(0.05)
+                continue
             
             # 开始计时
             frame_start_time = time.time()
             current_time = frame_start_time
             
-            # 定期调用性能调整
-            if current_time - last_perf_check > 2.0:  # 每2秒检查一次
+            # 根据订阅者情况切换空闲模式
+            if idle_mode_enabled:
+                subscribed = has_subscribers()
+                if not subscribed and not idle_state["idle"]:
+                    enter_idle_mode()
+                elif subscribed and idle_state["idle"]:
+                    exit_idle_mode()
+                    last_perf_check = current_time
+            
+            # 定期调用性能调整，空闲模式下帧率本来就低，不做调整
+            if not idle_state["idle"] and current_time - last_perf_check > 2.0:  # 每2秒检查一次
                 adjust_performance()
                 last_perf_check = current_time
             
-            # 定期监控系统资源 - 使用内联函数替代全局函数
-            if has_psutil and current_time - last_resource_check > resource_monitor_interval:
-                resource_info = inline_monitor_resources()
-                last_resource_check = current_time
-                
-                # 如果内存使用过高，执行优化
-                if resource_info["reset_needed"]:
-                    inline_reset_memory()
-                    
-                # 如果CPU温度过高，降低处理级别
-                if resource_info["cpu_temp"] > 75:
-                    global processing_level, reduce_processing
-                    processing_level = 0
-                    reduce_processing = True
-                    logger.warning(f"CPU温度过高 ({resource_info['cpu_temp']:.1f}°C)，降低处理级别以避免过热")
+            # 资源采样在后台线程中进行，这里只在帧之间执行它请求的内存清理，
+            # 避免在处理过程中清空正在使用的夜视缓存
+            if memory_reset_needed:
+                reset_memory_buffers()
             
             try:
                 # 尽量减少锁的持有时间
                 with camera_lock:
+                    if detached_cameras:
+                        close_detached_cameras()
                     if picam2 is None:
                         continue
-                    frame = picam2.capture_array()
+                    generation = camera_generation
+                    # 主画面、分析用的lores流和元数据来自同一个请求
+                    completed_request = picam2.capture_request()
+                    try:
+                        frame = completed_request.make_array("main")
+                        lores = completed_request.make_array("lores") if camera_has_lores else None
+                        metadata = completed_request.get_metadata()
+                    finally:
+                        completed_request.release()
+                    capture_time = time.time()
+                
+                # 捕获期间摄像头已被监督线程释放，丢弃旧摄像头返回的帧
+                if generation != camera_generation:
+                    continue
+                note_capture_success()
+                
+                if frame is not None and frame.size > 0:
+                    # 光线、运动和有效性检测由分析线程在低分辨率亮度图上进行
+                    luma = publish_lores(frame, lores, metadata, capture_time)
+                    if luma is not None:
+                        update_sensor_exposure(luma)
+                
+                if frame is not None and frame.size > 0 and idle_state["idle"]:
+                    # 空闲模式：分析线程继续跟踪光线变化，保留原始帧供订阅者到来时立即处理
+                    with processing_lock:
+                        idle_raw_frame = (frame, capture_time)
+                    last_frame_time = time.time()
+                    idle_state["idle_frames"] += 1
+                    continue
                 
                 if frame is not None and frame.size > 0:
                     # 每一帧都做相同处理，保持一致性
-                    processed_frame = process_frame(frame)
-                    
-                    if processed_frame is not None:
-                        # 更新帧数据
-                        with frame_lock:
-                            latest_frame = processed_frame.copy()  # 使用copy避免引用问题
-                            last_frame_time = time.time()
-                            update_fps_stats(time.time())
-                        
-                        # 编码缓存
-                        encode_and_cache_frame(processed_frame)
-                        
-                        # 记录帧处理时间
-                        frame_times.append(time.time() - frame_start_time)
-                        if len(frame_times) > 30:
-                            # 每30帧记录一次平均处理时间
-                            avg_time = sum(frame_times) / len(frame_times)
-                            logger.debug(f"平均帧处理时间: {avg_time*1000:.1f}ms，约等于 {1/avg_time:.1f}fps")
-                            frame_times = []  # 清空列表避免内存增长
+                    with processing_lock:
+                        processed_frame = deliver_frame(frame, capture_time)
                     
                     # 适当释放帧引用，帮助垃圾回收
                     del frame
@@ -974,29 +2026,463 @@ def capture_continuous():
                 
             except Exception as e:
                 logger.error(f"捕获帧异常: {e}")
+                note_capture_error(e)
                 time.sleep(0.1)
                 
         except Exception as e:
             logger.error(f"帧捕获线程错误: {e}")
             time.sleep(0.1)
 
-def encode_and_cache_frame(frame):
-    """编码并缓存当前帧为JPEG格式"""
-    global encoded_frames_cache
+def store_encoded_frame(data, capture_time=None, hops=0, stale=False, placeholder=False, encode_time=None):
+    """更新编码帧缓存，并通知等待新帧的发送线程"""
+    global encoded_frames_cache, encoded_frame_seq
+    
+    with encoded_frames_cache_lock:
+        # 单帧缓存，确保最新
+        encoded_frame_seq += 1
+        entry = {"time": encode_time or time.time(), "data": data, "seq": encoded_frame_seq,
+                 "capture_time": capture_time, "hops": hops,
+                 "stale": stale, "placeholder": placeholder}
+        # multipart分段（头 + JPEG + 结尾）每帧只拼接一次，所有MJPEG客户端发送同一个bytes对象
+        entry["chunk"] = build_part_header(entry) + data + b'\r\n'
+        encoded_frames_cache = [entry]
+        
+        # 多进程模式下同时发布给HTTP工作进程
+        if encoded_ring_writer is not None:
+            try:
+                encoded_ring_writer.publish(data, entry["time"], capture_time, hops, stale, placeholder)
+            except Exception as e:
+                logger.error(f"写入编码帧环出错: {e}")
+    
+    with frame_ready_condition:
+        frame_ready_condition.notify_all()
+
+def encode_and_cache_frame(frame, capture_time=None):
+    """编码并缓存当前帧为JPEG格式，返回JPEG的字节数，失败时返回None"""
+    
+    if frame is None:
+        logger.warning("无法编码空帧")
+        return None
+    
+    try:
+        # 确保清晰的图像质量，但避免过大
+        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+        
+        store_encoded_frame(buffer.tobytes(), capture_time)
+        return buffer.size
+    except Exception as e:
+        logger.error(f"编码帧出错: {e}")
+        return None
+
+def multicast_sender_loop():
+    """组播发送线程：每个新编码帧只发送一次，与观看端数量无关"""
+    global multicast_stats
+    
+    try:
+        group, port = multicast_target.rsplit(":", 1)
+        sender = mjpeg_multicast.MulticastSender(group, int(port), multicast_ttl, multicast_interface)
+    except Exception as e:
+        logger.error(f"启动组播发送失败 ({multicast_target}): {e}")
+        return
+    
+    logger.info(f"组播发送已启动: {multicast_target} (TTL {multicast_ttl})")
+    multicast_stats = sender.stats
+    last_seq = 0
+    
+    while running:
+        try:
+            # 在独立线程中发送，捕获线程不会被网络发送阻塞
+            with frame_ready_condition:
+                frame_ready_condition.wait_for(lambda: encoded_frame_seq != last_seq, timeout=1.0)
+            
+            entry = get_cached_frame_entry()
+            if entry is None or entry.get("seq", last_seq) == last_seq:
+                continue
+            
+            last_seq = entry["seq"]
+            sender.send_frame(entry["data"], entry.get("capture_time"))
+        except Exception as e:
+            logger.error(f"组播发送出错: {e}")
+            time.sleep(0.1)
+    
+    sender.close()
+
+def publish_to_frame_bus(processed_frame, raw_frame, timestamp):
+    """把处理后（可选：原始）帧写入共享内存帧总线"""
+    if not frame_bus_enabled:
+        return
+    
+    try:
+        if "processed" not in frame_bus_writers:
+            frame_bus_writers["processed"] = frame_bus.FrameBusWriter("camera_processed", frame_bus_slots)
+            if frame_bus_raw_enabled:
+                frame_bus_writers["raw"] = frame_bus.FrameBusWriter("camera_raw", frame_bus_slots)
+        
+        # 第一帧总是发布，建立共享内存供读取端连接；之后没有读取端心跳的总线不再复制帧
+        now = time.time()
+        for name, frame in (("processed", processed_frame), ("raw", raw_frame)):
+            writer = frame_bus_writers.get(name)
+            if writer is None:
+                continue
+            if writer.shm is None or now - writer.last_reader_time() < idle_enter_delay:
+                writer.publish(frame, timestamp)
+            else:
+                writer.withdraw()
+    except Exception as e:
+        logger.error(f"发布帧到共享内存总线出错: {e}")
+
+def close_frame_bus():
+    """关闭并删除帧总线的共享内存"""
+    for writer in frame_bus_writers.values():
+        writer.close()
+    frame_bus_writers.clear()
+
+def control_request(message):
+    """工作进程向采集进程发送一条控制消息并返回应答"""
+    conn = Client(control_socket_path, family="AF_UNIX", authkey=control_authkey)
+    try:
+        conn.send(message)
+        if not conn.poll(control_timeout):
+            raise TimeoutError("等待采集进程应答超时")
+        return conn.recv()
+    finally:
+        conn.close()
+
+def handle_control_connection(conn):
+    """采集进程处理工作进程发来的一条控制消息"""
+    try:
+        message = conn.recv()
+        kind = message.get("type")
+        if kind == "http":
+            # 转发的HTTP请求由本进程的Flask应用直接处理，路由逻辑与单进程模式完全相同
+            client = app.test_client()
+            response = client.open(message["path"], method=message["method"], query_string=message["query"],
+                                   data=message["body"], headers=message["headers"])
+            conn.send((response.status_code, list(response.headers.items()), response.get_data()))
+        elif kind == "report":
+            worker_reports[message["pid"]] = dict(message, time=time.time())
+            if message["active_clients"] > 0:
+                idle_state["last_subscriber_time"] = time.time()
+            conn.send(True)
+        elif kind == "wake":
+            wake_from_idle()
+            conn.send(True)
+        elif kind == "status":
+            conn.send(build_status())
+        else:
+            conn.send(None)
+    except EOFError:
+        pass
+    except Exception as e:
+        logger.error(f"处理控制请求出错: {e}")
+    finally:
+        conn.close()
+
+def control_server_loop():
+    """采集进程的控制通道：接收工作进程转发的请求和状态上报"""
+    if os.path.exists(control_socket_path):
+        os.unlink(control_socket_path)
+    # Listener在进程退出时自动删除socket文件
+    listener = Listener(control_socket_path, family="AF_UNIX", authkey=control_authkey)
+    os.chmod(control_socket_path, 0o600)
+    logger.info(f"控制通道已启动: {control_socket_path}")
+    
+    while running:
+        try:
+            conn = listener.accept()
+        except Exception as e:
+            logger.warning(f"接受控制连接失败: {e}")
+            continue
+        # 每个请求单独一个线程，/debug/profile 等耗时请求不会阻塞其他控制请求
+        handler = threading.Thread(target=handle_control_connection, args=(conn,), name="control-request")
+        handler.daemon = True
+        handler.start()
+
+def get_worker_stats():
+    """各HTTP工作进程最近一次上报的状态"""
+    now = time.time()
+    return [
+        {"pid": pid, "active_clients": report["active_clients"], "max_clients": report["max_clients"],
+         "last_report_age": now - report["time"]}
+        for pid, report in sorted(worker_reports.items())
+    ]
+
+def worker_frame_loop():
+    """工作进程：从编码帧环读取采集进程发布的帧放入本进程的缓存，并定期上报客户端数量"""
+    reader = frame_bus.EncodedFrameReader(encoded_ring_name)
+    last_report = 0.0
+    thread_tuner.apply()
+    
+    while running:
+        try:
+            frame = reader.wait_next(timeout=worker_report_interval)
+            if frame is not None:
+                store_encoded_frame(frame["data"], frame["capture_time"], frame["hops"], frame["stale"],
+                                    frame["placeholder"], encode_time=frame["time"])
+            
+            now = time.time()
+            if now - last_report >= worker_report_interval:
+                last_report = now
+                # 工作进程不运行健康检查线程，由这里定期按角色设置新出现的线程
+                # （缩放编码时创建的OpenCV线程池、/events 推送线程等）
+                thread_tuner.apply()
+                with clients_lock:
+                    clients = active_clients
+                with traffic_lock:
+                    bytes_sent = traffic_stats["bytes_sent"]
+                control_request({"type": "report", "pid": os.getpid(), "active_clients": clients,
+                                 "max_clients": max_clients, "bytes_sent": bytes_sent})
+        except Exception as e:
+            logger.error(f"工作进程读取编码帧出错: {e}")
+            time.sleep(1)
+    
+    reader.close()
+
+def start_worker(index, listen_fd):
+    """启动一个HTTP工作进程，继承已绑定的监听socket"""
+    env = dict(os.environ, CAMERA_MODE="worker", CAMERA_WORKERS="0", CAMERA_WORKER_INDEX=str(index),
+               CAMERA_LISTEN_FD=str(listen_fd), CAMERA_CONTROL_SOCKET=control_socket_path,
+               CAMERA_CONTROL_KEY=control_authkey.hex())
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], env=env, pass_fds=(listen_fd,))
+    worker_processes[index] = process
+    logger.info(f"HTTP工作进程 {index} 已启动 (PID {process.pid})")
+
+def supervise_workers(listen_socket):
+    """启动所有工作进程，退出的工作进程自动重启，直到服务停止"""
+    for index in range(worker_count):
+        start_worker(index, listen_socket.fileno())
+    
+    while running:
+        time.sleep(1)
+        for index, process in list(worker_processes.items()):
+            code = process.poll()
+            if code is not None and running:
+                logger.warning(f"HTTP工作进程 {index} (PID {process.pid}) 已退出，退出码 {code}，重新启动")
+                worker_reports.pop(process.pid, None)
+                start_worker(index, listen_socket.fileno())
+
+def stop_workers():
+    for process in worker_processes.values():
+        if process.poll() is None:
+            process.terminate()
+    for process in worker_processes.values():
+        try:
+            process.wait(timeout=5)
+        except subprocess.TimeoutExpired:
+            process.kill()
+    worker_processes.clear()
+
+def h264_encoder_loop():
+    """H.264编码线程：每个处理后的帧只编码一次，所有fMP4/HLS观看者共享输出"""
+    global h264_streamer
+    
+    logger.info(f"H.264输出已启用 (码率 {h264_bitrate}, GOP {h264_gop}, 部分分段 {h264_part_frames} 帧)")
+    last_seq = 0
+    last_frame = None
+    
+    while running:
+        try:
+            with frame_ready_condition:
+                frame_ready_condition.wait_for(lambda: encoded_frame_seq != last_seq, timeout=1.0)
+            last_seq = encoded_frame_seq
+            
+            # 没有观看者时停止编码，节省CPU
+            if time.time() - h264_last_access > h264_idle_timeout:
+                if h264_streamer is not None:
+                    h264_streamer.close()
+                    h264_streamer = None
+                    logger.info("H.264观看者已全部离开，停止编码")
+                continue
+            
+            with frame_lock:
+                frame = latest_frame
+                capture_time = latest_frame_capture_time or time.time()
+            if frame is None or frame is last_frame:
+                continue
+            last_frame = frame
+            
+            h, w = frame.shape[:2]
+            # 时间戳、分段时长和HLS的TARGETDURATION按采集档案的帧率计算，切换档案后重建编码器
+            fps = CAPTURE_PROFILES[capture_profile_name]["fps"]
+            if h264_streamer is None or (h264_streamer.width, h264_streamer.height, h264_streamer.fps) != (w, h, fps):
+                if h264_streamer is not None:
+                    h264_streamer.close()
+                h264_streamer = h264_stream.H264Streamer(w, h, fps=fps, bitrate=h264_bitrate, gop=h264_gop,
+                                                         part_frames=h264_part_frames,
+                                                         max_segments=h264_max_segments)
+                logger.info(f"H.264编码器已创建: {w}x{h}@{fps:g}")
+            
+            h264_streamer.encode(frame, capture_time)
+        except Exception as e:
+            logger.error(f"H.264编码出错: {e}")
+            h264_streamer = None
+            time.sleep(0.5)
+
+def get_h264_streamer(timeout=5.0):
+    """标记有H.264观看者并返回编码器，编码器未就绪时等待"""
+    global h264_last_access
+    
+    if not h264_enabled or h264_stream is None:
+        return None
+    
+    h264_last_access = time.time()
+    wake_from_idle()
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        streamer = h264_streamer
+        if streamer is not None and streamer.init_segment is not None:
+            return streamer
+        time.sleep(0.05)
+    return None
+
+def h264_viewer_active():
+    """H.264观看者仍在接收时刷新访问时间"""
+    global h264_last_access
+    h264_last_access = time.time()
+    return running
+
+def summarize_latencies(values):
+    """计算延迟样本的统计值(毫秒)"""
+    if not values:
+        return {"count": 0}
+    samples = np.array(values) * 1000
+    return {
+        "count": len(samples),
+        "avg_ms": float(samples.mean()),
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "max_ms": float(samples.max())
+    }
+
+def get_relay_stats():
+    """返回中继状态和每跳延迟统计"""
+    stats = dict(relay_stats)
+    stats["hop_latency"] = summarize_latencies(list(relay_hop_latencies))
+    stats["origin_latency"] = summarize_latencies(list(relay_origin_latencies))
+    return stats
+
+def read_upstream_mjpeg(url):
+    """读取上游MJPEG流，逐帧返回 (jpeg, 采集时间, 上游延迟, 跳数, 是否过期)"""
+    response = urllib.request.urlopen(url, timeout=10)
+    try:
+        while running and not relay_reconnect_event.is_set():
+            line = response.readline()
+            if not line:
+                raise ConnectionError("上游连接已关闭")
+            if not line.startswith(b'--'):
+                continue
+            
+            headers = {}
+            while True:
+                line = response.readline().strip()
+                if not line:
+                    break
+                key, _, value = line.partition(b':')
+                headers[key.strip().lower()] = value.strip()
+            
+            length = int(headers.get(b'content-length', 0))
+            if length <= 0:
+                raise ValueError("上游multipart分段缺少Content-Length")
+            jpeg = response.read(length)
+            
+            yield (jpeg,
+                   float(headers.get(b'x-frame-timestamp', 0)) or None,
+                   float(headers.get(b'x-frame-latency', 0)),
+                   int(headers.get(b'x-frame-hops', 0)),
+                   headers.get(b'x-frame-stale') == b'1')
+    finally:
+        response.close()
+
+def read_upstream_websocket(url):
+    """读取上游WebSocket视频流"""
+    if simple_websocket is None:
+        raise RuntimeError("WebSocket中继需要安装simple-websocket")
+    
+    ws = simple_websocket.Client.connect(url)
+    try:
+        while running and not relay_reconnect_event.is_set():
+            message = ws.receive(timeout=10)
+            if message is None:
+                raise ConnectionError("上游WebSocket超时")
+            capture_time, latency, hops, stale = WS_FRAME_HEADER.unpack_from(message)
+            yield bytes(message[WS_FRAME_HEADER.size:]), capture_time or None, latency, hops, bool(stale)
+    finally:
+        ws.close()
+
+def read_upstream_frame_bus(name):
+    """从本机帧总线读取原始帧并编码，用于同机的独立服务进程"""
+    reader = frame_bus.FrameBusReader(name)
+    try:
+        while running and not relay_reconnect_event.is_set():
+            frame = reader.wait_next(timeout=10)
+            if frame is None:
+                raise ConnectionError(f"帧总线 {name} 超时")
+            _, buffer = cv2.imencode('.jpg', frame.array, [cv2.IMWRITE_JPEG_QUALITY, 85])
+            if not reader.is_valid(frame):
+                continue
+            yield buffer.tobytes(), frame.timestamp, 0.0, 0, False
+    finally:
+        reader.close()
+
+def relay_client_loop():
+    """中继模式：只向上游订阅一次，把收到的帧放入本地缓存，再转发给本节点的所有客户端"""
+    global last_frame_time
     
-    if frame is None:
-        logger.warning("无法编码空帧")
-        return
+    logger.info(f"中继模式已启动，上游: {relay_upstream}")
+    backoff = 1.0
     
-    try:
-        # 确保清晰的图像质量，但避免过大
-        _, buffer = cv2.imencode('.jpg', frame, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    while running:
+        relay_reconnect_event.clear()
+        last_capture_time = None
+        try:
+            if relay_upstream.startswith("ws://") or relay_upstream.startswith("wss://"):
+                frames = read_upstream_websocket(relay_upstream)
+            elif relay_upstream.startswith("bus://"):
+                frames = read_upstream_frame_bus(relay_upstream[len("bus://"):])
+            else:
+                frames = read_upstream_mjpeg(relay_upstream)
+            
+            for jpeg, capture_time, upstream_latency, hops, stale in frames:
+                # 上游MJPEG在没有新帧时会重复发送同一帧，按采集时间去重
+                if capture_time is not None and capture_time == last_capture_time and not stale:
+                    continue
+                last_capture_time = capture_time
+                
+                now = time.time()
+                store_encoded_frame(jpeg, capture_time, hops + 1, stale)
+                last_frame_time = now
+                update_fps_stats(now)
+                record_frame_stats(now, capture_time, jpeg_bytes=len(jpeg))
+                
+                if capture_time:
+                    # 假设各节点时钟已通过NTP同步，本跳延迟为到源头的延迟减去上游节点的延迟
+                    origin_latency = now - capture_time
+                    relay_origin_latencies.append(origin_latency)
+                    relay_hop_latencies.append(origin_latency - upstream_latency)
+                
+                if relay_stats["state"] != "connected":
+                    relay_stats["state"] = "connected"
+                    logger.info(f"已连接上游 {relay_upstream} (距源头 {hops + 1} 跳)")
+                relay_stats["frames"] += 1
+                relay_stats["hops"] = hops + 1
+                backoff = 1.0
+                
+        except Exception as e:
+            relay_stats["last_error"] = str(e)
+            logger.error(f"中继上游连接出错: {e}")
         
-        with encoded_frames_cache_lock:
-            # 单帧缓存，确保最新
-            encoded_frames_cache = [{"time": time.time(), "data": buffer.tobytes()}]
-    except Exception as e:
-        logger.error(f"编码帧出错: {e}")
+        if not running:
+            break
+        
+        # 断开期间继续向客户端提供最后一帧，并标记为过期
+        relay_stats["state"] = "connecting"
+        relay_stats["reconnects"] += 1
+        entry = get_cached_frame_entry()
+        if entry is not None and not entry.get("placeholder") and not entry.get("stale"):
+            store_encoded_frame(entry["data"], entry.get("capture_time"), entry.get("hops", 0), stale=True)
+        
+        relay_reconnect_event.wait(timeout=backoff)
+        backoff = min(backoff * 2, 30.0)
 
 def get_cached_frame():
     """获取最新的缓存帧"""
@@ -1007,40 +2493,134 @@ def get_cached_frame():
             return b''
         return encoded_frames_cache[0]["data"]
 
-def generate_frames():
-    """优化的帧生成器，提高帧率和减少闪烁"""
+def get_cached_frame_entry():
+    """获取最新的缓存帧及其元数据（是否为占位帧、过期帧等）"""
+    with encoded_frames_cache_lock:
+        if not encoded_frames_cache:
+            return None
+        return encoded_frames_cache[0]
+
+def build_part_header(entry):
+    """生成multipart分段头，附带帧的采集时间、延迟和转发跳数，供中继节点和客户端使用"""
+    headers = [b'--frame', b'Content-Type: image/jpeg', b'Content-Length: %d' % len(entry["data"])]
+    if entry.get("capture_time"):
+        headers.append(b'X-Frame-Timestamp: %.6f' % entry["capture_time"])
+        headers.append(b'X-Frame-Latency: %.6f' % (entry["time"] - entry["capture_time"]))
+    headers.append(b'X-Frame-Hops: %d' % entry.get("hops", 0))
+    if entry.get("stale"):
+        # 摄像头恢复或上游断开期间发送的是带过期标记的最后一帧
+        headers.append(b'X-Frame-Stale: 1')
+    return b'\r\n'.join(headers) + b'\r\n\r\n'
+
+def build_ws_message(entry):
+    """生成WebSocket视频帧消息: 固定长度消息头 + JPEG数据"""
+    capture_time = entry.get("capture_time") or 0.0
+    latency = entry["time"] - capture_time if capture_time else 0.0
+    return WS_FRAME_HEADER.pack(capture_time, latency, entry.get("hops", 0), 1 if entry.get("stale") else 0) + entry["data"]
+
+def wait_for_new_frame(last_seq, timeout=1.0):
+    """等待比last_seq更新的编码帧，超时返回None"""
+    with frame_ready_condition:
+        frame_ready_condition.wait_for(lambda: encoded_frame_seq != last_seq, timeout=timeout)
+    entry = get_cached_frame_entry()
+    if entry is None or entry["seq"] == last_seq:
+        return None
+    return entry
+
+def parse_client_size(value):
+    """解析客户端请求的固定画面尺寸 "WxH"，未指定时返回None，无效时抛出ValueError"""
+    if not value:
+        return None
+    width, height = (int(v) for v in value.lower().split("x"))
+    if not (16 <= width <= MAX_CLIENT_SIZE[0] and 16 <= height <= MAX_CLIENT_SIZE[1]):
+        raise ValueError(f"尺寸超出范围 (16x16 - {MAX_CLIENT_SIZE[0]}x{MAX_CLIENT_SIZE[1]})")
+    return width, height
+
+def jpeg_dimensions(data):
+    """从JPEG的SOF段读取 (宽, 高)，不解码图像；无法解析时返回None"""
+    offset = 2
+    while offset + 9 <= len(data):
+        if data[offset] != 0xFF:
+            return None
+        marker = data[offset + 1]
+        length = (data[offset + 2] << 8) | data[offset + 3]
+        # SOF0-SOF15，排除DHT(C4)、JPG(C8)、DAC(CC)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            height = (data[offset + 5] << 8) | data[offset + 6]
+            width = (data[offset + 7] << 8) | data[offset + 8]
+            return width, height
+        offset += 2 + length
+    return None
+
+def get_scaled_entry(entry, size):
+    """返回缩放到客户端指定尺寸的编码帧条目
+
+    画面尺寸与请求一致（通常如此，除非切换了采集档案）时直接返回原条目；否则每个尺寸每帧
+    只解码、缩放、编码一次，结果由请求该尺寸的所有客户端共享。缩小较多时利用JPEG的DCT缩放
+    在解码阶段直接得到1/2、1/4或1/8尺寸。
+    """
+    if entry is None or size is None:
+        return entry
+    with scaled_frames_lock:
+        cached = scaled_frames.get(size)
+    if cached is not None and cached["seq"] == entry["seq"]:
+        return cached
+    source_size = jpeg_dimensions(entry["data"])
+    if source_size is None or source_size == size:
+        return entry
+
+    # 解码和编码在锁外进行，不阻塞其他尺寸的客户端；同时到达的同尺寸客户端最多重复计算一次
+    try:
+        flag = cv2.IMREAD_COLOR
+        for factor, reduced_flag in ((8, cv2.IMREAD_REDUCED_COLOR_8), (4, cv2.IMREAD_REDUCED_COLOR_4),
+                                     (2, cv2.IMREAD_REDUCED_COLOR_2)):
+            if source_size[0] // factor >= size[0] and source_size[1] // factor >= size[1]:
+                flag = reduced_flag
+                break
+        image = cv2.imdecode(np.frombuffer(entry["data"], np.uint8), flag)
+        interpolation = cv2.INTER_AREA if image.shape[1] > size[0] else cv2.INTER_LINEAR
+        image = cv2.resize(image, size, interpolation=interpolation)
+        _, buffer = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    except Exception as e:
+        logger.error(f"缩放编码帧到 {size[0]}x{size[1]} 出错: {e}")
+        return entry
+
+    scaled = dict(entry, data=buffer.tobytes())
+    scaled["chunk"] = build_part_header(scaled) + scaled["data"] + b'\r\n'
+    with scaled_frames_lock:
+        cached = scaled_frames.get(size)
+        if cached is not None and cached["seq"] >= entry["seq"]:
+            # 其他客户端已发布了同一帧或更新的帧
+            return cached if cached["seq"] == entry["seq"] else scaled
+        if size not in scaled_frames and len(scaled_frames) >= MAX_SCALED_SIZES:
+            scaled_frames.pop(next(iter(scaled_frames)))
+        scaled_frames[size] = scaled
+    return scaled
+
+def generate_frames(size=None):
+    """MJPEG帧生成器（经werkzeug写出），每个新帧只发送一次；指定size时发送缩放到该尺寸的画面"""
     global running, active_clients
     client_id = time.time()
-    target_interval = 1.0 / 30.0  # 目标30fps
     
     with clients_lock:
         active_clients += 1
         logger.info(f"客户端 {client_id:.2f} 连接，当前活跃客户端: {active_clients}")
+    wake_from_idle()
     
     try:
-        last_frame_time = time.time()
+        last_seq = None
         while running:
             try:
-                # 保持固定间隔发送帧
-                now = time.time()
-                time_to_wait = target_interval - (now - last_frame_time)
-                
-                if time_to_wait > 0:
-                    # 使用极短的休眠
-                    time.sleep(0.001)
-                    continue
-                
-                # 重置时间
-                last_frame_time = now
-                
-                # 获取缓存帧
-                buffer = get_cached_frame()
-                if buffer is None:
+                # 等待新编码的帧，而不是按固定间隔轮询，避免重复发送同一帧
+                entry = wait_for_new_frame(last_seq)
+                if entry is None:
                     continue
+                last_seq = entry["seq"]
                 
-                # 发送帧数据
-                yield (b'--frame\r\n'
-                       b'Content-Type: image/jpeg\r\n\r\n' + buffer + b'\r\n')
+                # 发送预先拼接好的共享分段
+                chunk = get_scaled_entry(entry, size)["chunk"]
+                yield chunk
+                count_bytes_sent(len(chunk))
                 
             except Exception as e:
                 logger.error(f"生成帧异常: {e}")
@@ -1053,11 +2633,85 @@ def generate_frames():
             active_clients -= 1
             logger.info(f"客户端 {client_id:.2f} 断开，当前活跃客户端: {active_clients}")
 
+def stream_frames_direct(sock, size=None):
+    """接管客户端socket直接发送MJPEG流
+    
+    每帧对每个客户端只是一次sendall，发送的是所有客户端共享的分段，
+    不经过werkzeug的分块编码（每帧3次写入）。发送阻塞时只影响本客户端的线程，
+    下一次取到的总是最新帧，慢速客户端自然跳帧
+    """
+    global active_clients
+    client_id = time.time()
+    
+    with clients_lock:
+        active_clients += 1
+        logger.info(f"客户端 {client_id:.2f} 连接(直接发送)，当前活跃客户端: {active_clients}")
+    wake_from_idle()
+    
+    try:
+        sock.settimeout(mjpeg_send_timeout)
+        if mjpeg_send_buffer > 0:
+            # 缩小发送缓冲区，慢速客户端在内核中积压的帧更少，延迟更低
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, mjpeg_send_buffer)
+        sock.sendall(b'HTTP/1.1 200 OK\r\n'
+                     b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                     b'Cache-Control: no-store\r\n'
+                     b'Connection: close\r\n\r\n')
+        last_seq = None
+        while running:
+            entry = wait_for_new_frame(last_seq)
+            if entry is None:
+                continue
+            last_seq = entry["seq"]
+            chunk = get_scaled_entry(entry, size)["chunk"]
+            sock.sendall(chunk)
+            count_bytes_sent(len(chunk))
+    except (OSError, socket.timeout):
+        pass
+    except Exception as e:
+        logger.error(f"直接发送帧异常: {e}")
+    finally:
+        with clients_lock:
+            active_clients -= 1
+            logger.info(f"客户端 {client_id:.2f} 断开，当前活跃客户端: {active_clients}")
+
+@app.before_request
+def forward_to_capture_process():
+    """工作进程中把视频流以外的请求转发给采集进程"""
+    if server_mode != "worker" or request.endpoint in WORKER_LOCAL_ENDPOINTS:
+        return None
+    if request.endpoint in WORKER_UNSUPPORTED_ENDPOINTS:
+        return "多进程模式下不支持H.264输出", 501
+    
+    cacheable = request.method == "GET" and request.path in STATUS_CACHED_PATHS and not request.query_string
+    cached = worker_status_cache.get(request.path) if cacheable else None
+    if cached is not None and time.time() - cached[0] < status_cache_period:
+        status_code, headers, body = cached[1]
+        return Response(body, status=status_code, headers=headers)
+    
+    try:
+        status_code, headers, body = control_request({
+            "type": "http",
+            "method": request.method,
+            "path": request.path,
+            # test_client 只接受字符串形式的查询串，按UTF-8解码后在采集进程中会编码回原来的字节
+            "query": request.query_string.decode("utf-8", "replace"),
+            "body": request.get_data(),
+            "headers": {"Content-Type": request.content_type} if request.content_type else {}
+        })
+    except Exception as e:
+        logger.error(f"转发请求到采集进程失败 ({request.path}): {e}")
+        return "采集进程不可用", 503
+    
+    if cacheable:
+        worker_status_cache[request.path] = (time.time(), (status_code, headers, body))
+    return Response(body, status=status_code, headers=headers)
+
 @app.route('/')
 def index():
     # 获取当前IP和服务URL
     ip = get_ip_address()
-    service_url = f"http://{ip}:8000/video_feed"
+    service_url = f"http://{ip}:{server_port}/video_feed"
     
     return f"""
     <!DOCTYPE html>
@@ -1171,38 +2825,423 @@ def index():
 
 @app.route('/video_feed')
 def video_feed():
+    # 可选的固定尺寸，切换采集档案后仍按该尺寸发送
+    try:
+        size = parse_client_size(request.args.get("size"))
+    except ValueError as e:
+        return f"无效的尺寸参数: {e}", 400
+    
     # 限制最大客户端数量
     with clients_lock:
         if active_clients >= max_clients:
             return "达到最大连接数，请稍后再试", 503
     
+    # werkzeug提供底层socket时直接写入，否则经WSGI逐块写出
+    sock = request.environ.get("werkzeug.socket")
+    if mjpeg_direct_send and sock is not None:
+        stream_frames_direct(sock, size)
+        return DetachedConnectionResponse("MJPEG连接已关闭")
+    
     # 返回视频流
-    return Response(generate_frames(),
+    return Response(generate_frames(size),
                     mimetype='multipart/x-mixed-replace; boundary=frame')
 
+@app.route('/snapshot.jpg')
+def snapshot():
+    """返回最新的一帧JPEG，可用 ?size=WxH 指定尺寸"""
+    try:
+        size = parse_client_size(request.args.get("size"))
+    except ValueError as e:
+        return f"无效的尺寸参数: {e}", 400
+    wake_from_idle()
+    entry = get_scaled_entry(get_cached_frame_entry(), size)
+    if entry is None:
+        return "暂无可用画面", 503
+    
+    headers = {"Cache-Control": "no-store", "X-Frame-Hops": str(entry.get("hops", 0))}
+    if entry.get("capture_time"):
+        headers["X-Frame-Timestamp"] = f"{entry['capture_time']:.6f}"
+    if entry.get("stale"):
+        headers["X-Frame-Stale"] = "1"
+    count_bytes_sent(len(entry["data"]))
+    return Response(entry["data"], mimetype='image/jpeg', headers=headers)
+
+class DetachedConnectionResponse(Response):
+    """连接被接管（WebSocket升级或直接写socket）并结束后返回，阻止werkzeug在该连接上再写HTTP响应"""
+    def __init__(self, message="连接已被接管并关闭"):
+        super().__init__()
+        self.message = message
+
+    def __call__(self, environ, start_response):
+        raise ConnectionError(self.message)
+
+@app.route('/ws/video_feed', websocket=True)
+def ws_video_feed():
+    """WebSocket视频流，每个新帧作为一条二进制消息发送（消息头格式见 WS_FRAME_HEADER）"""
+    global active_clients
+    
+    if simple_websocket is None:
+        return "服务器未安装simple-websocket，无法提供WebSocket视频流", 501
+    
+    try:
+        size = parse_client_size(request.args.get("size"))
+    except ValueError as e:
+        return f"无效的尺寸参数: {e}", 400
+    
+    with clients_lock:
+        if active_clients >= max_clients:
+            return "达到最大连接数，请稍后再试", 503
+    
+    ws = simple_websocket.Server.accept(request.environ)
+    client_id = time.time()
+    with clients_lock:
+        active_clients += 1
+        logger.info(f"WebSocket客户端 {client_id:.2f} 连接，当前活跃客户端: {active_clients}")
+    wake_from_idle()
+    
+    try:
+        last_seq = None
+        while running and ws.connected:
+            entry = wait_for_new_frame(last_seq)
+            if entry is None:
+                continue
+            last_seq = entry["seq"]
+            message = build_ws_message(get_scaled_entry(entry, size))
+            ws.send(message)
+            count_bytes_sent(len(message))
+    except simple_websocket.ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"WebSocket发送异常: {e}")
+    finally:
+        with clients_lock:
+            active_clients -= 1
+            logger.info(f"WebSocket客户端 {client_id:.2f} 断开，当前活跃客户端: {active_clients}")
+    
+    return DetachedConnectionResponse("WebSocket连接已关闭")
+
+@app.route('/video.mp4')
+def h264_video_feed():
+    """H.264分片MP4流，浏览器可用MediaSource Extensions播放"""
+    global active_clients
+    
+    with clients_lock:
+        if active_clients >= max_clients:
+            return "达到最大连接数，请稍后再试", 503
+    
+    streamer = get_h264_streamer()
+    if streamer is None:
+        return "H.264输出未启用或编码器未就绪", 503
+    
+    def generate():
+        global active_clients
+        with clients_lock:
+            active_clients += 1
+        try:
+            for chunk in streamer.iter_fmp4(h264_viewer_active):
+                yield chunk
+        finally:
+            with clients_lock:
+                active_clients -= 1
+    
+    return Response(generate(), mimetype='video/mp4', headers={"Cache-Control": "no-store"})
+
+@app.route('/ws/video.mp4', websocket=True)
+def ws_h264_video_feed():
+    """通过WebSocket发送fMP4：第一条消息为初始化段，之后每条消息为一个分片"""
+    global active_clients
+    
+    if simple_websocket is None:
+        return "服务器未安装simple-websocket，无法提供WebSocket视频流", 501
+    
+    streamer = get_h264_streamer()
+    if streamer is None:
+        return "H.264输出未启用或编码器未就绪", 503
+    
+    ws = simple_websocket.Server.accept(request.environ)
+    with clients_lock:
+        active_clients += 1
+    try:
+        for chunk in streamer.iter_fmp4(lambda: ws.connected and h264_viewer_active()):
+            ws.send(chunk)
+    except simple_websocket.ConnectionClosed:
+        pass
+    except Exception as e:
+        logger.error(f"WebSocket H.264发送异常: {e}")
+    finally:
+        with clients_lock:
+            active_clients -= 1
+    
+    return DetachedConnectionResponse("WebSocket连接已关闭")
+
+@app.route('/hls/stream.m3u8')
+def hls_playlist():
+    """LL-HLS播放列表，支持 _HLS_msn/_HLS_part 阻塞式刷新"""
+    streamer = get_h264_streamer()
+    if streamer is None:
+        return "H.264输出未启用或编码器未就绪", 503
+    
+    msn = request.args.get("_HLS_msn", type=int)
+    if msn is not None:
+        streamer.wait_for_part(msn, request.args.get("_HLS_part", 0, type=int))
+    
+    playlist = streamer.playlist()
+    if playlist is None:
+        return "播放列表尚未就绪", 503
+    return Response(playlist, mimetype='application/vnd.apple.mpegurl', headers={"Cache-Control": "no-store"})
+
+@app.route('/hls/init.mp4')
+def hls_init_segment():
+    streamer = get_h264_streamer()
+    if streamer is None:
+        return "H.264输出未启用或编码器未就绪", 503
+    return Response(streamer.init_segment, mimetype='video/mp4')
+
+@app.route('/hls/seg<int:seq>.m4s')
+def hls_segment(seq):
+    streamer = get_h264_streamer()
+    data = streamer.get_segment(seq) if streamer is not None else None
+    if data is None:
+        return "分段不存在", 404
+    return Response(data, mimetype='video/iso.segment')
+
+@app.route('/hls/seg<int:seq>.<int:part>.m4s')
+def hls_part(seq, part):
+    streamer = get_h264_streamer()
+    if streamer is None:
+        return "H.264输出未启用或编码器未就绪", 503
+    # 预加载提示指向的部分分段可能尚未生成，阻塞等待
+    streamer.wait_for_part(seq, part)
+    data = streamer.get_part(seq, part)
+    if data is None:
+        return "部分分段不存在", 404
+    return Response(data, mimetype='video/iso.segment')
+
+def build_status():
+    """生成状态快照，/status 和 /events 共用"""
+    # 捕获线程每帧都要获取stats_lock，锁内只复制帧率统计，其余字段各自加锁或不需要加锁
+    with stats_lock:
+        clients = active_clients
+        fps = dict(fps_stats)
+    return {
+        "active_clients": clients,
+        "max_clients": max_clients,
+        "fps": fps,
+        "uptime": time.time() - service_start_time,
+        "mode": server_mode,
+        "camera_status": camera_state["state"] if server_mode == "camera" else relay_stats["state"],
+        "camera": get_camera_state() if server_mode == "camera" else None,
+        "relay": get_relay_stats() if server_mode == "relay" else None,
+        "server_ip": get_ip_address(),
+        "reduce_processing": reduce_processing,
+        "processing_level": processing_level,
+        "processing_scale": get_processing_scale(),
+        "capture_profile": get_capture_profile_state(),
+        "pipeline": dict(processing_engine.stats(), night_mode=night_vision_state["mode"]),
+        "exposure": exposure_controller.state() if exposure_controller is not None else None,
+        "analysis": dict(analysis_stats, fps=analysis_fps),
+        "light": {
+            "source_setting": light_source_setting,
+            "source": light_state["source"],
+            "level": round(float(light_state["level"]), 1) if light_state["level"] is not None else None,
+            "threshold": light_threshold,
+            "inputs": light_state["inputs"],
+            "counts": light_estimator.counts if light_estimator is not None else None
+        },
+        "startup": startup_stats,
+        "multicast": dict(multicast_stats, target=multicast_target) if multicast_target else None,
+        "h264": dict(h264_streamer.stats, bitrate=h264_bitrate, gop=h264_gop) if h264_streamer is not None else None,
+        "resources": resource_sampler.latest() if resource_sampler is not None else None,
+        "idle": dict(idle_state, enabled=idle_mode_enabled, idle_fps=idle_frame_rate),
+        "logging": log_pipe.stats(),
+        "workers": get_worker_stats() if worker_count > 0 else None,
+        "last_frame_age": round(time.time() - last_frame_time, 1),
+        "night_vision": {
+            "enabled": night_vision_enabled,
+            "auto": night_vision_auto,
+            "active": bool(night_vision_active),
+            "light_level": round(float(last_light_level), 1),
+            "threshold": light_threshold,
+            "strength": night_vision_strength,
+            "green_tint": enable_green_tint
+        },
+        "thread_tuning": dict(thread_tuner.settings(), errors=len(thread_tuner.errors)),
+        "history": {"bytes": stats_history_store.nbytes,
+                    "tiers": {name: tier["span"] for name, tier in stats_history_store.tiers().items()}}
+                   if stats_history_store is not None else None,
+        "events": {"interval": events_interval,
+                   "subscribers": status_broadcaster.subscribers if status_broadcaster is not None else 0}
+    }
+
+def get_capture_profile_state():
+    """当前采集档案、可用档案和切换统计"""
+    profile = CAPTURE_PROFILES[capture_profile_name]
+    return dict(capture_profile_stats, name=capture_profile_name, size=profile["size"], fps=profile["fps"],
+                available={name: dict(value) for name, value in CAPTURE_PROFILES.items()})
+
 @app.route('/status')
 def status():
     """返回服务器状态信息"""
-    with stats_lock:
-        status_data = {
-            "active_clients": active_clients,
-            "max_clients": max_clients,
-            "fps": fps_stats,
-            "uptime": time.time() - service_start_time,
-            "camera_status": "running" if picam2 is not None else "stopped",
-            "server_ip": get_ip_address(),
-            "reduce_processing": reduce_processing
-        }
-    return status_data
+    return build_status()
+
+def fetch_capture_status():
+    """工作进程中从采集进程获取状态快照"""
+    return control_request({"type": "status"})
+
+@app.route('/events')
+def status_events_endpoint():
+    """Server-Sent Events：先推送完整状态快照，之后按 CAMERA_EVENTS_INTERVAL 推送变化的字段"""
+    if status_broadcaster is None:
+        return {"status": "error", "message": "状态推送未启动"}, 404
+    return Response(status_broadcaster.subscribe(), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route('/capture_profile', methods=['GET', 'POST'])
+def capture_profile_endpoint():
+    """查询或切换采集档案，POST {"profile": "drive"}"""
+    if request.method == 'GET':
+        return get_capture_profile_state()
+    if server_mode != "camera":
+        return {"status": "error", "message": "中继模式下不能切换采集档案"}, 400
+    
+    data = request.get_json(silent=True)
+    if not data or 'profile' not in data:
+        return {"status": "error", "message": "缺少档案参数"}, 400
+    if data['profile'] not in CAPTURE_PROFILES:
+        return {"status": "error", "message": f"未知的采集档案: {data['profile']}",
+                "available": list(CAPTURE_PROFILES)}, 400
+    
+    ok, message = switch_capture_profile(data['profile'])
+    if not ok:
+        return {"status": "error", "message": message}, 500
+    return {"status": "success", "message": message, "profile": get_capture_profile_state()}
 
 @app.route('/reset_camera', methods=['POST'])
 def reset_camera_endpoint():
-    """手动重置摄像头的API端点"""
-    success = reset_camera()
-    if success:
-        return {"status": "success", "message": "摄像头已重置"}
-    else:
-        return {"status": "error", "message": "摄像头重置失败"}, 500
+    """手动重置摄像头的API端点，重置在后台进行，立即返回"""
+    reset_camera()
+    return {"status": "success", "message": "摄像头重置已开始", "camera": get_camera_state()}
+
+@app.route('/debug/inject_fault', methods=['POST'])
+def inject_fault_endpoint():
+    """向合成摄像头注入故障，用于验证恢复流程"""
+    if camera_source != "synthetic":
+        return {"status": "error", "message": "仅合成摄像头支持故障注入"}, 400
+    
+    data = request.get_json(silent=True) or {}
+    fault = data.get("fault", "error")
+    count = int(data.get("count", 1))
+    
+    with synthetic_faults_lock:
+        if fault == "error":
+            synthetic_faults["pending_errors"] += count
+        elif fault == "stall":
+            synthetic_faults["pending_stall"] = True
+            synthetic_faults["stall_seconds"] = float(data.get("seconds", synthetic_faults["stall_seconds"]))
+        elif fault == "init_fail":
+            synthetic_faults["init_fail"] += count
+        else:
+            return {"status": "error", "message": f"未知故障类型: {fault}"}, 400
+    
+    logger.warning(f"已注入合成故障: {fault} x{count}")
+    return {"status": "success", "fault": fault, "count": count}
+
+@app.route('/debug/resources')
+def resource_history_endpoint():
+    """返回后台资源采样的历史记录，可用 ?window=秒数 限制范围"""
+    if resource_sampler is None:
+        return {"status": "error", "message": "资源采样未启用"}, 404
+    window = request.args.get("window", type=float)
+    return {"interval": resource_sample_interval, "samples": resource_sampler.get_history(window)}
+
+@app.route('/stats/history')
+def stats_history_endpoint():
+    """查询统计历史: ?metric=fps,latency_ms&window=秒数&step=秒数，不带metric时返回可用指标和各级容量
+    
+    step 缺省时按窗口自动选择，约300个点；step=0 返回不降采样的原始样本。
+    """
+    if stats_history_store is None:
+        return {"status": "error", "message": "统计历史未启用"}, 404
+    
+    metrics = [name for name in request.args.get("metric", "").split(",") if name]
+    if not metrics:
+        return {"metrics": stats_history_store.metrics(), "tiers": stats_history_store.tiers(),
+                "bytes": stats_history_store.nbytes}
+    
+    window = request.args.get("window", 300.0, type=float)
+    step = request.args.get("step", type=float)
+    if window <= 0 or (step is not None and step < 0):
+        return {"status": "error", "message": "window必须大于0，step不能为负数"}, 400
+    if step is None:
+        step = window / 300 if window > 300 else None
+    
+    now = time.time()
+    results = {}
+    for metric in metrics:
+        try:
+            results[metric] = stats_history_store.query(metric, window, step or None, now)
+        except KeyError:
+            return {"status": "error", "message": f"未知的指标: {metric}",
+                    "metrics": stats_history_store.metrics()}, 400
+    return {"time": now, "window": window, "step": step, "results": results}
+
+@app.route('/debug/light')
+def light_history_endpoint():
+    """返回光线检测的历史记录（输入、光线水平和夜视判断），可用 ?window=秒数 限制范围"""
+    window = request.args.get("window", type=float)
+    with light_history_lock:
+        samples = list(light_history)
+    if window is not None:
+        cutoff = time.time() - window
+        samples = [s for s in samples if s["time"] >= cutoff]
+    return {"source_setting": light_source_setting, "samples": samples}
+
+@app.route('/debug/threads')
+def debug_threads():
+    """各线程实际生效的CPU亲和性、调度策略和nice值，以及当前的OpenCV线程数"""
+    return thread_tuner.report()
+
+@app.route('/debug/memory')
+def memory_diff_endpoint():
+    """返回自基准快照以来内存增长最多的代码位置
+
+    参数: limit=条数, start=1 在运行时启用跟踪, reset=1 重新建立基准快照
+    """
+    global allocation_tracker
+    if request.args.get("start") == "1" and (allocation_tracker is None or not allocation_tracker.active):
+        allocation_tracker = resource_monitor.AllocationTracker(tracemalloc_frames or 10)
+        allocation_tracker.start()
+        return {"status": "success", "message": "已启用内存分配跟踪并建立基准快照"}
+    
+    if allocation_tracker is None or not allocation_tracker.active:
+        return {"status": "error", "message": "内存分配跟踪未启用，设置 CAMERA_TRACEMALLOC 或访问 /debug/memory?start=1"}, 400
+    
+    result = allocation_tracker.diff(limit=request.args.get("limit", 15, type=int))
+    if request.args.get("reset") == "1":
+        allocation_tracker.reset_baseline()
+    return result
+
+@app.route('/debug/profile')
+def profile_endpoint():
+    """对运行中的服务做栈采样分析
+
+    参数: seconds=采样时长(最长60秒), thread=capture|http|all|线程名, interval=采样间隔(毫秒),
+          top=排行条数, format=json|collapsed（collapsed可直接生成火焰图）
+    """
+    seconds = request.args.get("seconds", 5.0, type=float)
+    thread = request.args.get("thread", "all")
+    interval = request.args.get("interval", 10.0, type=float) / 1000
+    
+    try:
+        # 采样期间本请求线程只在等待，不计入结果
+        result = sampling_profiler.profile(seconds, thread, interval, exclude=[threading.get_ident()])
+    except sampling_profiler.ProfilerBusy as e:
+        return {"status": "error", "message": str(e)}, 409
+    
+    logger.info(f"完成 {result.elapsed:.1f}秒 的采样分析 (线程: {thread}, {result.samples} 次采样)")
+    if request.args.get("format") == "collapsed":
+        return Response(result.collapsed(), mimetype='text/plain')
+    return result.summary(request.args.get("top", 20, type=int))
 
 @app.route('/restart_service', methods=['POST'])
 def restart_service_endpoint():
@@ -1218,78 +3257,188 @@ def restart_service_endpoint():
         logger.error(f"重启服务失败: {e}")
         return {"status": "error", "message": f"重启服务失败: {e}"}, 500
 
+# 静态调试页面：通过 /events 接收状态快照和增量在浏览器端渲染，服务端不再为每次刷新生成HTML
+DEBUG_PAGE = """<!DOCTYPE html>
+<html>
+<head>
+    <title>摄像头调试信息</title>
+    <meta charset="utf-8">
+    <style>
+        body { font-family: monospace; padding: 20px; }
+        .stat { margin-bottom: 5px; }
+        .error { color: red; }
+        .good { color: green; }
+        form { margin-bottom: 5px; }
+    </style>
+</head>
+<body>
+    <h1>摄像头服务调试信息</h1>
+    <div class="stat">状态推送: <span id="connection" class="error">连接中</span></div>
+    <div class="stat">摄像头状态: <span id="camera_state"></span></div>
+    <div class="stat">摄像头恢复次数: <span id="recovery"></span></div>
+    <div class="stat">服务运行时间: <span id="uptime"></span>秒</div>
+    <div class="stat">最后一帧时间: <span id="last_frame_age"></span>秒前</div>
+    <div class="stat">活跃客户端: <span id="clients"></span></div>
+    <div class="stat">当前FPS: <span id="fps_current"></span></div>
+    <div class="stat">最小FPS: <span id="fps_min"></span></div>
+    <div class="stat">最大FPS: <span id="fps_max"></span></div>
+    <div class="stat">处理模式: <span id="processing"></span></div>
+    <div class="stat">采集档案: <span id="capture_profile"></span></div>
+    <div class="stat">空闲模式: <span id="idle"></span></div>
+    <div class="stat">服务器IP: <span id="server_ip"></span></div>
+    <div class="stat">CPU: <span id="cpu"></span></div>
+    <div class="stat">线程CPU: <span id="threads"></span></div>
+    <div>
+        <h3>操作</h3>
+        <form data-action="/reset_camera"><button type="submit">重置摄像头</button></form>
+        <form data-action="/capture_profile" data-field="profile">
+            <label for="profile">采集档案:</label>
+            <select id="profile"></select>
+            <button type="submit">切换采集档案</button>
+        </form>
+    </div>
+    <div class="section">
+        <h2>夜视模式状态</h2>
+        <div class="stat">夜视功能: <span id="nv_enabled"></span></div>
+        <div class="stat">夜视模式: <span id="nv_auto"></span></div>
+        <div class="stat">当前状态: <span id="nv_active"></span></div>
+        <div class="stat">当前光线水平: <span id="nv_light"></span> (<span id="light_source"></span>)</div>
+        <div class="stat">光线阈值: <span id="nv_threshold"></span></div>
+        <div class="stat">夜视强度: <span id="nv_strength"></span></div>
+        <div class="stat">绿色夜视效果: <span id="nv_green"></span></div>
+    </div>
+    <div class="section">
+        <h2>操作</h2>
+        <form data-action="/toggle_night_vision"><button type="submit">切换夜视功能</button></form>
+        <form data-action="/toggle_night_vision_mode"><button type="submit">切换夜视模式</button></form>
+        <form data-action="/set_night_vision_strength" data-field="strength">
+            <label for="strength">夜视增强强度 (0.1-1.0):</label>
+            <input type="number" id="strength" min="0.1" max="1.0" step="0.01">
+            <button type="submit">设置夜视增强强度</button>
+        </form>
+        <form data-action="/toggle_green_night_vision"><button type="submit">切换绿色夜视效果</button></form>
+        <form data-action="/set_light_threshold" data-field="threshold">
+            <label for="threshold">光线阈值 (10-150):</label>
+            <input type="number" id="threshold" min="10" max="150">
+            <button type="submit">设置光线阈值</button>
+        </form>
+        <div class="stat" id="message"></div>
+    </div>
+    <script>
+        var state = {};
+        var inputsFilled = false;
+
+        function merge(target, delta) {
+            for (var key in delta) {
+                var value = delta[key];
+                if (value === null) {
+                    delete target[key];
+                } else if (typeof value === "object" && !Array.isArray(value) &&
+                           typeof target[key] === "object" && target[key] !== null && !Array.isArray(target[key])) {
+                    merge(target[key], value);
+                } else {
+                    target[key] = value;
+                }
+            }
+        }
+
+        function set(id, text, cls) {
+            var element = document.getElementById(id);
+            element.textContent = text;
+            if (cls !== undefined) element.className = cls;
+        }
+
+        function fixed(value, digits) {
+            return typeof value === "number" ? value.toFixed(digits) : "-";
+        }
+
+        function render() {
+            var camera = state.camera || {};
+            var fps = state.fps || {};
+            var idle = state.idle || {};
+            var resources = state.resources || {};
+            var nv = state.night_vision || {};
+            var cameraState = state.camera_status || "-";
+            set("camera_state", cameraState, cameraState === "running" || cameraState === "connected" ? "good" : "error");
+            set("recovery", (camera.recovery_count || 0) + " (上次耗时 " + fixed(camera.last_recovery_duration || 0, 1) + "秒)");
+            set("uptime", fixed(state.uptime, 0));
+            set("last_frame_age", fixed(state.last_frame_age, 1));
+            set("clients", state.active_clients + "/" + state.max_clients);
+            set("fps_current", fixed(fps.current, 2), fps.current < 5 ? "error" : "good");
+            set("fps_min", fixed(fps.min, 2));
+            set("fps_max", fixed(fps.max, 2));
+            set("processing", (state.reduce_processing ? "简化" : "完整") + ", 级别 " + state.processing_level);
+            var profile = state.capture_profile || {};
+            set("capture_profile", profile.name ? profile.name + " (" + profile.size.join("x") + "@" + profile.fps +
+                "fps, 切换 " + profile.switches + " 次" + (profile.last_switch_ms !== null ? ", 上次耗时 " +
+                profile.last_switch_ms + "ms" : "") + ")" : "-");
+            set("idle", (idle.idle ? "空闲 (传感器 " + idle.idle_fps + "fps)" : "工作中") + ", 唤醒次数: " + (idle.wakeups || 0));
+            set("server_ip", state.server_ip || "-");
+            set("cpu", fixed(resources.cpu_percent, 1) + "% (本进程 " + fixed(resources.process_cpu_percent, 1) +
+                "%), 温度: " + fixed(resources.cpu_temp, 1) + "°C, 降频: " + ((resources.throttle_flags || []).join(", ") || "无"));
+            var threads = resources.threads || {};
+            set("threads", Object.keys(threads).map(function (name) { return name + " " + threads[name] + "%"; }).join(", ") || "采样中");
+            set("nv_enabled", nv.enabled ? "已启用" : "未启用", nv.enabled ? "good" : "error");
+            set("nv_auto", nv.auto ? "自动" : "手动", nv.auto ? "good" : "");
+            set("nv_active", nv.active ? "活跃" : "未活跃", nv.active ? "good" : "");
+            set("nv_light", fixed(nv.light_level, 1));
+            set("light_source", (state.light || {}).source || "-");
+            set("nv_threshold", nv.threshold);
+            set("nv_strength", fixed((nv.strength || 0) * 100, 0) + "%");
+            set("nv_green", nv.green_tint ? "开启" : "关闭");
+            if (!inputsFilled && nv.threshold !== undefined) {
+                document.getElementById("strength").value = nv.strength;
+                document.getElementById("threshold").value = nv.threshold;
+                var select = document.getElementById("profile");
+                Object.keys(profile.available || {}).forEach(function (name) {
+                    var item = profile.available[name];
+                    select.add(new Option(name + " (" + item.size.join("x") + "@" + item.fps + ")", name));
+                });
+                select.value = profile.name;
+                inputsFilled = true;
+            }
+        }
+
+        var source = new EventSource("/events");
+        source.addEventListener("snapshot", function (event) {
+            state = JSON.parse(event.data);
+            render();
+        });
+        source.addEventListener("delta", function (event) {
+            merge(state, JSON.parse(event.data));
+            render();
+        });
+        source.onopen = function () { set("connection", "已连接", "good"); };
+        source.onerror = function () { set("connection", "已断开，正在重连", "error"); };
+
+        document.querySelectorAll("form[data-action]").forEach(function (form) {
+            form.addEventListener("submit", function (event) {
+                event.preventDefault();
+                var body = null;
+                var field = form.getAttribute("data-field");
+                if (field) {
+                    body = {};
+                    var input = document.getElementById(field);
+                    body[field] = input.type === "number" ? parseFloat(input.value) : input.value;
+                }
+                fetch(form.getAttribute("data-action"), {
+                    method: "POST",
+                    headers: body ? {"Content-Type": "application/json"} : {},
+                    body: body ? JSON.stringify(body) : null
+                }).then(function (response) { return response.json(); })
+                  .then(function (result) { set("message", result.message || result.status); })
+                  .catch(function (error) { set("message", "请求失败: " + error); });
+            });
+        });
+    </script>
+</body>
+</html>
+"""
+
 @app.route('/debug')
 def debug_info():
-    """返回详细的调试信息页面"""
-    with stats_lock, clients_lock, night_vision_lock:
-        debug_html = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>摄像头调试信息</title>
-            <meta charset="utf-8">
-            <meta http-equiv="refresh" content="5">
-            <style>
-                body {{ font-family: monospace; padding: 20px; }}
-                .stat {{ margin-bottom: 5px; }}
-                .error {{ color: red; }}
-                .good {{ color: green; }}
-            </style>
-        </head>
-        <body>
-            <h1>摄像头服务调试信息</h1>
-            <div class="stat">摄像头状态: <span class="{'good' if picam2 is not None else 'error'}">{('运行中' if picam2 is not None else '未运行')}</span></div>
-            <div class="stat">服务运行时间: {int(time.time() - service_start_time)}秒</div>
-            <div class="stat">最后一帧时间: {int(time.time() - last_frame_time)}秒前</div>
-            <div class="stat">活跃客户端: {active_clients}/{max_clients}</div>
-            <div class="stat">当前FPS: <span class="{'error' if fps_stats['current'] < 5 else 'good'}">{fps_stats['current']:.2f}</span></div>
-            <div class="stat">最小FPS: {fps_stats['min']:.2f}</div>
-            <div class="stat">最大FPS: {fps_stats['max']:.2f}</div>
-            <div class="stat">处理模式: {'简化' if reduce_processing else '完整'}</div>
-            <div class="stat">服务器IP: {get_ip_address()}</div>
-            <div>
-                <h3>操作</h3>
-                <form action="/reset_camera" method="post">
-                    <button type="submit">重置摄像头</button>
-                </form>
-            </div>
-            <div class="section">
-                <h2>夜视模式状态</h2>
-                <div class="stat">夜视功能: <span class="{'good' if night_vision_enabled else 'error'}">{('已启用' if night_vision_enabled else '未启用')}</span></div>
-                <div class="stat">夜视模式: <span class="{('good' if night_vision_auto else '')}">{('自动' if night_vision_auto else '手动')}</span></div>
-                <div class="stat">当前状态: <span class="{'good' if night_vision_active else ''}">{('活跃' if night_vision_active else '未活跃')}</span></div>
-                <div class="stat">当前光线水平: <span>{last_light_level:.1f}</span></div>
-                <div class="stat">光线阈值: <span>{light_threshold}</span></div>
-                <div class="stat">夜视强度: <span>{night_vision_strength * 100:.0f}%</span></div>
-                <div class="stat">绿色夜视效果: <span>{('开启' if enable_green_tint else '关闭')}</span></div>
-            </div>
-            
-            <div class="section">
-                <h2>操作</h2>
-                <form action="/toggle_night_vision" method="post">
-                    <button type="submit">切换夜视功能</button>
-                </form>
-                <form action="/toggle_night_vision_mode" method="post">
-                    <button type="submit">切换夜视模式</button>
-                </form>
-                <form action="/set_night_vision_strength" method="post">
-                    <label for="strength">夜视增强强度 (0.1-1.0):</label>
-                    <input type="number" id="strength" name="strength" min="0.1" max="1.0" step="0.01" value="{night_vision_strength:.1f}">
-                    <button type="submit">设置夜视增强强度</button>
-                </form>
-                <form action="/toggle_green_night_vision" method="post">
-                    <button type="submit">切换绿色夜视效果</button>
-                </form>
-                <form action="/set_light_threshold" method="post">
-                    <label for="threshold">光线阈值 (10-150):</label>
-                    <input type="number" id="threshold" name="threshold" min="10" max="150" value="{light_threshold:.0f}">
-                    <button type="submit">设置光线阈值</button>
-                </form>
-            </div>
-        </body>
-        </html>
-        """
-        return debug_html
+    """返回调试信息页面（静态页面，数据来自 /events）"""
+    return Response(DEBUG_PAGE, mimetype="text/html")
 
 def health_check():
     """健康检查函数，监控和维护系统状态"""
@@ -1303,17 +3452,22 @@ def health_check():
         if current_time - last_check >= health_check_interval:
             logger.info("执行健康检查...")
             
-            # 检查最后一帧的时间
-            if current_time - last_frame_time > frame_timeout:
-                logger.warning(f"帧超时 ({current_time - last_frame_time:.1f}秒没有新帧)，重置摄像头")
-                reset_camera()
+            # 帧超时检测和摄像头恢复由 camera_supervisor 负责，这里只输出状态
+            camera_info = get_camera_state()
             
             # 输出当前状态
             with clients_lock, stats_lock:
-                logger.info(f"服务状态 - 活跃客户端: {active_clients}/{max_clients}, FPS: {fps_stats['current']:.2f}")
+                logger.info(f"服务状态 - 活跃客户端: {active_clients}/{max_clients}, FPS: {fps_stats['current']:.2f}, "
+                            f"摄像头: {camera_info['state']}, 恢复次数: {camera_info['recovery_count']}")
+            
+            # 补报被限流的日志条数
+            log_pipe.rate_filter.report_suppressed(logger)
             
             last_check = current_time
         
+        # 新创建的线程（例如OpenCV线程池、H.264编码线程）继承创建者的亲和性，按角色重新设置
+        thread_tuner.apply()
+        
         # 短暂休眠以减少CPU使用
         time.sleep(1)
 
@@ -1335,8 +3489,11 @@ def adjust_performance():
         # 当前时间，用于计算间隔
         current_time = time.time()
         
+        # 以下阈值按25fps设定，随采集档案的目标帧率缩放（例如检查档案只有10fps）
+        fps_scale = CAPTURE_PROFILES[capture_profile_name]["fps"] / 25.0
+        
         # 帧率极低时的紧急措施（不到8FPS）
-        if current_fps < 8:
+        if current_fps < 8 * fps_scale:
             # 立即降低到最低处理级别
             processing_level = 0
             # 如果帧率极低并且夜视开启，可能是夜视处理导致卡顿
@@ -1348,14 +3505,14 @@ def adjust_performance():
             return
             
         # 如果是夜视模式，使用较低的帧率阈值和更激进的调整
-        fps_threshold_high = 18 if night_vision_enabled else 25
-        fps_threshold_low = 12 if night_vision_enabled else 15
+        fps_threshold_high = (18 if night_vision_enabled else 25) * fps_scale
+        fps_threshold_low = (12 if night_vision_enabled else 15) * fps_scale
         
         # 帧率不足时立即降低处理级别
         if current_fps < fps_threshold_low:
             # 检查是否有明显的帧率下降
             fps_drop = avg_fps - current_fps
-            if fps_drop > 5 or current_fps < 10:  # 帧率下降超过5或低于10时
+            if fps_drop > 5 * fps_scale or current_fps < 10 * fps_scale:  # 帧率下降超过5或低于10时
                 # 急剧降低处理级别
                 processing_level = max(0, processing_level - 2)
                 reduce_processing = True
@@ -1375,7 +3532,7 @@ def adjust_performance():
             # 每30秒才考虑提高处理级别，避免频繁调整
             if current_time - last_fps_check > 30:
                 # 仅当帧率比阈值高出一定余量时提高级别
-                if current_fps > fps_threshold_high + 5:
+                if current_fps > fps_threshold_high + 5 * fps_scale:
                     processing_level = min(max_processing_level, processing_level + 1)
                     logger.info(f"性能调整: 提高处理级别到 {processing_level} (帧率: {current_fps:.1f}, 最低: {min_fps:.1f})")
                 
@@ -1389,58 +3546,12 @@ def adjust_performance():
         # 处理级别有变化时记录
         if previous_processing_level != processing_level:
             logger.info(f"处理级别调整: {previous_processing_level} -> {processing_level} (帧率: {current_fps:.1f} FPS)")
+            if processing_scale_setting == "auto":
+                logger.info(f"低频处理分辨率比例: {get_processing_scale():g}")
     
     except Exception as e:
         logger.error(f"性能调整错误: {e}")
 
-# 增加主线程服务启动
-if __name__ == '__main__':
-    # 记录启动时间
-    service_start_time = time.time()
-    ip_address = get_ip_address()
-    
-    try:
-        logger.info(f"摄像头服务器开始启动，IP: {ip_address}")
-        
-        # 确保全局变量已正确初始化
-        # 使用全局变量时不需要再次使用global声明，因为这些变量已经在文件顶部定义为全局变量
-        motion_detected = False
-        motion_frame_buffer = None
-        last_motion_time = time.time()
-        reduced_processing_until = 0
-        
-        # 初始化摄像头
-        if not init_camera():
-            logger.error("摄像头初始化失败，服务无法启动")
-            sys.exit(1)
-        
-        # 启动帧捕获线程
-        capture_thread = threading.Thread(target=capture_continuous)
-        capture_thread.daemon = True
-        capture_thread.start()
-        
-        # 启动健康检查线程
-        health_thread = threading.Thread(target=health_check)
-        health_thread.daemon = True
-        health_thread.start()
-        
-        # 启动Flask应用
-        logger.info(f"摄像头服务器开始运行在 http://{ip_address}:8000")
-        app.run(host='0.0.0.0', port=8000, threaded=True, use_reloader=False)
-        
-    except KeyboardInterrupt:
-        logger.info("接收到终止信号，关闭服务...")
-    except Exception as e:
-        logger.error(f"服务器运行出错: {e}")
-    finally:
-        running = False
-        if picam2 is not None:
-            try:
-                picam2.stop()
-            except:
-                pass
-        logger.info("摄像头服务已关闭")
-
 @app.route('/toggle_night_vision', methods=['POST'])
 def toggle_night_vision_endpoint():
     """切换夜视功能开关的API端点"""
@@ -1527,3 +3638,141 @@ def set_light_threshold_endpoint():
     except Exception as e:
         logger.error(f"设置光线阈值失败: {e}")
         return {"status": "error", "message": f"设置光线阈值失败: {e}"}, 500
+
+# 增加主线程服务启动
+if __name__ == '__main__':
+    ip_address = get_ip_address()
+    
+    try:
+        logger.info(f"摄像头服务器开始启动，IP: {ip_address}")
+        
+        # 确保全局变量已正确初始化
+        # 使用全局变量时不需要再次使用global声明，因为这些变量已经在文件顶部定义为全局变量
+        motion_detected = False
+        motion_frame_buffer = None
+        last_motion_time = time.time()
+        reduced_processing_until = 0
+        
+        # 多进程模式下编码帧同时写入共享内存环，供HTTP工作进程读取
+        if worker_count > 0 and server_mode == "camera":
+            encoded_ring_writer = frame_bus.EncodedFrameWriter(encoded_ring_name)
+        
+        # 在摄像头就绪前先提供占位帧，客户端连接后不会看到空白流
+        store_encoded_frame(create_placeholder_frame(), placeholder=True)
+        
+        # 合成摄像头的故障注入配置
+        synthetic_faults.update(parse_camera_faults(os.environ.get("CAMERA_FAULTS", "")))
+        
+        if server_mode == "relay":
+            # 中继模式不打开摄像头，只订阅上游
+            relay_thread = threading.Thread(target=relay_client_loop, name="relay")
+            relay_thread.daemon = True
+            relay_thread.start()
+        elif server_mode == "worker":
+            # 工作进程只从编码帧环读取帧并提供HTTP服务，采集、编码和后台维护都在采集进程中完成
+            worker_thread = threading.Thread(target=worker_frame_loop, name="worker-frames")
+            worker_thread.daemon = True
+            worker_thread.start()
+        else:
+            # 启动摄像头监督线程，picamera2导入和摄像头预热都在该线程中完成，不阻塞HTTP服务
+            supervisor_thread = threading.Thread(target=camera_supervisor, name="camera-supervisor")
+            supervisor_thread.daemon = True
+            supervisor_thread.start()
+            
+            # 启动帧捕获线程
+            capture_thread = threading.Thread(target=capture_continuous, name="capture")
+            capture_thread.daemon = True
+            capture_thread.start()
+            
+            # 启动画面分析线程（光线、运动、有效性检测）
+            analysis_thread = threading.Thread(target=analysis_loop, name="analysis")
+            analysis_thread.daemon = True
+            analysis_thread.start()
+        
+        # 启动组播发送线程
+        if multicast_target and server_mode != "worker":
+            multicast_thread = threading.Thread(target=multicast_sender_loop, name="multicast")
+            multicast_thread.daemon = True
+            multicast_thread.start()
+        
+        # 启动H.264编码线程
+        if h264_enabled and server_mode != "worker":
+            if h264_stream is None:
+                logger.warning("未找到PyAV，H.264输出不可用。请使用 'pip install av' 安装")
+            else:
+                h264_thread = threading.Thread(target=h264_encoder_loop, name="h264")
+                h264_thread.daemon = True
+                h264_thread.start()
+        
+        # 启动健康检查线程
+        if server_mode != "worker":
+            health_thread = threading.Thread(target=health_check, name="health")
+            health_thread.daemon = True
+            health_thread.start()
+        
+        # 启动后台资源采样线程
+        if server_mode != "worker":
+            if tracemalloc_frames > 0:
+                allocation_tracker = resource_monitor.AllocationTracker(tracemalloc_frames)
+                allocation_tracker.start()
+            resource_thread = threading.Thread(target=resource_monitor_loop, name="resource-monitor")
+            resource_thread.daemon = True
+            resource_thread.start()
+        
+        # 启动统计历史采样线程
+        if stats_history_store is not None and server_mode != "worker":
+            history_thread = threading.Thread(target=stats_history_loop, name="stats-history")
+            history_thread.daemon = True
+            history_thread.start()
+        
+        # /events 状态推送，工作进程的快照来自采集进程
+        status_broadcaster = status_events.StatusBroadcaster(
+            fetch_capture_status if server_mode == "worker" else build_status, interval=events_interval)
+        status_broadcaster.start()
+        
+        # 所有后台线程已启动，按角色设置亲和性和优先级；主线程之后创建的HTTP请求线程继承http角色的设置
+        if thread_tuner.enabled:
+            thread_tuner.apply()
+            logger.info(f"线程调优设置: {thread_tuner.settings()}")
+        
+        if server_mode == "worker":
+            # 使用采集进程绑定并传入的监听socket，各工作进程共同accept
+            server = make_server('0.0.0.0', server_port, app, threaded=True, fd=int(os.environ["CAMERA_LISTEN_FD"]))
+            logger.info(f"HTTP工作进程 {os.environ.get('CAMERA_WORKER_INDEX', '0')} 开始服务 (PID {os.getpid()})")
+            server.serve_forever()
+        elif encoded_ring_writer is not None:
+            # 采集进程只绑定端口，不处理HTTP请求
+            listen_socket = socket.create_server(('0.0.0.0', server_port), backlog=128)
+            control_thread = threading.Thread(target=control_server_loop, name="control")
+            control_thread.daemon = True
+            control_thread.start()
+            startup_stats["time_to_listening"] = time.time() - process_start_time
+            logger.info(f"摄像头服务器开始运行在 http://{ip_address}:{server_port}，{worker_count} 个HTTP工作进程 "
+                        f"(距进程启动 {startup_stats['time_to_listening']:.2f}秒)")
+            supervise_workers(listen_socket)
+        else:
+            # 先绑定端口再进入服务循环，以便记录开始监听的耗时
+            server = make_server('0.0.0.0', server_port, app, threaded=True)
+            startup_stats["time_to_listening"] = time.time() - process_start_time
+            logger.info(f"摄像头服务器开始运行在 http://{ip_address}:{server_port} (距进程启动 {startup_stats['time_to_listening']:.2f}秒)")
+            server.serve_forever()
+        
+    except KeyboardInterrupt:
+        logger.info("接收到终止信号，关闭服务...")
+    except Exception as e:
+        logger.error(f"服务器运行出错: {e}")
+    finally:
+        running = False
+        if picam2 is not None:
+            try:
+                picam2.stop()
+            except:
+                pass
+        if status_broadcaster is not None:
+            status_broadcaster.stop()
+        close_frame_bus()
+        if encoded_ring_writer is not None:
+            stop_workers()
+            encoded_ring_writer.close()
+        logger.info("摄像头服务已关闭")
+        log_pipe.stop()
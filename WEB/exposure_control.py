@@ -0,0 +1,157 @@
+"""传感器曝光/增益自适应控制
+
+原来 init_camera() 固定 ExposureTime=60000、AnalogueGain=6.0：白天曝光时间超过帧间隔，
+传感器被限制在约16fps；夜间画面再在软件里用 convertScaleAbs 整帧提亮，放大噪声也消耗CPU。
+
+ExposureController 根据测得的画面亮度闭环调整传感器参数（通过 picam2.set_controls）：
+  - 需要的总曝光量 = 曝光时间 x 模拟增益，按目标亮度和当前亮度之比调整（对数域阻尼，避免振荡）
+  - 优先延长曝光时间，其次提高模拟增益，传感器达到上限后剩余部分才由软件增益补足
+  - 白天档案：曝光时间不超过最短帧间隔，保持全帧率；采集档案帧率较低（如10fps）时上限随帧间隔放宽
+  - 夜间档案：允许更长的曝光（降低帧率）和更高的增益；白天档案饱和时切换到夜间，
+    所需曝光量明显低于白天上限时切换回来（滞后，避免在临界光线下反复切换）
+  - min_frame_duration：采集档案的目标帧率对应的最短帧间隔，两个档案的帧间隔都不短于它
+
+brightness_scale() 把当前画面亮度换算到固定参考曝光（原来的60000us x 6.0）下的亮度，
+夜视模式的光线判断据此仍使用原来的阈值。
+"""
+
+import time
+
+# 参考曝光：原固定配置，light_threshold 等亮度阈值以此为基准
+REFERENCE_EXPOSURE = 60000
+REFERENCE_GAIN = 6.0
+
+PROFILES = {
+    # 帧间隔33-40ms（25-30fps），曝光时间不超过最短帧间隔（的 DAY_EXPOSURE_FRACTION）
+    "day": {"frame_duration": (33333, 40000), "max_exposure": 33000, "max_gain": 4.0},
+    # 允许曝光到100ms（最低10fps）
+    "night": {"frame_duration": (33333, 100000), "max_exposure": 100000, "max_gain": 8.0},
+}
+MIN_EXPOSURE = 100
+DAY_EXPOSURE_FRACTION = 0.99  # 白天曝光时间占最短帧间隔的上限，留出传感器读出的余量
+
+
+class ExposureController:
+    """按画面亮度调整传感器曝光时间、模拟增益和帧间隔
+
+    - target: 目标平均亮度(0-255)
+    - max_software_gain: 软件增益上限
+    - damping: 每次调整走完所需变化（对数域）的比例，1为一步到位
+    - update_interval: 两次调整之间的最短时间(秒)，需大于传感器应用新参数的延迟（几帧）
+    - tolerance: 参数相对变化小于此比例时不下发
+    """
+
+    def __init__(self, target=110.0, max_software_gain=4.0, damping=0.6, update_interval=0.3, tolerance=0.05,
+                 profiles=None):
+        self.target = target
+        self.max_software_gain = max_software_gain
+        self.damping = damping
+        self.update_interval = update_interval
+        self.tolerance = tolerance
+        self.profiles = profiles or PROFILES
+        self.profile = "day"
+        self.min_frame_duration = 0
+        self.exposure = float(self.max_exposure("day"))
+        self.gain = 1.0
+        self.software_gain = 1.0
+        self.brightness = None
+        self.last_update = 0.0
+        self.profile_changes = 0
+        self.updates = 0
+
+    def frame_duration_limits(self, profile=None):
+        shortest, longest = self.profiles[profile or self.profile]["frame_duration"]
+        return (max(shortest, self.min_frame_duration), max(longest, self.min_frame_duration))
+
+    def set_min_frame_duration(self, duration):
+        """采集档案切换时设置最短帧间隔，当前曝光时间超过新档案的上限时立即收回"""
+        self.min_frame_duration = int(duration)
+        self.exposure = min(self.exposure, float(self.max_exposure()))
+
+    def max_exposure(self, profile=None):
+        """档案的曝光时间上限：白天档案随采集档案的帧间隔放宽，不低于档案中的配置"""
+        profile = profile or self.profile
+        limit = self.profiles[profile]["max_exposure"]
+        if profile == "day":
+            limit = max(limit, int(self.frame_duration_limits("day")[0] * DAY_EXPOSURE_FRACTION))
+        return limit
+
+    def controls(self, include_frame_duration=True):
+        """当前应下发给传感器的控制参数"""
+        controls = {"AeEnable": False, "ExposureTime": int(self.exposure), "AnalogueGain": round(self.gain, 3)}
+        if include_frame_duration:
+            controls["FrameDurationLimits"] = self.frame_duration_limits()
+        return controls
+
+    def brightness_scale(self):
+        """把当前曝光下的亮度换算到参考曝光下的系数"""
+        return (REFERENCE_EXPOSURE * REFERENCE_GAIN) / (self.exposure * self.gain)
+
+    def at_limit(self):
+        """曝光时间、模拟增益和软件增益是否都已（基本）到上限，阻尼调整只会无限接近上限"""
+        profile = self.profiles[self.profile]
+        return self.exposure >= self.max_exposure() * 0.98 and self.gain >= profile["max_gain"] * 0.98 and \
+            self.software_gain >= self.max_software_gain * 0.98
+
+    def _allocate(self, total):
+        """把总曝光量分配到曝光时间、模拟增益和软件增益"""
+        profile = self.profiles[self.profile]
+        exposure = min(max(total, MIN_EXPOSURE), self.max_exposure())
+        gain = min(max(total / exposure, 1.0), profile["max_gain"])
+        software_gain = min(max(total / (exposure * gain), 1.0), self.max_software_gain)
+        return exposure, gain, software_gain
+
+    def update(self, brightness, now=None):
+        """输入当前（软件增益之前的）平均亮度，需要调整传感器时返回控制参数字典，否则返回None
+
+        返回的参数包含 FrameDurationLimits 表示档案发生了切换。
+        """
+        now = time.time() if now is None else now
+        self.brightness = brightness
+        if now - self.last_update < self.update_interval:
+            return None
+        self.last_update = now
+
+        # brightness 由传感器曝光量产生（软件增益之前），据此算出达到目标亮度所需的总曝光量；
+        # 当前总曝光量包含软件增益，这样传感器到达上限时仍能算出还差多少
+        sensor_total = self.exposure * self.gain
+        current_total = sensor_total * self.software_gain
+        # 饱和画面无法反映真实亮度，单步最多调整4倍
+        required = sensor_total * min(max(self.target / max(brightness, 1.0), 0.25), 4.0)
+        total = current_total * (required / current_total) ** self.damping
+
+        profile_changed = False
+        day = self.profiles["day"]
+        day_limit = self.max_exposure("day") * day["max_gain"]
+        if self.profile == "day" and total > day_limit * 1.05:
+            self.profile = "night"
+            profile_changed = True
+        elif self.profile == "night" and total < day_limit * 0.5:
+            self.profile = "day"
+            profile_changed = True
+        if profile_changed:
+            self.profile_changes += 1
+
+        exposure, gain, software_gain = self._allocate(total)
+        self.software_gain = software_gain
+        changed = abs(exposure - self.exposure) > self.exposure * self.tolerance or \
+            abs(gain - self.gain) > self.gain * self.tolerance
+        if not changed and not profile_changed:
+            return None
+
+        self.exposure = exposure
+        self.gain = gain
+        self.updates += 1
+        return self.controls(include_frame_duration=profile_changed)
+
+    def state(self):
+        return {
+            "profile": self.profile,
+            "exposure_us": int(self.exposure),
+            "analogue_gain": round(self.gain, 2),
+            "software_gain": round(self.software_gain, 2),
+            "brightness": round(self.brightness, 1) if self.brightness is not None else None,
+            "frame_duration_limits": self.frame_duration_limits(),
+            "updates": self.updates,
+            "profile_changes": self.profile_changes
+        }
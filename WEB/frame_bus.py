@@ -0,0 +1,471 @@
+"""共享内存原始帧总线
+
+camera_server.py 把处理后（可选：未处理）的帧写入 POSIX 共享内存环形缓冲区，
+同一台树莓派上的视觉程序（例如避障脚本）可以直接以 NumPy 视图零拷贝读取，
+不需要经过 JPEG 编码、HTTP 传输和解码。
+
+共享内存布局：
+    [总头 64字节][槽位头 32字节 x N][对齐到64字节的帧数据 x N]
+
+多进程模式（CAMERA_WORKERS）下采集进程还通过 EncodedFrameWriter 把编码后的JPEG写入另一个环形缓冲区，
+各HTTP工作进程用 EncodedFrameReader 读取，不需要再次编码。
+
+每个槽位使用 seqlock 保护：写入前把槽位锁序号加一（变为奇数），写完再加一（变为偶数）。
+读取方在读取前后比较锁序号，序号为奇数或发生变化说明读到的数据可能被覆盖。
+
+读取端在每次读取和等待时写入心跳。写入端可以在一段时间没有心跳后调用 withdraw() 停止发布：
+把最新帧序号清零，读取端此时读不到旧帧，等待中的读取端的心跳会让写入端恢复发布。
+
+读取示例：
+    from frame_bus import FrameBusReader
+    reader = FrameBusReader("camera_processed")
+    frame = reader.wait_next(timeout=1.0)
+    if frame is not None:
+        analyse(frame.array)            # frame.array 是共享内存上的零拷贝视图
+        if not reader.is_valid(frame):  # 处理期间槽位被覆盖，结果作废
+            ...
+"""
+
+import logging
+import struct
+import sys
+import time
+from collections import namedtuple
+from multiprocessing import shared_memory
+
+import numpy as np
+
+logger = logging.getLogger('frame_bus')
+
+BUS_MAGIC = b"CAMBUS01"
+BUS_VERSION = 1
+FLAG_CLOSED = 1
+
+# 总头: magic, version, flags, slot_count, height, width, channels, dtype, slot_size, write_seq, reader_heartbeat
+HEADER_FORMAT = "<8sIIIIII4sQQd"
+HEADER_SIZE = 64
+# 槽位头: seqlock序号, 帧序号, 时间戳
+SLOT_HEADER_FORMAT = "<QQd"
+SLOT_HEADER_SIZE = 32
+
+# 各字段在总头中的偏移，热路径上直接按偏移读写
+FLAGS_OFFSET = 12
+WRITE_SEQ_OFFSET = 44
+HEARTBEAT_OFFSET = 52
+
+BusFrame = namedtuple("BusFrame", ["seq", "timestamp", "array", "slot", "lock_seq"])
+
+# 编码帧环：多进程模式下采集进程把JPEG写入，HTTP工作进程读取后提供服务
+ENCODED_MAGIC = b"CAMJPG01"
+# 总头: magic, version, flags, slot_count, slot_capacity, write_seq, reader_heartbeat
+ENCODED_HEADER_FORMAT = "<8sIIIIQd"
+ENCODED_WRITE_SEQ_OFFSET = 24
+# 槽位头: seqlock序号, 帧序号, 数据长度, 编码时间, 采集时间, 转发跳数, 标志位
+ENCODED_SLOT_HEADER_FORMAT = "<QQIddHH"
+ENCODED_SLOT_HEADER_SIZE = 48
+ENCODED_FLAG_STALE = 1
+ENCODED_FLAG_PLACEHOLDER = 2
+
+
+def _align(value, alignment=64):
+    return (value + alignment - 1) // alignment * alignment
+
+
+def _attach_shared_memory(name):
+    """以只使用不拥有的方式打开共享内存
+
+    Python 3.13 之前，打开已有共享内存也会注册到 resource_tracker，
+    读取进程退出时会把写入方的共享内存删除，这里手动取消注册。
+    """
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+
+    shm = shared_memory.SharedMemory(name=name)
+    try:
+        from multiprocessing import resource_tracker
+        resource_tracker.unregister(shm._name, "shared_memory")
+    except Exception:
+        pass
+    return shm
+
+
+class FrameBusWriter:
+    """帧总线写入端，由 camera_server 在捕获线程中调用 publish()
+
+    帧尺寸或类型变化时（例如切换分辨率）会重建共享内存，
+    并在旧的共享内存上设置关闭标志，读取端据此重新连接。
+    """
+
+    def __init__(self, name, slots=4):
+        self.name = name
+        self.slots = slots
+        self.shm = None
+        self.layout = None
+        self.slot_views = []
+        self.seq = 0
+
+    def _create(self, shape, dtype):
+        self.close()
+
+        height, width = shape[:2]
+        channels = shape[2] if len(shape) == 3 else 1
+        dtype = np.dtype(dtype)
+        slot_size = _align(height * width * channels * dtype.itemsize)
+        data_offset = _align(HEADER_SIZE + SLOT_HEADER_SIZE * self.slots)
+        total_size = data_offset + slot_size * self.slots
+
+        # 上次异常退出可能残留同名共享内存，先清理
+        try:
+            stale = _attach_shared_memory(self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"清理残留共享内存 {self.name} 出错: {e}")
+
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=total_size)
+        struct.pack_into(HEADER_FORMAT, self.shm.buf, 0, BUS_MAGIC, BUS_VERSION, 0, self.slots,
+                         height, width, channels, dtype.str.encode().ljust(4), slot_size, 0, 0.0)
+        for slot in range(self.slots):
+            struct.pack_into(SLOT_HEADER_FORMAT, self.shm.buf, HEADER_SIZE + slot * SLOT_HEADER_SIZE, 0, 0, 0.0)
+
+        self.slot_views = [
+            np.ndarray(shape, dtype=dtype, buffer=self.shm.buf, offset=data_offset + slot * slot_size)
+            for slot in range(self.slots)
+        ]
+        self.layout = (tuple(shape), dtype)
+        logger.info(f"帧总线 {self.name} 已创建: {width}x{height}x{channels} {dtype}, {self.slots} 个槽位, "
+                    f"{total_size / (1024 * 1024):.1f}MB")
+
+    def publish(self, frame, timestamp=None):
+        """把一帧写入下一个槽位"""
+        if self.layout != (frame.shape, frame.dtype):
+            self._create(frame.shape, frame.dtype)
+
+        self.seq += 1
+        slot = self.seq % self.slots
+        slot_offset = HEADER_SIZE + slot * SLOT_HEADER_SIZE
+        buf = self.shm.buf
+
+        lock_seq = struct.unpack_from("<Q", buf, slot_offset)[0]
+        struct.pack_into("<Q", buf, slot_offset, lock_seq + 1)
+        np.copyto(self.slot_views[slot], frame)
+        struct.pack_into(SLOT_HEADER_FORMAT, buf, slot_offset, lock_seq + 2, self.seq,
+                         timestamp if timestamp is not None else time.time())
+        struct.pack_into("<Q", buf, WRITE_SEQ_OFFSET, self.seq)
+
+    def last_reader_time(self):
+        """返回最近一次有读取端访问的时间，没有读取端时为0"""
+        if self.shm is None:
+            return 0.0
+        return struct.unpack_from("<d", self.shm.buf, HEARTBEAT_OFFSET)[0]
+
+    def withdraw(self):
+        """暂停发布时把最新帧序号清零，读取端不会读到暂停前的旧帧；下一次 publish() 恢复"""
+        if self.shm is not None:
+            struct.pack_into("<Q", self.shm.buf, WRITE_SEQ_OFFSET, 0)
+
+    def close(self):
+        if self.shm is None:
+            return
+        try:
+            struct.pack_into("<I", self.shm.buf, FLAGS_OFFSET, FLAG_CLOSED)
+            self.slot_views = []
+            self.shm.close()
+            self.shm.unlink()
+        except Exception as e:
+            logger.warning(f"关闭帧总线 {self.name} 出错: {e}")
+        self.shm = None
+        self.layout = None
+
+
+class FrameBusReader:
+    """帧总线读取端，供同一台机器上的其他进程使用"""
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = None
+        self.slot_views = []
+        self.last_seq = 0
+
+    def _connect(self):
+        self._disconnect()
+        shm = _attach_shared_memory(self.name)
+        (magic, version, flags, slots, height, width, channels,
+         dtype_str, slot_size, _, _) = struct.unpack_from(HEADER_FORMAT, shm.buf, 0)
+        if magic != BUS_MAGIC or version != BUS_VERSION:
+            shm.close()
+            raise ValueError(f"{self.name} 不是有效的帧总线")
+
+        shape = (height, width, channels) if channels > 1 else (height, width)
+        dtype = np.dtype(dtype_str.decode().strip())
+        data_offset = _align(HEADER_SIZE + SLOT_HEADER_SIZE * slots)
+        self.shm = shm
+        self.slot_views = [
+            np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=data_offset + slot * slot_size)
+            for slot in range(slots)
+        ]
+        for view in self.slot_views:
+            view.flags.writeable = False
+
+    def _disconnect(self):
+        if self.shm is not None:
+            self.slot_views = []
+            try:
+                self.shm.close()
+            except BufferError:
+                # 调用方仍持有旧视图时无法立即释放映射，交给垃圾回收处理
+                pass
+            self.shm = None
+
+    def _ensure_connected(self):
+        if self.shm is not None:
+            flags = struct.unpack_from("<I", self.shm.buf, FLAGS_OFFSET)[0]
+            if not flags & FLAG_CLOSED:
+                return True
+        try:
+            self._connect()
+            return True
+        except FileNotFoundError:
+            self._disconnect()
+            return False
+
+    def read_latest(self, copy=False):
+        """读取最新一帧，没有可用帧时返回None
+
+        copy=False 时返回共享内存上的只读视图，处理完成后应调用 is_valid() 确认未被覆盖；
+        copy=True 时返回经过 seqlock 校验的独立副本。
+        """
+        for _ in range(3):
+            if not self._ensure_connected():
+                return None
+
+            buf = self.shm.buf
+            struct.pack_into("<d", buf, HEARTBEAT_OFFSET, time.time())
+            seq = struct.unpack_from("<Q", buf, WRITE_SEQ_OFFSET)[0]
+            if seq == 0:
+                return None
+
+            slot = seq % len(self.slot_views)
+            slot_offset = HEADER_SIZE + slot * SLOT_HEADER_SIZE
+            lock_seq, frame_seq, timestamp = struct.unpack_from(SLOT_HEADER_FORMAT, buf, slot_offset)
+            if lock_seq % 2 == 1 or frame_seq != seq:
+                continue
+
+            array = self.slot_views[slot]
+            frame = BusFrame(frame_seq, timestamp, array, slot, lock_seq)
+            if copy:
+                frame = frame._replace(array=array.copy())
+                if not self.is_valid(frame):
+                    continue
+
+            self.last_seq = frame_seq
+            return frame
+
+        return None
+
+    def is_valid(self, frame):
+        """检查读取到的帧在此期间是否被写入端覆盖"""
+        if self.shm is None:
+            return False
+        slot_offset = HEADER_SIZE + frame.slot * SLOT_HEADER_SIZE
+        return struct.unpack_from("<Q", self.shm.buf, slot_offset)[0] == frame.lock_seq
+
+    def wait_next(self, timeout=1.0, poll_interval=0.002, copy=False):
+        """等待比上次读取更新的帧"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._ensure_connected():
+                # 等待期间也写入心跳，写入端暂停发布时据此恢复
+                struct.pack_into("<d", self.shm.buf, HEARTBEAT_OFFSET, time.time())
+                seq = struct.unpack_from("<Q", self.shm.buf, WRITE_SEQ_OFFSET)[0]
+                if seq not in (self.last_seq, 0):
+                    frame = self.read_latest(copy=copy)
+                    if frame is not None:
+                        return frame
+            time.sleep(poll_interval)
+        return None
+
+    def close(self):
+        self._disconnect()
+
+
+class EncodedFrameWriter:
+    """编码帧环写入端，每个槽位保存一帧JPEG及其元数据
+
+    帧大小超过槽位容量时按两倍容量重建共享内存，读取端根据关闭标志重新连接。
+    只允许一个写入线程，调用方负责串行化 publish()。
+    """
+
+    def __init__(self, name, slots=4, capacity=256 * 1024):
+        self.name = name
+        self.slots = slots
+        self.capacity = capacity
+        self.shm = None
+        self.data_offset = 0
+        self.seq = 0
+
+    def _create(self, capacity):
+        self.close()
+        capacity = _align(capacity)
+        self.data_offset = _align(HEADER_SIZE + ENCODED_SLOT_HEADER_SIZE * self.slots)
+        total_size = self.data_offset + capacity * self.slots
+
+        try:
+            stale = _attach_shared_memory(self.name)
+            stale.close()
+            stale.unlink()
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            logger.warning(f"清理残留共享内存 {self.name} 出错: {e}")
+
+        self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=total_size)
+        struct.pack_into(ENCODED_HEADER_FORMAT, self.shm.buf, 0, ENCODED_MAGIC, BUS_VERSION, 0,
+                         self.slots, capacity, self.seq, 0.0)
+        for slot in range(self.slots):
+            struct.pack_into(ENCODED_SLOT_HEADER_FORMAT, self.shm.buf, HEADER_SIZE + slot * ENCODED_SLOT_HEADER_SIZE,
+                             0, 0, 0, 0.0, 0.0, 0, 0)
+        self.capacity = capacity
+        logger.info(f"编码帧环 {self.name} 已创建: {self.slots} 个槽位, 每个 {capacity // 1024}KB")
+
+    def publish(self, data, timestamp, capture_time=None, hops=0, stale=False, placeholder=False):
+        if self.shm is None or len(data) > self.capacity:
+            self._create(max(self.capacity, len(data) * 2))
+
+        self.seq += 1
+        slot = self.seq % self.slots
+        slot_offset = HEADER_SIZE + slot * ENCODED_SLOT_HEADER_SIZE
+        data_offset = self.data_offset + slot * self.capacity
+        buf = self.shm.buf
+        flags = (ENCODED_FLAG_STALE if stale else 0) | (ENCODED_FLAG_PLACEHOLDER if placeholder else 0)
+
+        lock_seq = struct.unpack_from("<Q", buf, slot_offset)[0]
+        struct.pack_into("<Q", buf, slot_offset, lock_seq + 1)
+        buf[data_offset:data_offset + len(data)] = data
+        struct.pack_into(ENCODED_SLOT_HEADER_FORMAT, buf, slot_offset, lock_seq + 2, self.seq, len(data),
+                         timestamp, capture_time or 0.0, hops, flags)
+        struct.pack_into("<Q", buf, ENCODED_WRITE_SEQ_OFFSET, self.seq)
+
+    def close(self):
+        if self.shm is None:
+            return
+        try:
+            struct.pack_into("<I", self.shm.buf, FLAGS_OFFSET, FLAG_CLOSED)
+            self.shm.close()
+            self.shm.unlink()
+        except Exception as e:
+            logger.warning(f"关闭编码帧环 {self.name} 出错: {e}")
+        self.shm = None
+
+
+class EncodedFrameReader:
+    """编码帧环读取端，返回与 camera_server 编码帧缓存相同字段的字典（data为独立的bytes副本）"""
+
+    def __init__(self, name):
+        self.name = name
+        self.shm = None
+        self.slots = 0
+        self.capacity = 0
+        self.data_offset = 0
+        self.last_seq = 0
+
+    def _connect(self):
+        self._disconnect()
+        shm = _attach_shared_memory(self.name)
+        magic, version, _, slots, capacity, _, _ = struct.unpack_from(ENCODED_HEADER_FORMAT, shm.buf, 0)
+        if magic != ENCODED_MAGIC or version != BUS_VERSION:
+            shm.close()
+            raise ValueError(f"{self.name} 不是有效的编码帧环")
+        self.shm = shm
+        self.slots = slots
+        self.capacity = capacity
+        self.data_offset = _align(HEADER_SIZE + ENCODED_SLOT_HEADER_SIZE * slots)
+
+    def _disconnect(self):
+        if self.shm is not None:
+            self.shm.close()
+            self.shm = None
+
+    def _ensure_connected(self):
+        if self.shm is not None:
+            if not struct.unpack_from("<I", self.shm.buf, FLAGS_OFFSET)[0] & FLAG_CLOSED:
+                return True
+        try:
+            self._connect()
+            return True
+        except FileNotFoundError:
+            self._disconnect()
+            return False
+
+    def read_latest(self):
+        """读取最新一帧，没有可用帧或连续读到正在写入的槽位时返回None"""
+        for _ in range(3):
+            if not self._ensure_connected():
+                return None
+            buf = self.shm.buf
+            seq = struct.unpack_from("<Q", buf, ENCODED_WRITE_SEQ_OFFSET)[0]
+            if seq == 0:
+                return None
+
+            slot = seq % self.slots
+            slot_offset = HEADER_SIZE + slot * ENCODED_SLOT_HEADER_SIZE
+            lock_seq, frame_seq, length, timestamp, capture_time, hops, flags = \
+                struct.unpack_from(ENCODED_SLOT_HEADER_FORMAT, buf, slot_offset)
+            if lock_seq % 2 == 1 or frame_seq != seq:
+                continue
+
+            data_offset = self.data_offset + slot * self.capacity
+            data = bytes(buf[data_offset:data_offset + length])
+            if struct.unpack_from("<Q", buf, slot_offset)[0] != lock_seq:
+                continue
+
+            self.last_seq = frame_seq
+            return {"seq": frame_seq, "time": timestamp, "data": data,
+                    "capture_time": capture_time or None, "hops": hops,
+                    "stale": bool(flags & ENCODED_FLAG_STALE),
+                    "placeholder": bool(flags & ENCODED_FLAG_PLACEHOLDER)}
+        return None
+
+    def wait_next(self, timeout=1.0, poll_interval=0.005):
+        """等待比上次读取更新的帧"""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self._ensure_connected():
+                seq = struct.unpack_from("<Q", self.shm.buf, ENCODED_WRITE_SEQ_OFFSET)[0]
+                if seq != self.last_seq:
+                    frame = self.read_latest()
+                    if frame is not None:
+                        return frame
+            time.sleep(poll_interval)
+        return None
+
+    def close(self):
+        self._disconnect()
+
+
+if __name__ == '__main__':
+    # 简单的读取端示例：统计从帧总线读取的帧率和延迟
+    bus_name = sys.argv[1] if len(sys.argv) > 1 else "camera_processed"
+    reader = FrameBusReader(bus_name)
+    count = 0
+    latency_total = 0.0
+    report_time = time.time()
+    try:
+        while True:
+            frame = reader.wait_next(timeout=2.0)
+            if frame is None:
+                print(f"等待 {bus_name} 的帧...")
+                continue
+            count += 1
+            latency_total += time.time() - frame.timestamp
+            if time.time() - report_time >= 2.0:
+                elapsed = time.time() - report_time
+                print(f"{bus_name}: {count / elapsed:.1f} fps, 平均延迟 {latency_total / count * 1000:.1f}ms, "
+                      f"形状 {frame.array.shape}")
+                count = 0
+                latency_total = 0.0
+                report_time = time.time()
+    except KeyboardInterrupt:
+        reader.close()
@@ -0,0 +1,306 @@
+"""H.264 分片MP4 / 低延迟HLS 输出
+
+把处理后的帧用 libx264（ultrafast + zerolatency）编码一次，封装为分片MP4（fMP4），
+同时提供两种分发方式：
+  - 连续的fMP4字节流（HTTP 或 WebSocket），浏览器用 MediaSource Extensions 播放
+  - LL-HLS：以GOP为分段、每若干帧为一个部分分段(part)，全部保存在内存中
+
+依赖 PyAV（pip install av），未安装时 camera_server 不启用此功能。
+
+MP4封装器在收到下一帧时才输出上一帧的分片（需要下一帧的时间戳计算时长），
+因此分片会比编码晚一帧。
+"""
+
+import fractions
+import logging
+import math
+import struct
+import threading
+import time
+from collections import deque
+
+import av
+
+logger = logging.getLogger('h264_stream')
+
+MP4_TIME_BASE = fractions.Fraction(1, 90000)
+
+
+class Fmp4BoxSink:
+    """接收封装器输出的字节，按MP4顶层box切分为初始化段和 moof+mdat 分片"""
+
+    def __init__(self, on_init, on_fragment):
+        self.buffer = bytearray()
+        self.init_boxes = []
+        self.pending_moof = None
+        self.on_init = on_init
+        self.on_fragment = on_fragment
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= 8:
+            size, box_type = struct.unpack_from(">I4s", self.buffer)
+            if size < 8 or len(self.buffer) < size:
+                break
+            box = bytes(self.buffer[:size])
+            del self.buffer[:size]
+
+            if box_type in (b"ftyp", b"moov"):
+                self.init_boxes.append(box)
+                if box_type == b"moov":
+                    self.on_init(b"".join(self.init_boxes))
+                    self.init_boxes = []
+            elif box_type == b"moof":
+                self.pending_moof = box
+            elif box_type == b"mdat" and self.pending_moof is not None:
+                self.on_fragment(self.pending_moof + box)
+                self.pending_moof = None
+        return len(data)
+
+    def tell(self):
+        return 0
+
+    def seek(self, *args):
+        raise OSError("fMP4输出不支持seek")
+
+
+class H264Streamer:
+    """编码处理后的帧并维护fMP4分片和LL-HLS分段的内存存储
+
+    - gop: 关键帧间隔（帧数），也就是HLS分段长度
+    - part_frames: 每个LL-HLS部分分段包含的帧数
+    - max_segments: 内存中保留的完整分段数
+    """
+
+    def __init__(self, width, height, fps=25, bitrate=800000, gop=25, part_frames=5, max_segments=6):
+        self.width = width
+        self.height = height
+        self.fps = fps
+        self.bitrate = bitrate
+        self.gop = gop
+        self.part_frames = part_frames
+        self.max_segments = max_segments
+
+        self.condition = threading.Condition()
+        self.init_segment = None
+        # 连续fMP4流: 自最近关键帧起的分片 (序号, 数据)，新客户端从关键帧开始播放
+        self.fragment_seq = 0
+        self.gop_fragments = []
+        # LL-HLS: 已完成的分段和正在生成的分段
+        self.segments = deque(maxlen=max_segments)
+        self.current_segment = None
+        self.segment_seq = -1
+        self.max_segment_duration = gop / fps
+
+        self.keyframe_flags = deque()
+        self.fragment_durations = deque()
+        self.start_time = None
+        self.last_pts = -1
+        self.stats = {"frames": 0, "bytes": 0, "keyframes": 0, "encode_time": 0.0}
+
+        self.sink = Fmp4BoxSink(self._on_init, self._on_fragment)
+        self.container = av.open(self.sink, mode="w", format="mp4",
+                                 options={"movflags": "empty_moov+default_base_moof+frag_every_frame"})
+        # 采集档案的帧率可能是小数（如 CAMERA_PROFILES 中的 @12.5），PyAV要求有理数
+        self.stream = self.container.add_stream("libx264", rate=fractions.Fraction(fps).limit_denominator(1001))
+        self.stream.width = width
+        self.stream.height = height
+        self.stream.pix_fmt = "yuv420p"
+        self.stream.bit_rate = bitrate
+        self.stream.time_base = MP4_TIME_BASE
+        self.stream.codec_context.gop_size = gop
+        self.stream.codec_context.options = {
+            "preset": "ultrafast",
+            "tune": "zerolatency",
+            "x264-params": f"keyint={gop}:min-keyint={gop}:scenecut=0"
+        }
+
+    def encode(self, frame, timestamp):
+        """编码一帧BGR图像，timestamp为采集时间(秒)"""
+        if self.start_time is None:
+            self.start_time = timestamp
+        pts = int(round((timestamp - self.start_time) * MP4_TIME_BASE.denominator))
+        if pts <= self.last_pts:
+            pts = self.last_pts + 1
+        duration = pts - self.last_pts if self.last_pts >= 0 else int(MP4_TIME_BASE.denominator / self.fps)
+        self.last_pts = pts
+
+        encode_start = time.process_time()
+        video_frame = av.VideoFrame.from_ndarray(frame, format="bgr24")
+        video_frame.pts = pts
+        video_frame.time_base = MP4_TIME_BASE
+        for packet in self.stream.encode(video_frame):
+            self.keyframe_flags.append(packet.is_keyframe)
+            self.fragment_durations.append(duration)
+            self.container.mux(packet)
+        self.stats["encode_time"] += time.process_time() - encode_start
+        self.stats["frames"] += 1
+
+    def close(self):
+        try:
+            for packet in self.stream.encode(None):
+                self.keyframe_flags.append(packet.is_keyframe)
+                self.fragment_durations.append(int(MP4_TIME_BASE.denominator / self.fps))
+                self.container.mux(packet)
+            self.container.close()
+        except Exception as e:
+            logger.warning(f"关闭H.264编码器出错: {e}")
+        with self.condition:
+            self.condition.notify_all()
+
+    def _on_init(self, data):
+        with self.condition:
+            self.init_segment = data
+            self.condition.notify_all()
+
+    def _on_fragment(self, data):
+        keyframe = self.keyframe_flags.popleft() if self.keyframe_flags else False
+        duration = self.fragment_durations.popleft() / MP4_TIME_BASE.denominator if self.fragment_durations else 1 / self.fps
+        self.stats["bytes"] += len(data)
+
+        with self.condition:
+            self.fragment_seq += 1
+            if keyframe:
+                self.stats["keyframes"] += 1
+                self.gop_fragments = []
+                self._start_segment()
+            self.gop_fragments.append((self.fragment_seq, data))
+
+            if self.current_segment is not None:
+                segment = self.current_segment
+                part = segment["parts"][-1] if segment["parts"] else None
+                if part is None or part["complete"]:
+                    part = {"data": [], "duration": 0.0, "complete": False, "independent": keyframe}
+                    segment["parts"].append(part)
+                part["data"].append(data)
+                part["duration"] += duration
+                segment["duration"] += duration
+                if len(part["data"]) >= self.part_frames:
+                    part["complete"] = True
+                    part["data"] = [b"".join(part["data"])]
+
+            self.condition.notify_all()
+
+    def _start_segment(self):
+        """关键帧开始新的HLS分段，之前的分段标记为完成"""
+        if self.current_segment is not None:
+            segment = self.current_segment
+            if segment["parts"] and not segment["parts"][-1]["complete"]:
+                segment["parts"][-1]["complete"] = True
+                segment["parts"][-1]["data"] = [b"".join(segment["parts"][-1]["data"])]
+            segment["complete"] = True
+            self.max_segment_duration = max(self.max_segment_duration, segment["duration"])
+            self.segments.append(segment)
+        self.segment_seq += 1
+        self.current_segment = {"seq": self.segment_seq, "parts": [], "duration": 0.0, "complete": False}
+
+    # ---- 连续fMP4流 ----
+
+    def iter_fmp4(self, is_active, timeout=5.0):
+        """生成连续的fMP4字节流：初始化段 + 最近关键帧以来的分片 + 后续实时分片"""
+        with self.condition:
+            if not self.condition.wait_for(lambda: self.init_segment is not None and self.gop_fragments, timeout):
+                return
+            init = self.init_segment
+            backlog = list(self.gop_fragments)
+        yield init
+        last_seq = 0
+        for seq, data in backlog:
+            last_seq = seq
+            yield data
+
+        while is_active():
+            with self.condition:
+                if not self.condition.wait_for(lambda: self.fragment_seq > last_seq, timeout):
+                    return
+                new = [(seq, data) for seq, data in self.gop_fragments if seq > last_seq]
+                if not new or new[0][0] != last_seq + 1:
+                    # 客户端落后超过一个GOP，从最近的关键帧重新开始
+                    new = list(self.gop_fragments)
+            for seq, data in new:
+                last_seq = seq
+                yield data
+
+    # ---- LL-HLS ----
+
+    def _find_segment(self, seq):
+        if self.current_segment is not None and self.current_segment["seq"] == seq:
+            return self.current_segment
+        for segment in self.segments:
+            if segment["seq"] == seq:
+                return segment
+        return None
+
+    def _has_part(self, msn, part_index):
+        segment = self._find_segment(msn)
+        if segment is None:
+            return self.current_segment is not None and self.current_segment["seq"] > msn
+        if segment["complete"]:
+            return True
+        return len(segment["parts"]) > part_index and segment["parts"][part_index]["complete"]
+
+    def wait_for_part(self, msn, part_index, timeout=3.0):
+        """阻塞直到指定的分段/部分分段可用（用于阻塞式播放列表刷新和预加载提示）"""
+        with self.condition:
+            return self.condition.wait_for(lambda: self._has_part(msn, part_index), timeout)
+
+    def get_segment(self, seq):
+        with self.condition:
+            segment = self._find_segment(seq)
+            if segment is None or not segment["complete"]:
+                return None
+            return b"".join(part["data"][0] for part in segment["parts"])
+
+    def get_part(self, seq, part_index):
+        with self.condition:
+            segment = self._find_segment(seq)
+            if segment is None or len(segment["parts"]) <= part_index:
+                return None
+            part = segment["parts"][part_index]
+            return part["data"][0] if part["complete"] else None
+
+    def playlist(self):
+        """生成LL-HLS媒体播放列表"""
+        with self.condition:
+            if self.init_segment is None or self.current_segment is None:
+                return None
+            part_target = self.part_frames / self.fps
+            segments = list(self.segments)
+            first_seq = segments[0]["seq"] if segments else self.current_segment["seq"]
+            lines = [
+                "#EXTM3U",
+                "#EXT-X-VERSION:9",
+                f"#EXT-X-TARGETDURATION:{math.ceil(self.max_segment_duration)}",
+                f"#EXT-X-PART-INF:PART-TARGET={part_target:.3f}",
+                f"#EXT-X-SERVER-CONTROL:CAN-BLOCK-RELOAD=YES,PART-HOLD-BACK={part_target * 3:.3f}",
+                f"#EXT-X-MEDIA-SEQUENCE:{first_seq}",
+                '#EXT-X-MAP:URI="init.mp4"',
+            ]
+            # 只为最近两个完整分段列出部分分段，减少播放列表体积
+            for index, segment in enumerate(segments):
+                if index >= len(segments) - 2:
+                    lines.extend(self._part_lines(segment))
+                lines.append(f"#EXTINF:{segment['duration']:.3f},")
+                lines.append(f"seg{segment['seq']}.m4s")
+
+            lines.extend(self._part_lines(self.current_segment))
+            next_seq = self.current_segment["seq"]
+            next_part = len(self.current_segment["parts"])
+            if self.current_segment["parts"] and not self.current_segment["parts"][-1]["complete"]:
+                next_part -= 1
+            elif next_part * self.part_frames >= self.gop:
+                # 当前分段的部分分段已满，下一个部分分段属于下一个GOP
+                next_seq += 1
+                next_part = 0
+            lines.append(f'#EXT-X-PRELOAD-HINT:TYPE=PART,URI="seg{next_seq}.{next_part}.m4s"')
+            return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _part_lines(segment):
+        lines = []
+        for index, part in enumerate(segment["parts"]):
+            if not part["complete"]:
+                break
+            independent = ",INDEPENDENT=YES" if part["independent"] else ""
+            lines.append(f'#EXT-X-PART:DURATION={part["duration"]:.3f},URI="seg{segment["seq"]}.{index}.m4s"{independent}')
+        return lines
@@ -0,0 +1,77 @@
+"""基于摄像头请求元数据的光线估计
+
+夜视切换原来每帧把中心区域转灰度求平均，得到的是"画面亮度"而不是"场景亮度"：
+传感器曝光和增益变化后同样的场景亮度不同。摄像头每帧的元数据里已经有 Lux（ISP按标定参数估计的
+场景照度）以及实际生效的 ExposureTime、AnalogueGain、DigitalGain，据此估计几乎没有计算量。
+
+光线水平统一换算为"参考曝光（60000us x 增益6.0，原固定配置）下的画面平均亮度"，
+与原来的 light_threshold 使用同一个尺度：
+  - lux:      元数据中有 Lux 时，光线水平 = Lux / lux_per_level
+  - exposure: 没有 Lux 时，用分析流亮度图的平均亮度按实际曝光量换算到参考曝光
+  - pixels:   元数据不可用时返回None，由调用方退回到原来的像素统计
+
+参考曝光下的画面亮度最高为255，元数据换算的结果却没有上限（白天的 Lux 约对应几千）。
+夜视判断按这个尺度线性平滑，未限幅时从白天降到阈值以下要多等几倍的时间，
+所以返回值限制在 0-255，与原来像素统计的范围相同，light_threshold 的含义不变；
+未限幅的值保留在输入的 raw_level 中。
+
+lux_per_level 由 OV5647 调优文件（ov5647.json 的 rpi.lux）推导：libcamera按
+  Lux = 参考照度 x (参考曝光 x 参考增益)/(曝光 x 增益) x Y/参考Y
+估计照度，而光线水平 = Y x 参考曝光量/(曝光 x 增益)，两者之比为常数。
+"""
+
+REFERENCE_EXPOSURE = 60000
+REFERENCE_GAIN = 6.0
+MAX_LEVEL = 255.0  # 参考曝光下画面平均亮度的上限
+
+# ov5647.json rpi.lux: reference_shutter_speed, reference_gain, reference_lux, reference_Y(16位)
+OV5647_LUX_REFERENCE = (21663, 1.0, 987, 8854)
+
+
+def lux_per_level_from_tuning(shutter, gain, lux, y16):
+    """由调优文件的照度标定参数计算 Lux 与光线水平之比"""
+    reference_y = y16 / 65536 * 255
+    return lux * shutter * gain / (reference_y * REFERENCE_EXPOSURE * REFERENCE_GAIN)
+
+
+DEFAULT_LUX_PER_LEVEL = lux_per_level_from_tuning(*OV5647_LUX_REFERENCE)
+
+
+class LightEstimator:
+    """从单帧元数据（和可选的亮度图）估计光线水平"""
+
+    def __init__(self, lux_per_level=DEFAULT_LUX_PER_LEVEL, use_lux=True):
+        self.lux_per_level = lux_per_level
+        self.use_lux = use_lux
+        self.counts = {"lux": 0, "exposure": 0, "pixels": 0}
+
+    def estimate(self, metadata, luma=None):
+        """返回 (光线水平, 来源, 输入)；元数据不足时光线水平和来源为None"""
+        metadata = metadata or {}
+        inputs = {
+            "lux": metadata.get("Lux"),
+            "exposure_us": metadata.get("ExposureTime"),
+            "analogue_gain": metadata.get("AnalogueGain"),
+            "digital_gain": metadata.get("DigitalGain")
+        }
+
+        if self.use_lux and inputs["lux"] is not None and self.lux_per_level > 0:
+            self.counts["lux"] += 1
+            return self._bounded(inputs["lux"] / self.lux_per_level, inputs), "lux", inputs
+
+        exposure = inputs["exposure_us"]
+        gain = inputs["analogue_gain"]
+        if exposure and gain and luma is not None and luma.size:
+            mean = float(luma.mean())
+            inputs["mean"] = round(mean, 1)
+            total = exposure * gain * (inputs["digital_gain"] or 1.0)
+            self.counts["exposure"] += 1
+            return self._bounded(mean * REFERENCE_EXPOSURE * REFERENCE_GAIN / total, inputs), "exposure", inputs
+
+        self.counts["pixels"] += 1
+        return None, None, inputs
+
+    @staticmethod
+    def _bounded(level, inputs):
+        inputs["raw_level"] = round(level, 1)
+        return min(max(level, 0.0), MAX_LEVEL)
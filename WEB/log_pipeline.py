@@ -0,0 +1,127 @@
+"""非阻塞、按调用位置限流的日志管道
+
+捕获线程里的 logger.error(...) 原来直接写入控制台和SD卡上的日志文件，
+SD卡写入偶尔会卡住几十到几百毫秒，出错路径每帧都会打印日志时会直接拖慢采集。
+
+  - 调用方只把日志记录放进有界队列（QueueHandler），由后台的 QueueListener 线程写控制台和文件
+  - 队列满时丢弃新记录并计数，而不是阻塞调用线程
+  - 同一调用位置（文件+行号）在时间窗口内超过限额的日志被抑制，
+    窗口结束后的下一条日志附带被抑制的条数；之后一直没有新日志的位置由 report_suppressed() 补报
+  - 日志文件按大小轮转，不会写满SD卡
+"""
+
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+
+class RateLimitFilter(logging.Filter):
+    """每个调用位置在 interval 秒内最多放行 burst 条日志"""
+
+    def __init__(self, burst=5, interval=10.0):
+        super().__init__()
+        self.burst = burst
+        self.interval = interval
+        self.sites = {}  # (路径, 行号) -> [窗口开始时间, 窗口内放行数, 被抑制数]
+        self.total_suppressed = 0
+        self.lock = threading.Lock()
+
+    def filter(self, record):
+        if self.burst <= 0:
+            return True
+        key = (record.pathname, record.lineno)
+        now = time.monotonic()
+        with self.lock:
+            site = self.sites.get(key)
+            if site is None or now - site[0] >= self.interval:
+                suppressed = site[2] if site is not None else 0
+                self.sites[key] = [now, 1, 0]
+            elif site[1] < self.burst:
+                site[1] += 1
+                return True
+            else:
+                site[2] += 1
+                self.total_suppressed += 1
+                return False
+
+        if suppressed:
+            record.msg = f"{record.getMessage()} (此前{self.interval:g}秒内另有{suppressed}条相同位置的日志被抑制)"
+            record.args = None
+        return True
+
+    def report_suppressed(self, logger):
+        """补报窗口已结束、但之后没有新日志的调用位置的抑制条数"""
+        now = time.monotonic()
+        pending = []
+        with self.lock:
+            for key, site in list(self.sites.items()):
+                if now - site[0] < self.interval:
+                    continue
+                if site[2]:
+                    pending.append((key, site[2]))
+                del self.sites[key]
+        for (path, line), count in pending:
+            logger.warning(f"{os.path.basename(path)}:{line} 的日志在{self.interval:g}秒内有{count}条被抑制")
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """队列满时丢弃日志记录，保证调用线程不会因为写日志而阻塞"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class LogPipeline:
+    def __init__(self, handler, listener, rate_filter):
+        self.handler = handler
+        self.listener = listener
+        self.rate_filter = rate_filter
+
+    def stats(self):
+        return {
+            "queued": self.handler.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "suppressed": self.rate_filter.total_suppressed
+        }
+
+    def stop(self):
+        """停止后台线程，写完队列中剩余的日志"""
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+
+def setup_logging(log_file, level=logging.INFO, fmt='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+                  max_bytes=5 * 1024 * 1024, backup_count=3, burst=5, interval=10.0, queue_size=10000):
+    """配置根日志记录器，返回 LogPipeline"""
+    formatter = logging.Formatter(fmt)
+    outputs = [logging.StreamHandler()]
+    if log_file:
+        outputs.append(logging.handlers.RotatingFileHandler(
+            log_file, maxBytes=max_bytes, backupCount=backup_count, encoding="utf-8"))
+    for output in outputs:
+        output.setFormatter(formatter)
+
+    handler = DroppingQueueHandler(queue.Queue(queue_size))
+    rate_filter = RateLimitFilter(burst, interval)
+    handler.addFilter(rate_filter)
+
+    root = logging.getLogger()
+    root.setLevel(level)
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+
+    listener = logging.handlers.QueueListener(handler.queue, *outputs, respect_handler_level=True)
+    listener.start()
+    return LogPipeline(handler, listener, rate_filter)
@@ -0,0 +1,312 @@
+"""UDP组播MJPEG分发
+
+每个已编码的JPEG帧被切分成带序号的UDP数据报发送到组播组，
+局域网内任意数量的观看端加入组播组即可接收，服务端只需发送一次。
+
+数据报格式（小端）：
+    magic(4s) version(B) reserved(B) frag_index(H) frag_count(H) frame_id(I) timestamp(d) frame_size(I) + JPEG分片
+
+接收端按 frame_id 重组，只有全部分片到齐的帧才会交付；
+更新的帧完成重组后，更早的未完成帧直接丢弃，不等待重传。
+
+参考接收端：
+    python mjpeg_multicast.py receive --group 239.255.42.99 --port 5004
+回环测试（模拟丢包，另外不经网络检查超时、头部不一致和越界分片的处理）：
+    python mjpeg_multicast.py selftest --loss 0.02
+"""
+
+import argparse
+import logging
+import os
+import random
+import socket
+import struct
+import time
+
+logger = logging.getLogger('mjpeg_multicast')
+
+PACKET_MAGIC = b"MJPM"
+PACKET_VERSION = 1
+PACKET_HEADER = struct.Struct("<4sBBHHIdI")
+DEFAULT_DATAGRAM_SIZE = 1400  # 低于以太网MTU，避免IP分片
+
+
+class MulticastSender:
+    """把JPEG帧切片发送到组播组"""
+
+    def __init__(self, group, port, ttl=1, interface=None, datagram_size=DEFAULT_DATAGRAM_SIZE, loss_rate=0.0):
+        self.address = (group, port)
+        self.payload_size = datagram_size - PACKET_HEADER.size
+        self.loss_rate = loss_rate  # 仅用于测试，按比例随机丢弃分片
+        self.frame_id = 0
+        self.stats = {"frames_sent": 0, "datagrams_sent": 0, "bytes_sent": 0, "send_errors": 0}
+
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, ttl)
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+        if interface:
+            self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_IF, socket.inet_aton(interface))
+
+    def send_frame(self, jpeg, timestamp=None):
+        """发送一帧，返回帧ID"""
+        self.frame_id = (self.frame_id + 1) & 0xFFFFFFFF
+        timestamp = timestamp if timestamp is not None else time.time()
+        data = memoryview(jpeg)
+        frag_count = max(1, (len(data) + self.payload_size - 1) // self.payload_size)
+        if frag_count > 0xFFFF:
+            raise ValueError(f"帧过大，无法分片: {len(data)} 字节")
+
+        for frag_index in range(frag_count):
+            if self.loss_rate and random.random() < self.loss_rate:
+                continue
+            header = PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, 0, frag_index, frag_count,
+                                        self.frame_id, timestamp, len(data))
+            payload = data[frag_index * self.payload_size:(frag_index + 1) * self.payload_size]
+            try:
+                # 使用分散写，避免把头部和分片拼接成新的bytes
+                sent = self.sock.sendmsg([header, payload], [], 0, self.address)
+                self.stats["datagrams_sent"] += 1
+                self.stats["bytes_sent"] += sent
+            except OSError:
+                self.stats["send_errors"] += 1
+
+        self.stats["frames_sent"] += 1
+        return self.frame_id
+
+    def close(self):
+        self.sock.close()
+
+
+class FrameReassembler:
+    """按帧ID重组分片，不涉及网络，便于单独验证丢包和乱序行为"""
+
+    def __init__(self, max_pending=4, frame_timeout=1.0):
+        self.max_pending = max_pending
+        self.frame_timeout = frame_timeout
+        self.pending = {}  # frame_id -> 重组状态
+        self.last_completed = None
+        self.stats = {"frames_completed": 0, "frames_dropped": 0, "fragments_received": 0,
+                      "fragments_duplicate": 0, "fragments_late": 0, "bad_packets": 0}
+
+    @staticmethod
+    def _is_newer(a, b):
+        """考虑32位回绕的帧ID比较"""
+        return 0 < ((a - b) & 0xFFFFFFFF) < 0x80000000
+
+    def _drop(self, frame_id):
+        del self.pending[frame_id]
+        self.stats["frames_dropped"] += 1
+
+    def feed(self, datagram, now=None):
+        """处理一个数据报，帧完整时返回 (frame_id, timestamp, jpeg)，否则返回None"""
+        now = now if now is not None else time.time()
+        if len(datagram) < PACKET_HEADER.size:
+            self.stats["bad_packets"] += 1
+            return None
+
+        magic, version, _, frag_index, frag_count, frame_id, timestamp, frame_size = \
+            PACKET_HEADER.unpack_from(datagram)
+        if magic != PACKET_MAGIC or version != PACKET_VERSION or frag_index >= frag_count:
+            self.stats["bad_packets"] += 1
+            return None
+
+        if self.last_completed is not None and not self._is_newer(frame_id, self.last_completed):
+            self.stats["fragments_late"] += 1
+            return None
+
+        # 先清理超时和超额的帧，再取本帧的状态，之后不会再有别处删除它
+        self._expire(now, frame_id)
+        state = self.pending.get(frame_id)
+        if state is None:
+            state = {"parts": [None] * frag_count, "received": 0, "size": frame_size,
+                     "timestamp": timestamp, "first_seen": now}
+            self.pending[frame_id] = state
+        elif frag_count != len(state["parts"]) or frame_size != state["size"]:
+            # 与同一帧已收到的分片头部不一致，丢弃该分片，不破坏已重组的部分
+            self.stats["bad_packets"] += 1
+            return None
+
+        self.stats["fragments_received"] += 1
+        if state["parts"][frag_index] is not None:
+            self.stats["fragments_duplicate"] += 1
+            return None
+
+        state["parts"][frag_index] = bytes(datagram[PACKET_HEADER.size:])
+        state["received"] += 1
+
+        if state["received"] < len(state["parts"]):
+            return None
+
+        jpeg = b"".join(state["parts"])
+        del self.pending[frame_id]
+        if len(jpeg) != state["size"]:
+            self.stats["bad_packets"] += 1
+            return None
+
+        # 新帧已完整，比它更早的未完成帧不再等待
+        for older_id in [fid for fid in self.pending if self._is_newer(frame_id, fid)]:
+            self._drop(older_id)
+
+        self.last_completed = frame_id
+        self.stats["frames_completed"] += 1
+        return frame_id, state["timestamp"], jpeg
+
+    def _expire(self, now, incoming):
+        """丢弃超时的帧；incoming 是即将新建状态的帧时，为它预留一个位置"""
+        for frame_id in [fid for fid, st in self.pending.items() if now - st["first_seen"] > self.frame_timeout]:
+            self._drop(frame_id)
+        limit = self.max_pending if incoming in self.pending else self.max_pending - 1
+        while self.pending and len(self.pending) > limit:
+            oldest = min(self.pending, key=lambda fid: self.pending[fid]["first_seen"])
+            self._drop(oldest)
+
+
+class MulticastReceiver:
+    """加入组播组并交付完整的JPEG帧"""
+
+    def __init__(self, group, port, interface="0.0.0.0", max_pending=4, frame_timeout=1.0):
+        self.sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        # 提高接收缓冲区，避免突发的分片被内核丢弃
+        self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4 * 1024 * 1024)
+        self.sock.bind(("", port))
+        membership = struct.pack("4s4s", socket.inet_aton(group), socket.inet_aton(interface))
+        self.sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+        self.reassembler = FrameReassembler(max_pending, frame_timeout)
+        self.buffer = bytearray(65536)
+
+    @property
+    def stats(self):
+        return self.reassembler.stats
+
+    def receive(self, timeout=1.0):
+        """阻塞直到收到一个完整帧，超时返回None"""
+        deadline = time.time() + timeout
+        view = memoryview(self.buffer)
+        while True:
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                return None
+            self.sock.settimeout(remaining)
+            try:
+                length = self.sock.recv_into(self.buffer)
+            except socket.timeout:
+                return None
+            frame = self.reassembler.feed(view[:length])
+            if frame is not None:
+                return frame
+
+    def close(self):
+        self.sock.close()
+
+
+def run_receiver(args):
+    """参考接收端：统计帧率、丢帧和延迟，可选保存最新帧"""
+    receiver = MulticastReceiver(args.group, args.port, args.interface)
+    report_time = time.time()
+    frames = 0
+    latency_total = 0.0
+    try:
+        while True:
+            frame = receiver.receive(timeout=2.0)
+            if frame is not None:
+                frame_id, timestamp, jpeg = frame
+                frames += 1
+                latency_total += time.time() - timestamp
+                if args.save:
+                    with open(args.save, "wb") as f:
+                        f.write(jpeg)
+            if time.time() - report_time >= 2.0:
+                elapsed = time.time() - report_time
+                avg_latency = latency_total / frames * 1000 if frames else 0
+                print(f"{frames / elapsed:.1f} fps, 平均延迟 {avg_latency:.1f}ms, 统计: {receiver.stats}")
+                frames = 0
+                latency_total = 0.0
+                report_time = time.time()
+    except KeyboardInterrupt:
+        receiver.close()
+
+
+def check_reassembler():
+    """不经网络验证超时、头部不一致和越界分片的处理，返回失败项列表"""
+    def packet(frag_index, frag_count, frame_id, payload, frame_size=4):
+        return PACKET_HEADER.pack(PACKET_MAGIC, PACKET_VERSION, 0, frag_index, frag_count,
+                                  frame_id, 0.0, frame_size) + payload
+
+    failures = []
+    reassembler = FrameReassembler(frame_timeout=1.0)
+    # 分片间隔超过超时：旧状态被清理，迟到的分片开始新的重组，而不是出错
+    reassembler.feed(packet(0, 2, 1, b"ab"), now=0.0)
+    if reassembler.feed(packet(1, 2, 1, b"cd"), now=2.0) is not None:
+        failures.append("超时后的分片不应完成已清理的帧")
+    if reassembler.feed(packet(0, 2, 1, b"ab"), now=2.1) != (1, 0.0, b"abcd"):
+        failures.append("超时后重新收到的分片未能完成重组")
+
+    reassembler = FrameReassembler()
+    reassembler.feed(packet(0, 2, 5, b"ab"), now=0.0)
+    reassembler.feed(packet(1, 3, 5, b"xx"), now=0.0)
+    reassembler.feed(packet(1, 2, 5, b"xx", frame_size=6), now=0.0)
+    reassembler.feed(packet(2, 2, 6, b"xx"), now=0.0)
+    if reassembler.stats["bad_packets"] != 3:
+        failures.append(f"分片数、帧大小不一致或序号越界的分片应计为坏包: {reassembler.stats}")
+    if reassembler.feed(packet(1, 2, 5, b"cd"), now=0.0) != (5, 0.0, b"abcd"):
+        failures.append("坏包破坏了已收到的分片")
+    return failures
+
+
+def run_selftest(args):
+    """在回环接口上发送随机数据帧，验证重组正确性和丢包行为"""
+    failures = check_reassembler()
+    for failure in failures:
+        print(f"重组检查失败: {failure}")
+    receiver = MulticastReceiver(args.group, args.port, "127.0.0.1")
+    sender = MulticastSender(args.group, args.port, interface="127.0.0.1", loss_rate=args.loss)
+    sent = {}
+    received = 0
+    corrupted = 0
+
+    for _ in range(args.frames):
+        payload = os.urandom(args.frame_size)
+        frame_id = sender.send_frame(payload)
+        sent[frame_id] = payload
+        # 逐帧接收，模拟观看端跟上发送节奏
+        while True:
+            frame = receiver.receive(timeout=0.05)
+            if frame is None:
+                break
+            received += 1
+            if sent.get(frame[0]) != frame[2]:
+                corrupted += 1
+
+    expected_complete = (1 - args.loss) ** ((args.frame_size + sender.payload_size - 1) // sender.payload_size)
+    print(f"发送 {args.frames} 帧, 完整接收 {received} 帧, 内容错误 {corrupted} 帧")
+    print(f"理论完整率 {expected_complete * 100:.1f}%, 实际 {received / args.frames * 100:.1f}%")
+    print(f"发送统计: {sender.stats}")
+    print(f"接收统计: {receiver.stats}")
+    sender.close()
+    receiver.close()
+    return 0 if corrupted == 0 and not failures else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="UDP组播MJPEG接收端与回环测试")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    recv = sub.add_parser("receive", help="接收组播视频流")
+    recv.add_argument("--group", default="239.255.42.99")
+    recv.add_argument("--port", type=int, default=5004)
+    recv.add_argument("--interface", default="0.0.0.0", help="加入组播组使用的本机接口地址")
+    recv.add_argument("--save", help="把最新一帧保存到此文件")
+
+    test = sub.add_parser("selftest", help="回环接口上的重组和丢包测试")
+    test.add_argument("--group", default="239.255.42.99")
+    test.add_argument("--port", type=int, default=5004)
+    test.add_argument("--loss", type=float, default=0.0, help="模拟的分片丢失率")
+    test.add_argument("--frames", type=int, default=200)
+    test.add_argument("--frame-size", type=int, default=50000)
+
+    args = parser.parse_args()
+    if args.command == "receive":
+        run_receiver(args)
+    else:
+        raise SystemExit(run_selftest(args))
@@ -0,0 +1,370 @@
+"""声明式的图像处理图
+
+原来的处理流程分散在 process_frame、enhance_frame 和 apply_night_vision（三种夜视模式各抄一遍）中，
+状态用 hasattr 挂在函数对象上，帧计数器每帧加两次，夜视状态也要检查两次。现在每种处理流程是一张
+ProcessingGraph，由若干 Stage 组成，每个阶段声明：
+  - inputs/output: 输入和输出的名称，图按这些依赖排序（不要求按依赖顺序声明），缺少输入或有环时创建图即报错
+  - every/phase:   每every帧在 帧序号 % every == phase 的帧上执行一次
+  - enabled:       启用条件 enabled(ctx)，例如只在开启绿色夜视时执行
+  - scale:         处理分辨率比例（数值或无参函数），执行前写入 ctx.scale，由阶段函数自行使用
+  - inplace:       直接修改第一个输入并返回它（如文字叠加）
+  - prepare:       每帧执行前调用一次 prepare(ctx)，返回值作为 ctx.params（平滑参数、生成查找表等帧级状态）
+  - halo:          逐像素或小卷积核阶段需要的上下文行数（逐像素为0），声明后可以按条带并行执行，
+                   输出与输入尺寸相同；None 表示只能整幅处理
+白天和三种夜视模式之间的切换就是换一张图。
+
+ProcessingEngine 执行图：
+  - 本帧不执行的阶段（间隔未到、条件不满足或出错），输出直接等于第一个输入
+  - 中间结果写入按阶段分配一次的缓冲区（ctx.output），尺寸变化时重新分配；图的最终输出每帧新分配，
+    因为它会作为 latest_frame 被其他线程读取，之后不能再被改写
+  - 记录每个阶段的执行次数、跳过次数、错误次数和耗时
+  - 设置了条带调度器（band_parallel.BandScheduler）时，连续的、只被下一个阶段使用的可条带化阶段
+    合并为一段，整段在每个条带上依次执行（见 band_parallel.py），结果与整幅处理逐位相同
+"""
+
+import logging
+import time
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """处理图中的一个阶段，function(ctx, *inputs) 返回输出数组"""
+
+    def __init__(self, name, function, inputs=("frame",), output=None, every=1, phase=0, enabled=None,
+                 scale=None, inplace=False, prepare=None, halo=None):
+        if every < 1:
+            raise ValueError(f"阶段 {name} 的执行间隔必须不小于1")
+        self.name = name
+        self.function = function
+        self.inputs = tuple(inputs)
+        self.output = output or name
+        self.every = every
+        self.phase = phase % every
+        self.enabled = enabled
+        self.scale = scale
+        self.inplace = inplace
+        self.prepare = prepare
+        self.halo = halo
+
+    def should_run(self, ctx):
+        if self.every > 1 and ctx.index % self.every != self.phase:
+            return False
+        return self.enabled is None or bool(self.enabled(ctx))
+
+    @property
+    def bandable(self):
+        """是否可以按条带并行执行：声明了halo、单输入且不原地修改"""
+        return self.halo is not None and not self.inplace and len(self.inputs) == 1
+
+    def resolve_scale(self):
+        if self.scale is None:
+            return 1.0
+        return float(self.scale() if callable(self.scale) else self.scale)
+
+
+class ProcessingGraph:
+    """一组阶段及其依赖关系，inputs 为外部提供的输入名称，output 为图的输出名称"""
+
+    def __init__(self, name, stages, inputs=("frame",), output=None):
+        self.name = name
+        self.inputs = tuple(inputs)
+        self.producers = {}
+        for stage in stages:
+            if stage.output in self.producers or stage.output in self.inputs:
+                raise ValueError(f"处理图 {name} 中 {stage.output} 被多次产生")
+            self.producers[stage.output] = stage
+        self.stages = self._sort(stages)
+        self.output = output or (self.stages[-1].output if self.stages else self.inputs[0])
+        if self.output not in self.producers and self.output not in self.inputs:
+            raise ValueError(f"处理图 {name} 没有产生输出 {self.output}")
+
+    def _sort(self, stages):
+        """按依赖拓扑排序，没有依赖关系的阶段保持声明顺序"""
+        ordered = []
+        available = set(self.inputs)
+        pending = list(stages)
+        while pending:
+            ready = next((stage for stage in pending if all(name in available for name in stage.inputs)), None)
+            if ready is None:
+                missing = sorted({name for stage in pending for name in stage.inputs
+                                  if name not in available and name not in self.producers})
+                detail = f"缺少输入 {', '.join(missing)}" if missing else "存在循环依赖"
+                raise ValueError(f"处理图 {self.name} 无法排序: {detail}")
+            pending.remove(ready)
+            ordered.append(ready)
+            available.add(ready.output)
+        return ordered
+
+    def describe(self):
+        return [{"name": stage.name, "inputs": list(stage.inputs), "output": stage.output, "every": stage.every,
+                 "conditional": stage.enabled is not None, "inplace": stage.inplace} for stage in self.stages]
+
+
+class FrameContext:
+    """一次图执行中传给各阶段的上下文"""
+
+    __slots__ = ("engine", "index", "stage", "scale", "params", "fresh")
+
+    def __init__(self, engine, index):
+        self.engine = engine
+        self.index = index
+        self.stage = None
+        self.scale = 1.0
+        self.params = None
+        self.fresh = False
+
+    def output(self, shape, dtype=np.uint8):
+        """当前阶段的输出缓冲区：中间结果复用按阶段分配的数组，图的最终输出每次新分配"""
+        if self.fresh:
+            return np.empty(shape, dtype)
+        return self.engine.buffer(self.stage.name, shape, dtype)
+
+
+class BandContext(FrameContext):
+    """条带中执行阶段时的上下文：输出写入该条带自己的缓冲区，或直接写入整幅输出的对应行"""
+
+    __slots__ = ("band", "target")
+
+    def __init__(self, ctx, band):
+        super().__init__(ctx.engine, ctx.index)
+        self.band = band
+        self.target = None
+
+    def output(self, shape, dtype=np.uint8):
+        if self.target is not None and self.target.shape == tuple(shape) and self.target.dtype == dtype:
+            return self.target
+        return self.engine.buffer(("band", self.band, self.stage.name), shape, dtype)
+
+
+class ProcessingEngine:
+    """执行处理图，复用中间缓冲区并统计每个阶段的耗时"""
+
+    def __init__(self, bands=None):
+        self.bands = bands           # BandScheduler，None 时所有阶段整幅执行
+        self.buffers = {}
+        self.plans = {}
+        self.stage_stats = {}
+        self.graph_frames = {}
+        self.current_graph = None
+        self.switches = 0
+        self.last_ms = 0.0
+
+    def buffer(self, key, shape, dtype=np.uint8):
+        array = self.buffers.get(key)
+        if array is None or array.shape != tuple(shape) or array.dtype != dtype:
+            array = self.buffers[key] = np.empty(shape, dtype)
+        return array
+
+    def clear_buffers(self):
+        self.buffers.clear()
+
+    def _is_internal(self, array, inputs):
+        return any(array is value for value in inputs.values()) or \
+            any(array is buffer for buffer in list(self.buffers.values()))
+
+    @staticmethod
+    def _fresh_stage(graph, running):
+        """本帧最终输出由哪个阶段新分配：从输出往回找第一个执行且不是原地修改的阶段，找不到时返回None"""
+        name = graph.output
+        while name in graph.producers:
+            stage = graph.producers[name]
+            if stage.name in running and not stage.inplace:
+                return stage.name
+            name = stage.inputs[0]
+        return None
+
+    def _plan(self, graph, running):
+        """把本帧执行的阶段分成若干段，可条带化且首尾相接的阶段合并为一段，结果按执行集合缓存"""
+        key = (graph.name, running)
+        plan = self.plans.get(key)
+        if plan is not None:
+            return plan
+
+        def resolve(name):
+            # 跳过的阶段输出等于第一个输入
+            while name in graph.producers and graph.producers[name].name not in running:
+                name = graph.producers[name].inputs[0]
+            return name
+
+        stages = [stage for stage in graph.stages if stage.name in running]
+        consumers = {}
+        for stage in stages:
+            for name in stage.inputs:
+                consumers[resolve(name)] = consumers.get(resolve(name), 0) + 1
+        consumers[resolve(graph.output)] = consumers.get(resolve(graph.output), 0) + 1
+
+        plan = []
+        for stage in stages:
+            previous = plan[-1] if plan else None
+            if stage.bandable and previous is not None and previous[0].bandable and \
+                    resolve(stage.inputs[0]) == previous[-1].output and consumers[previous[-1].output] == 1:
+                previous.append(stage)
+            else:
+                plan.append([stage])
+        plan = [(segment, [resolve(name) for name in segment[0].inputs]) for segment in plan]
+        self.plans[key] = plan
+        return plan
+
+    def _record(self, graph, stage, elapsed_ms=None, error=False, banded=False):
+        stats = self.stage_stats.setdefault((graph.name, stage.name),
+                                            {"runs": 0, "skips": 0, "errors": 0, "banded": 0,
+                                             "last_ms": 0.0, "avg_ms": 0.0})
+        if error:
+            stats["errors"] += 1
+        elif elapsed_ms is None:
+            stats["skips"] += 1
+        else:
+            stats["runs"] += 1
+            stats["banded"] += banded
+            stats["last_ms"] = elapsed_ms
+            stats["avg_ms"] = elapsed_ms if stats["runs"] == 1 else stats["avg_ms"] * 0.9 + elapsed_ms * 0.1
+
+    def _run_stage(self, graph, stage, ctx, args, fresh, prepared=None):
+        """整幅执行一个阶段；prepared 中已有该阶段的 (scale, params) 时直接使用，不再调用 prepare"""
+        ctx.stage = stage
+        ctx.fresh = stage.name == fresh
+        stage_start = time.perf_counter()
+        try:
+            if prepared is not None and stage.name in prepared:
+                ctx.scale, ctx.params = prepared[stage.name]
+            else:
+                ctx.scale = stage.resolve_scale()
+                ctx.params = stage.prepare(ctx) if stage.prepare is not None else None
+            result = stage.function(ctx, *args)
+            self._record(graph, stage, (time.perf_counter() - stage_start) * 1000)
+        except Exception as e:
+            logger.error(f"处理阶段 {graph.name}/{stage.name} 出错: {e}")
+            self._record(graph, stage, error=True)
+            result = args[0]
+            if ctx.fresh:
+                # 该阶段本应新分配最终输出，之后的原地修改不能改到复用的缓冲区或原始画面
+                result = result.copy()
+        return result
+
+    def _run_bands(self, graph, segment, ctx, source, fresh, prepared):
+        """在每个条带上依次执行整段阶段，返回整幅输出；条带数为1时返回None，由调用方逐阶段整幅执行
+
+        每个阶段的 (scale, params) 写入 prepared，条带执行出错改为整幅执行时沿用，
+        prepare 每帧只调用一次（亮度平滑等帧级状态不会前进两次）。
+        """
+        rows = source.shape[0]
+        bounds = self.bands.split(rows)
+        if len(bounds) < 2:
+            return None
+
+        params = []
+        for stage in segment:
+            ctx.stage = stage
+            ctx.scale = stage.resolve_scale()
+            prepared[stage.name] = (ctx.scale, stage.prepare(ctx) if stage.prepare is not None else None)
+            params.append(prepared[stage.name])
+        last = segment[-1]
+        ctx.stage = last
+        ctx.fresh = last.name == fresh
+        output = ctx.output(source.shape, source.dtype)
+        # context[k]: 第k个阶段的输入需要在条带上下各多取的行数 = 它及之后所有阶段的halo之和
+        context = [sum(stage.halo for stage in segment[k:]) for k in range(len(segment) + 1)]
+        timings = [0.0] * len(segment)
+
+        def run_band(band):
+            y0, y1 = bounds[band]
+            top, bottom = max(0, y0 - context[0]), min(rows, y1 + context[0])
+            data = source[top:bottom]
+            band_ctx = BandContext(ctx, band)
+            for k, stage in enumerate(segment):
+                band_ctx.stage = stage
+                band_ctx.scale, band_ctx.params = params[k]
+                # 最后一个阶段输入恰好是本条带的行时，直接写入整幅输出
+                band_ctx.target = output[y0:y1] if stage is last and (top, bottom) == (y0, y1) else None
+                start = time.perf_counter()
+                result = stage.function(band_ctx, data)
+                if band == 0:
+                    timings[k] = (time.perf_counter() - start) * 1000
+                new_top, new_bottom = max(0, y0 - context[k + 1]), min(rows, y1 + context[k + 1])
+                data = result[new_top - top:new_bottom - top]
+                top, bottom = new_top, new_bottom
+            if band_ctx.target is None or not np.may_share_memory(data, output):
+                output[y0:y1] = data
+
+        self.bands.map(run_band, len(bounds))
+        for stage, elapsed in zip(segment, timings):
+            self._record(graph, stage, elapsed, banded=True)
+        return output
+
+    def run(self, graph, inputs, index):
+        """执行一次处理图，inputs 为 {输入名: 数组}，只有一个输入时可直接传数组；返回图的输出"""
+        if not isinstance(inputs, dict):
+            inputs = {graph.inputs[0]: inputs}
+        if graph.name != self.current_graph:
+            if self.current_graph is not None:
+                self.switches += 1
+                logger.debug(f"处理图切换: {self.current_graph} -> {graph.name}")
+            self.current_graph = graph.name
+        self.graph_frames[graph.name] = self.graph_frames.get(graph.name, 0) + 1
+
+        start = time.perf_counter()
+        ctx = FrameContext(self, index)
+        running = frozenset(stage.name for stage in graph.stages if stage.should_run(ctx))
+        fresh = self._fresh_stage(graph, running)
+
+        values = dict(inputs)
+        if fresh is None and graph.output in graph.producers:
+            # 没有阶段新分配输出（全部跳过或只有原地修改）：先复制输入，原地修改不能改到原始画面
+            source = graph.output
+            while source in graph.producers:
+                source = graph.producers[source].inputs[0]
+            values[source] = values[source].copy()
+
+        for stage in graph.stages:
+            if stage.name not in running:
+                self._record(graph, stage)
+
+        for segment, sources in self._plan(graph, running):
+            args = [values[name] for name in sources]
+            result = None
+            prepared = {}
+            if segment[0].bandable and self.bands is not None:
+                try:
+                    result = self._run_bands(graph, segment, ctx, args[0], fresh, prepared)
+                except Exception as e:
+                    # 条带执行出错时整段改为逐阶段整幅执行，由其中的错误处理跳过出错的阶段
+                    logger.error(f"处理图 {graph.name} 条带执行出错: {e}")
+                    result = None
+            if result is None:
+                result = args[0]
+                for stage in segment:
+                    result = self._run_stage(graph, stage, ctx, [result] if stage is not segment[0] else args,
+                                             fresh, prepared)
+                    values[stage.output] = result
+            values[segment[-1].output] = result
+
+        # 跳过的阶段输出等于第一个输入
+        output_name = graph.output
+        while output_name in graph.producers and graph.producers[output_name].name not in running:
+            output_name = graph.producers[output_name].inputs[0]
+        output = values[output_name]
+        if self._is_internal(output, inputs):
+            # 负责新分配输出的阶段出错时，输出可能是复用的缓冲区或原始画面
+            output = output.copy()
+        self.last_ms = (time.perf_counter() - start) * 1000
+        return output
+
+    def stats(self, graph=None):
+        """当前（或指定）处理图各阶段的统计
+
+        由HTTP线程调用，捕获线程可能同时插入新的阶段统计，先复制条目列表再遍历。
+        """
+        name = graph or self.current_graph
+        return {
+            "graph": self.current_graph,
+            "switches": self.switches,
+            "last_ms": self.last_ms,
+            "frames": dict(self.graph_frames),
+            "buffers_kb": sum(buffer.nbytes for buffer in list(self.buffers.values())) / 1024,
+            "bands": self.bands.state() if self.bands is not None else None,
+            "stages": {stage: dict(stats) for (graph_name, stage), stats in list(self.stage_stats.items())
+                       if graph_name == name}
+        }
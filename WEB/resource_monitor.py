@@ -0,0 +1,244 @@
+"""后台资源采样与内存分配跟踪
+
+ResourceSampler 在独立的低优先级线程中定期采样，不再占用捕获线程：
+  - 系统CPU使用率（非阻塞，取两次采样之间的平均值）、内存、进程RSS
+  - CPU温度（/sys/class/thermal）
+  - 树莓派降频/欠压状态（vcgencmd get_throttled）
+  - 每个线程的CPU占用（按线程名汇总，便于区分捕获、编码和HTTP线程）
+采样结果保存在环形缓冲区中。
+
+AllocationTracker 基于 tracemalloc，对比基准快照与当前快照，
+按代码行列出增长最多的内存分配，用于定位触发内存清理的增长来源。
+"""
+
+import logging
+import os
+import subprocess
+import threading
+import time
+import tracemalloc
+from collections import deque
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+logger = logging.getLogger('resource_monitor')
+
+THERMAL_ZONE_PATH = "/sys/class/thermal/thermal_zone0/temp"
+
+# vcgencmd get_throttled 的状态位
+THROTTLE_FLAGS = {
+    0: "under_voltage",
+    1: "freq_capped",
+    2: "throttled",
+    3: "soft_temp_limit",
+    16: "under_voltage_occurred",
+    17: "freq_capped_occurred",
+    18: "throttled_occurred",
+    19: "soft_temp_limit_occurred"
+}
+
+
+def read_cpu_temperature():
+    """读取CPU温度(°C)，不可用时返回None"""
+    try:
+        with open(THERMAL_ZONE_PATH, 'r') as f:
+            return int(f.read().strip()) / 1000.0
+    except (OSError, ValueError):
+        return None
+
+
+def read_throttled():
+    """读取树莓派降频状态，返回 (原始值, 已置位的状态列表)，非树莓派返回 (None, [])"""
+    try:
+        output = subprocess.run(["vcgencmd", "get_throttled"], capture_output=True, text=True, timeout=2).stdout
+        value = int(output.strip().split("=")[1], 16)
+    except (OSError, IndexError, ValueError, subprocess.SubprocessError):
+        return None, []
+    return value, [name for bit, name in THROTTLE_FLAGS.items() if value & (1 << bit)]
+
+
+def read_thread_cpu_times():
+    """返回 {线程ID: 累计CPU秒数}"""
+    if psutil is not None:
+        return {t.id: t.user_time + t.system_time for t in psutil.Process().threads()}
+
+    # 没有psutil时直接读取 /proc，utime 和 stime 是 stat 的第14、15个字段
+    times = {}
+    ticks = os.sysconf("SC_CLK_TCK")
+    try:
+        for tid in os.listdir("/proc/self/task"):
+            with open(f"/proc/self/task/{tid}/stat", 'r') as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            times[int(tid)] = (int(fields[11]) + int(fields[12])) / ticks
+    except (OSError, ValueError, IndexError):
+        pass
+    return times
+
+
+def lower_current_thread_priority(niceness=10):
+    """降低当前线程的调度优先级（Linux上nice值对单个线程生效）"""
+    try:
+        os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), niceness)
+        return True
+    except (AttributeError, OSError):
+        return False
+
+
+class ResourceSampler:
+    """定期采样系统和进程资源，结果保存在环形缓冲区中"""
+
+    def __init__(self, history_size=720, check_throttling=True):
+        self.history = deque(maxlen=history_size)
+        self.lock = threading.Lock()
+        self.check_throttling = check_throttling
+        self.process = psutil.Process() if psutil is not None else None
+        self.last_sample_time = None
+        self.last_process_cpu = None
+        self.last_thread_times = {}
+        if psutil is not None:
+            # 首次调用只建立基准，之后的调用返回两次调用之间的平均值，不会阻塞
+            psutil.cpu_percent(interval=None)
+
+    def sample(self):
+        """采集一次资源数据，追加到历史记录并返回"""
+        now = time.time()
+        process_cpu = sum(os.times()[:2])
+        thread_times = read_thread_cpu_times()
+        elapsed = now - self.last_sample_time if self.last_sample_time else None
+
+        sample = {
+            "time": now,
+            "cpu_percent": None,
+            "process_cpu_percent": None,
+            "memory_percent": None,
+            "available_memory_mb": None,
+            "rss_mb": None,
+            "cpu_temp": read_cpu_temperature(),
+            "throttled": None,
+            "throttle_flags": [],
+            "threads": {}
+        }
+
+        if psutil is not None:
+            memory = psutil.virtual_memory()
+            sample["cpu_percent"] = psutil.cpu_percent(interval=None)
+            sample["memory_percent"] = memory.percent
+            sample["available_memory_mb"] = memory.available / (1024 * 1024)
+            sample["rss_mb"] = self.process.memory_info().rss / (1024 * 1024)
+
+        if self.check_throttling:
+            sample["throttled"], sample["throttle_flags"] = read_throttled()
+
+        if elapsed:
+            sample["process_cpu_percent"] = (process_cpu - self.last_process_cpu) / elapsed * 100
+            # 按线程名汇总，同名线程（例如HTTP请求线程）合并统计
+            names = {t.native_id: t.name for t in threading.enumerate()}
+            threads = {}
+            for tid, cpu_time in thread_times.items():
+                previous = self.last_thread_times.get(tid, cpu_time)
+                name = names.get(tid, "other")
+                if "process_request_thread" in name:
+                    name = "http"
+                threads[name] = threads.get(name, 0.0) + (cpu_time - previous) / elapsed * 100
+            sample["threads"] = {name: round(value, 1) for name, value in sorted(threads.items())}
+
+        self.last_sample_time = now
+        self.last_process_cpu = process_cpu
+        self.last_thread_times = thread_times
+
+        with self.lock:
+            self.history.append(sample)
+        return sample
+
+    def latest(self):
+        with self.lock:
+            return self.history[-1] if self.history else None
+
+    def get_history(self, window=None):
+        """返回最近window秒内的采样，window为None时返回全部"""
+        with self.lock:
+            samples = list(self.history)
+        if window is not None:
+            cutoff = time.time() - window
+            samples = [s for s in samples if s["time"] >= cutoff]
+        return samples
+
+
+class AllocationTracker:
+    """tracemalloc内存分配跟踪，比较基准快照与当前快照的差异"""
+
+    def __init__(self, frames=10):
+        self.frames = frames
+        self.baseline = None
+        self.baseline_time = None
+        self.lock = threading.Lock()
+
+    @property
+    def active(self):
+        return tracemalloc.is_tracing()
+
+    def start(self):
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(self.frames)
+            logger.info(f"已启用tracemalloc内存分配跟踪（保留{self.frames}层调用栈）")
+        self.reset_baseline()
+
+    def stop(self):
+        with self.lock:
+            self.baseline = None
+        tracemalloc.stop()
+
+    def _take_snapshot(self):
+        # 排除tracemalloc自身和导入机制的分配
+        return tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+        ))
+
+    def reset_baseline(self):
+        with self.lock:
+            self.baseline = self._take_snapshot()
+            self.baseline_time = time.time()
+
+    def diff(self, limit=15, key_type="lineno"):
+        """返回自基准快照以来增长最多的分配位置"""
+        if not tracemalloc.is_tracing():
+            return None
+        snapshot = self._take_snapshot()
+        with self.lock:
+            baseline = self.baseline
+            baseline_time = self.baseline_time
+        if baseline is None:
+            return None
+
+        stats = snapshot.compare_to(baseline, key_type)
+        current, peak = tracemalloc.get_traced_memory()
+        return {
+            "since": baseline_time,
+            "elapsed": time.time() - baseline_time,
+            "traced_mb": current / (1024 * 1024),
+            "peak_mb": peak / (1024 * 1024),
+            "overhead_mb": tracemalloc.get_tracemalloc_memory() / (1024 * 1024),
+            "top": [
+                {
+                    "location": str(stat.traceback[0]) if stat.traceback else "?",
+                    "traceback": stat.traceback.format()[-6:],
+                    "size_diff_kb": stat.size_diff / 1024,
+                    "size_kb": stat.size / 1024,
+                    "count_diff": stat.count_diff
+                }
+                for stat in stats[:limit]
+            ]
+        }
+
+    def format_top(self, limit=5):
+        """生成便于写入日志的增长摘要"""
+        result = self.diff(limit)
+        if result is None:
+            return ""
+        lines = [f"{item['size_diff_kb']:+.1f}KB ({item['count_diff']:+d}) {item['location']}" for item in result["top"]]
+        return f"最近{result['elapsed']:.0f}秒内存增长最多的位置:\n  " + "\n  ".join(lines)
@@ -0,0 +1,160 @@
+"""运行中服务的采样分析器
+
+现场设备变慢时无法给systemd服务挂调试器，camera_server 通过 /debug/profile
+在进程内按固定间隔读取 sys._current_frames() 采样各线程的调用栈：
+  - 输出折叠栈（collapsed stacks），可直接交给 flamegraph.pl / speedscope 生成火焰图
+  - 输出按函数统计的自身耗时和累计耗时排行
+
+开销控制：
+  - 采样线程只读取栈帧，不插桩，目标线程不受影响
+  - 单次采样耗时超过预算（默认占采样间隔的5%）时自动拉长采样间隔
+  - 同一时间只允许一个分析任务，最长运行时间有上限
+
+生成火焰图：
+    curl "http://树莓派IP:8000/debug/profile?seconds=10&thread=capture&format=collapsed" > capture.collapsed
+    flamegraph.pl capture.collapsed > capture.svg
+"""
+
+import collections
+import os
+import sys
+import threading
+import time
+
+MAX_SECONDS = 60.0
+MIN_INTERVAL = 0.001
+
+_run_lock = threading.Lock()
+
+
+class ProfilerBusy(RuntimeError):
+    """已有分析任务在运行"""
+
+
+def thread_group(name):
+    """把线程名归类：werkzeug为每个请求创建的线程统一归为http"""
+    if "process_request_thread" in name:
+        return "http"
+    return name
+
+
+class SamplingProfiler:
+    """对匹配的线程做栈采样
+
+    - thread: "all" 或线程名/线程组（如 capture、http）
+    - interval: 期望的采样间隔(秒)
+    - overhead_budget: 采样耗时占采样间隔的上限比例
+    """
+
+    def __init__(self, thread="all", interval=0.01, overhead_budget=0.05, max_depth=64):
+        self.thread = thread
+        self.interval = max(MIN_INTERVAL, interval)
+        self.overhead_budget = overhead_budget
+        self.max_depth = max_depth
+        self.stacks = collections.Counter()
+        self.samples = 0
+        self.thread_samples = collections.Counter()
+        self.sampling_time = 0.0
+        self.elapsed = 0.0
+        self.effective_interval = self.interval
+
+    def _matches(self, group):
+        return self.thread == "all" or group == self.thread
+
+    def _stack_key(self, group, frame):
+        parts = []
+        while frame is not None and len(parts) < self.max_depth:
+            code = frame.f_code
+            parts.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        parts.append(group)
+        return ";".join(reversed(parts))
+
+    def sample_once(self, exclude=()):
+        names = {t.ident: t.name for t in threading.enumerate()}
+        for ident, frame in sys._current_frames().items():
+            if ident in exclude:
+                continue
+            group = thread_group(names.get(ident, "unknown"))
+            if not self._matches(group):
+                continue
+            self.stacks[self._stack_key(group, frame)] += 1
+            self.thread_samples[group] += 1
+        self.samples += 1
+
+    def run(self, seconds, exclude=()):
+        """在当前线程中采样seconds秒，exclude为不采样的线程ID"""
+        seconds = min(max(0.1, seconds), MAX_SECONDS)
+        exclude = set(exclude) | {threading.get_ident()}
+        interval = self.interval
+        start = time.perf_counter()
+        deadline = start + seconds
+
+        while True:
+            now = time.perf_counter()
+            if now >= deadline:
+                break
+            self.sample_once(exclude)
+            cost = time.perf_counter() - now
+            self.sampling_time += cost
+            # 采样开销超出预算时拉长间隔，保证对被分析进程的影响有上限
+            interval = max(interval, cost / self.overhead_budget)
+            time.sleep(max(0.0, interval - cost))
+
+        self.elapsed = time.perf_counter() - start
+        self.effective_interval = self.elapsed / self.samples if self.samples else interval
+        return self
+
+    def collapsed(self):
+        """折叠栈文本，每行为 "调用栈 次数" """
+        return "\n".join(f"{stack} {count}" for stack, count in self.stacks.most_common()) + "\n"
+
+    def top(self, limit=20):
+        """按函数统计：self为处于栈顶的采样数，total为出现在栈中的采样数"""
+        self_counts = collections.Counter()
+        total_counts = collections.Counter()
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            # 函数级统计不区分行号
+            functions = [frame.rsplit(":", 1)[0] for frame in frames]
+            self_counts[functions[-1]] += count
+            for function in set(functions):
+                total_counts[function] += count
+
+        thread_total = sum(self.thread_samples.values()) or 1
+        return [
+            {
+                "function": function,
+                "self": count,
+                "self_percent": count / thread_total * 100,
+                "total": total_counts[function],
+                "total_percent": total_counts[function] / thread_total * 100
+            }
+            for function, count in self_counts.most_common(limit)
+        ]
+
+    def summary(self, limit=20):
+        return {
+            "thread": self.thread,
+            "seconds": self.elapsed,
+            "samples": self.samples,
+            "requested_interval_ms": self.interval * 1000,
+            "effective_interval_ms": self.effective_interval * 1000,
+            "overhead_percent": self.sampling_time / self.elapsed * 100 if self.elapsed else 0.0,
+            "thread_samples": dict(self.thread_samples),
+            "top": self.top(limit),
+            "collapsed": self.collapsed()
+        }
+
+
+def profile(seconds, thread="all", interval=0.01, exclude=()):
+    """运行一次分析，已有分析任务时抛出 ProfilerBusy"""
+    if not _run_lock.acquire(blocking=False):
+        raise ProfilerBusy("已有分析任务在运行")
+    try:
+        return SamplingProfiler(thread, interval).run(seconds, exclude)
+    finally:
+        _run_lock.release()
+
@@ -0,0 +1,242 @@
+"""定长NumPy环形缓冲区保存的统计历史
+
+原来FPS统计是一个10项的列表（每帧 pop(0)），平均FPS实际就是当前值，也没有任何历史可查。
+StatsHistory 用三级固定容量的环保存历史，内存在创建时一次分配，之后不再增长：
+  - 逐帧: 帧间隔、处理耗时、编码耗时、采集到编码完成的延迟、JPEG大小（默认4096帧，约2.7分钟@25fps）
+  - 逐秒: 由最近一秒的逐帧样本得到帧率、各耗时均值和帧间隔抖动，加上调用方提供的光线、运动、
+          CPU、温度、发送字节数等（默认6小时）
+  - 逐分钟: 每满一分钟把逐秒样本聚合为均值/最小值/最大值（默认7天）
+时间戳为float64，数值为float32，缺失值为NaN；默认容量下总共约3.3MB。
+
+窗口查询和降采样都是向量化的：环中两段各自按时间有序，用 searchsorted 定位窗口起点，
+按步长分桶后用 reduceat 一次算出每个桶的均值、最小值和最大值。
+"""
+
+import threading
+
+import numpy as np
+
+
+def _nan_stats(values):
+    """逐列统计（忽略NaN），返回 (均值, 有效样本数)"""
+    valid = ~np.isnan(values)
+    counts = valid.sum(axis=0)
+    sums = np.where(valid, values, 0).sum(axis=0, dtype=np.float64)
+    means = np.divide(sums, counts, out=np.full(sums.shape, np.nan), where=counts > 0)
+    return means, counts
+
+
+class TimeSeriesRing:
+    """固定容量的时序环：一列时间戳，每个指标一列float32"""
+
+    def __init__(self, metrics, capacity):
+        self.metrics = list(metrics)
+        self.columns = {name: index for index, name in enumerate(self.metrics)}
+        self.capacity = capacity
+        self.times = np.zeros(capacity, np.float64)
+        self.values = np.full((capacity, len(self.metrics)), np.nan, np.float32)
+        self.index = 0   # 下一个写入位置
+        self.count = 0
+        self.lock = threading.Lock()
+
+    @property
+    def nbytes(self):
+        return self.times.nbytes + self.values.nbytes
+
+    def append(self, timestamp, row):
+        """写入一行，row按 metrics 的顺序排列"""
+        with self.lock:
+            index = self.index
+            self.times[index] = timestamp
+            self.values[index] = row
+            self.index = (index + 1) % self.capacity
+            self.count = min(self.count + 1, self.capacity)
+
+    def span(self):
+        """环中最早和最新样本的时间，没有样本时为None"""
+        with self.lock:
+            if self.count == 0:
+                return None
+            oldest = 0 if self.count < self.capacity else self.index
+            return float(self.times[oldest]), float(self.times[self.index - 1])
+
+    def window(self, since=None):
+        """返回时间不早于since的 (时间, 数值) 副本，按时间排序"""
+        with self.lock:
+            if self.count < self.capacity:
+                segments = [(0, self.count)]
+            else:
+                # 环已写满：[index:] 是较早的一段，[:index] 是较新的一段，两段各自有序
+                segments = [(self.index, self.capacity), (0, self.index)]
+            times, values = [], []
+            for start, end in segments:
+                if since is not None:
+                    start += int(np.searchsorted(self.times[start:end], since, side="left"))
+                if start < end:
+                    times.append(self.times[start:end])
+                    values.append(self.values[start:end])
+            if not times:
+                return np.empty(0, np.float64), np.empty((0, len(self.metrics)), np.float32)
+            return np.concatenate(times), np.concatenate(values)
+
+    def column(self, metric, since=None):
+        """单个指标在窗口内的有效样本 (时间, 数值)"""
+        times, values = self.window(since)
+        column = values[:, self.columns[metric]]
+        valid = ~np.isnan(column)
+        return times[valid], column[valid]
+
+    def summary(self, metric, since=None):
+        """窗口内的均值、分位数、最值、标准差和抖动（相邻样本差的平均绝对值）"""
+        _, values = self.column(metric, since)
+        if values.size == 0:
+            return {"count": 0}
+        values = values.astype(np.float64)
+        p50, p90, p99 = np.percentile(values, (50, 90, 99))
+        return {
+            "count": int(values.size),
+            "mean": float(values.mean()),
+            "min": float(values.min()),
+            "max": float(values.max()),
+            "p50": float(p50),
+            "p90": float(p90),
+            "p99": float(p99),
+            "std": float(values.std()),
+            "jitter": float(np.abs(np.diff(values)).mean()) if values.size > 1 else 0.0
+        }
+
+    def downsample(self, metric, since=None, step=None, min_metric=None, max_metric=None):
+        """按step秒分桶，返回每个桶的起始时间、均值、最小值和最大值
+
+        min_metric/max_metric 指定另外的列作为桶内最值的来源（逐分钟环中预先聚合的最值列）。
+        """
+        times, values = self.window(since)
+        means = values[:, self.columns[metric]]
+        mins = values[:, self.columns[min_metric or metric]]
+        maxs = values[:, self.columns[max_metric or metric]]
+        valid = ~np.isnan(means)
+        times, means, mins, maxs = times[valid], means[valid], mins[valid], maxs[valid]
+        if times.size == 0:
+            return {"time": [], "mean": [], "min": [], "max": []}
+        if not step:
+            return {"time": times.tolist(), "mean": means.tolist(), "min": mins.tolist(), "max": maxs.tolist()}
+
+        # 桶边界按step对齐，同样的参数多次查询得到的桶一致
+        origin = np.floor(times[0] / step) * step
+        buckets = ((times - origin) // step).astype(np.int64)
+        keys, starts = np.unique(buckets, return_index=True)
+        counts = np.diff(np.append(starts, buckets.size))
+        sums = np.add.reduceat(means.astype(np.float64), starts)
+        return {
+            "time": (origin + keys * step).tolist(),
+            "mean": (sums / counts).tolist(),
+            "min": np.minimum.reduceat(mins, starts).tolist(),
+            "max": np.maximum.reduceat(maxs, starts).tolist()
+        }
+
+
+class StatsHistory:
+    """逐帧、逐秒、逐分钟三级统计历史"""
+
+    def __init__(self, frame_metrics, second_metrics, frame_capacity=4096, second_capacity=6 * 3600,
+                 minute_capacity=7 * 24 * 60):
+        self.frame_metrics = list(frame_metrics)
+        # 逐秒环：由逐帧样本得到的帧率和各指标均值，再加上调用方提供的指标
+        self.derived_metrics = ["fps"] + self.frame_metrics + ["interval_jitter_ms"]
+        self.second_metrics = self.derived_metrics + list(second_metrics)
+        self.frames = TimeSeriesRing(self.frame_metrics, frame_capacity)
+        self.seconds = TimeSeriesRing(self.second_metrics, second_capacity)
+        self.minutes = TimeSeriesRing([f"{name}{suffix}" for name in self.second_metrics
+                                       for suffix in ("", ":min", ":max")], minute_capacity)
+        self.last_second = None
+        self.minute_start = None
+
+    @property
+    def nbytes(self):
+        return self.frames.nbytes + self.seconds.nbytes + self.minutes.nbytes
+
+    def add_frame(self, timestamp, row):
+        self.frames.append(timestamp, row)
+
+    def add_second(self, timestamp, sample):
+        """写入一个逐秒样本，返回写入的行（字典）
+
+        帧率和逐帧指标的均值由上次调用以来的逐帧样本计算；sample 提供其余指标，缺少的记为NaN。
+        """
+        since = self.last_second if self.last_second is not None else timestamp - 1.0
+        elapsed = max(timestamp - since, 1e-6)
+        self.last_second = timestamp
+
+        # 上次调用之后写入的帧，时间都不早于上次调用的时间
+        _, frame_values = self.frames.window(since)
+        means, _ = _nan_stats(frame_values)
+        row = {"fps": frame_values.shape[0] / elapsed}
+        row.update(zip(self.frame_metrics, means.tolist()))
+        if "interval_ms" in self.frames.columns and frame_values.shape[0] > 1:
+            intervals = frame_values[:, self.frames.columns["interval_ms"]]
+            row["interval_jitter_ms"] = float(np.nanstd(intervals)) if not np.isnan(intervals).all() else np.nan
+        for name in self.second_metrics[len(self.derived_metrics):]:
+            value = sample.get(name)
+            row[name] = np.nan if value is None else value
+        self.seconds.append(timestamp, [row.get(name, np.nan) for name in self.second_metrics])
+
+        # 每满一分钟把逐秒样本聚合到逐分钟环
+        minute = np.floor(timestamp / 60) * 60
+        if self.minute_start is None:
+            self.minute_start = minute
+        elif minute > self.minute_start:
+            self._aggregate_minute(self.minute_start)
+            self.minute_start = minute
+        return row
+
+    def _aggregate_minute(self, start):
+        times, values = self.seconds.window(start)
+        values = values[times < start + 60]
+        if values.shape[0] == 0:
+            return
+        means, counts = _nan_stats(values)
+        filled_low = np.where(np.isnan(values), np.inf, values).min(axis=0)
+        filled_high = np.where(np.isnan(values), -np.inf, values).max(axis=0)
+        mins = np.where(counts > 0, filled_low, np.nan)
+        maxs = np.where(counts > 0, filled_high, np.nan)
+        self.minutes.append(start, np.column_stack((means, mins, maxs)).ravel())
+
+    def metrics(self):
+        return {"frame": self.frame_metrics, "second": self.second_metrics}
+
+    def tiers(self):
+        """各级的分辨率、容量、当前覆盖的时间范围和占用内存"""
+        result = {}
+        for name, ring, resolution in (("frame", self.frames, None), ("second", self.seconds, 1),
+                                       ("minute", self.minutes, 60)):
+            span = ring.span()
+            result[name] = {"resolution": resolution, "capacity": ring.capacity, "count": ring.count,
+                            "span": span[1] - span[0] if span else 0.0, "bytes": ring.nbytes}
+        return result
+
+    def query(self, metric, window, step=None, now=None):
+        """查询指标在最近window秒内的历史，按step秒降采样
+
+        优先使用分辨率足够且覆盖整个窗口的最细一级：逐帧指标在窗口不超过逐帧环覆盖范围、
+        且步长小于1秒时使用逐帧环；步长不小于60秒或窗口超过逐秒环容量时使用逐分钟环。
+        """
+        if metric not in self.second_metrics and metric not in self.frame_metrics:
+            raise KeyError(metric)
+        since = now - window if now is not None else None
+        frame_span = self.frames.span()
+        if metric in self.frame_metrics and (step is None or step < 1) and frame_span is not None and \
+                since is not None and frame_span[0] <= since:
+            tier, ring, columns = "frame", self.frames, {}
+        elif (step is not None and step >= 60) or window > self.seconds.capacity:
+            tier, ring, columns = "minute", self.minutes, {"min_metric": f"{metric}:min",
+                                                           "max_metric": f"{metric}:max"}
+        else:
+            tier, ring, columns = "second", self.seconds, {}
+        return {
+            "metric": metric,
+            "tier": tier,
+            "window": window,
+            "step": step,
+            "summary": ring.summary(metric, since),
+            "points": ring.downsample(metric, since, step, **columns)
+        }
@@ -0,0 +1,140 @@
+"""状态的Server-Sent Events广播
+
+/debug 页面原来每5秒整页刷新，每次都重新生成HTML、获取三把锁；同时监控多台机械狗时，
+树莓派的开销随观看者数量线性增长。
+
+StatusBroadcaster 在后台线程中按固定间隔调用一次 snapshot_fn 生成状态快照，与上一份快照比较
+得到增量（只包含变化的字段，删除的字段为null），序列化一次后由所有订阅者共享：
+  - 每个订阅者首先收到完整快照（event: snapshot），之后收到增量（event: delta）
+  - 订阅者跟不上而漏掉增量时，下一条改发当前的完整快照，客户端状态不会出错
+  - 没有变化的周期不发送；长时间没有消息时发送注释行保活
+  - 没有订阅者时后台线程不生成快照
+"""
+
+import json
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+
+def json_delta(old, new):
+    """返回把old变成new所需的增量：变化的键取新值，删除的键为None，嵌套字典递归比较"""
+    delta = {}
+    for key, value in new.items():
+        if key not in old:
+            delta[key] = value
+        elif isinstance(value, dict) and isinstance(old[key], dict):
+            child = json_delta(old[key], value)
+            if child:
+                delta[key] = child
+        elif old[key] != value:
+            delta[key] = value
+    for key in old:
+        if key not in new:
+            delta[key] = None
+    return delta
+
+
+def format_event(event, seq, payload):
+    return f"id: {seq}\nevent: {event}\ndata: {payload}\n\n".encode()
+
+
+class StatusBroadcaster:
+    """按 interval 秒生成状态快照，向所有订阅者推送共享的增量消息"""
+
+    def __init__(self, snapshot_fn, interval=1.0, keepalive=15.0):
+        self.snapshot_fn = snapshot_fn
+        self.interval = interval
+        self.keepalive = keepalive
+        self.condition = threading.Condition()
+        self.seq = 0
+        self.snapshot = None
+        self.delta_message = None
+        self.snapshot_message = None  # 当前快照的完整消息，有订阅者需要时才序列化
+        self.subscribers = 0
+        self.running = False
+        self.thread = None
+        self.stats = {"ticks": 0, "messages": 0, "snapshots_sent": 0, "serialize_ms": 0.0, "errors": 0}
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self._run, name="status-events", daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+
+    def _run(self):
+        while self.running:
+            with self.condition:
+                while self.running and self.subscribers == 0:
+                    # 没有订阅者时不生成快照，下次订阅时重新发送完整快照
+                    self.snapshot = None
+                    self.condition.wait()
+            if not self.running:
+                break
+
+            start = time.perf_counter()
+            try:
+                snapshot = self.snapshot_fn()
+                # 统一为JSON类型，避免元组与列表比较时误判为变化
+                snapshot = json.loads(json.dumps(snapshot, default=str))
+            except Exception as e:
+                self.stats["errors"] += 1
+                logger.error(f"生成状态快照失败: {e}")
+                time.sleep(self.interval)
+                continue
+
+            with self.condition:
+                previous = self.snapshot
+                delta = json_delta(previous, snapshot) if previous is not None else snapshot
+                if delta or previous is None:
+                    self.seq += 1
+                    self.snapshot = snapshot
+                    self.delta_message = format_event("delta", self.seq, json.dumps(delta, separators=(",", ":")))
+                    self.snapshot_message = None
+                    self.stats["messages"] += 1
+                    self.condition.notify_all()
+                self.stats["ticks"] += 1
+            self.stats["serialize_ms"] = (time.perf_counter() - start) * 1000
+            time.sleep(self.interval)
+
+    def _full_message(self):
+        # 调用方持有 condition
+        if self.snapshot_message is None:
+            self.snapshot_message = format_event("snapshot", self.seq,
+                                                 json.dumps(self.snapshot, separators=(",", ":")))
+        return self.snapshot_message
+
+    def subscribe(self):
+        """返回一个生成SSE消息的生成器，客户端断开（生成器关闭）时自动退订"""
+        with self.condition:
+            self.subscribers += 1
+            self.condition.notify_all()
+        return self._stream()
+
+    def _stream(self):
+        last_seq = None
+        try:
+            # 提示浏览器断线后1秒重连
+            yield b"retry: 1000\n\n"
+            while self.running:
+                with self.condition:
+                    if self.seq == last_seq or self.snapshot is None:
+                        self.condition.wait(self.keepalive)
+                    if self.snapshot is None or self.seq == last_seq:
+                        message = None
+                    elif last_seq is not None and self.seq == last_seq + 1:
+                        message = self.delta_message
+                    else:
+                        message = self._full_message()
+                        self.stats["snapshots_sent"] += 1
+                    last_seq = self.seq if message is not None else last_seq
+                yield message if message is not None else b": keepalive\n\n"
+        finally:
+            with self.condition:
+                self.subscribers -= 1
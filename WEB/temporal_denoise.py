@@ -0,0 +1,99 @@
+"""夜视模式的时域降噪
+
+低光下传感器噪声在相邻帧之间基本不相关，而静止场景的内容不变，
+因此对静止区域做帧间滑动平均（cv2.accumulateWeighted）可以在不损失空间细节的情况下降低噪声。
+运动区域如果继续平均会产生拖影，这些区域直接用当前帧重置累加器：
+  - 复用 detect_motion 计算的运动掩码（更新频率较低，覆盖大范围运动）
+  - 每帧再做一次与当前输出的逐像素差值检测，补上运动掩码更新之间的新运动
+
+所有缓冲区在分辨率确定后一次性分配，之后每帧的处理都写入已有缓冲区，不再分配内存。
+scale < 1 时在缩小的画面上累加后放大输出，速度更快但会损失细节。
+"""
+
+import cv2
+import numpy as np
+
+
+class TemporalDenoiser:
+    """带运动感知重置的滑动平均降噪器
+
+    - alpha: 当前帧在平均中的权重，越小降噪越强、对亮度变化响应越慢
+    - scale: 处理分辨率比例（1.0、0.5 ...）
+    - reset_threshold: 当前帧与平均结果的灰度差超过此值时，该像素视为运动并重置
+    """
+
+    def __init__(self, alpha=0.25, scale=1.0, reset_threshold=30):
+        self.alpha = alpha
+        self.scale = scale
+        self.reset_threshold = reset_threshold
+        self.shape = None
+        self.buffers = None
+        self.primed = False
+
+    def _allocate(self, shape):
+        height, width = shape[:2]
+        work_size = (max(1, int(width * self.scale)), max(1, int(height * self.scale)))
+        work_shape = (work_size[1], work_size[0])
+        self.buffers = {
+            "work_size": work_size,
+            "small": np.empty(work_shape + (3,), np.uint8) if self.scale != 1.0 else None,
+            "accumulator": np.empty(work_shape + (3,), np.float32),
+            "average": np.empty(work_shape + (3,), np.uint8),
+            "diff": np.empty(work_shape + (3,), np.uint8),
+            "diff_gray": np.empty(work_shape, np.uint8),
+            "reset_mask": np.empty(work_shape, np.uint8),
+            "motion_mask": np.empty(work_shape, np.uint8),
+            "output": np.empty(shape, np.uint8) if self.scale != 1.0 else None
+        }
+        self.shape = shape
+        self.primed = False
+
+    def reset(self):
+        """丢弃累加结果，例如切换夜视模式或摄像头重启后"""
+        self.shape = None
+        self.buffers = None
+
+    def restart(self):
+        """下一帧重新开始累加，保留已分配的缓冲区；可在处理线程之外调用，例如重新进入夜视模式时"""
+        self.primed = False
+
+    def process(self, frame, motion_mask=None):
+        """返回降噪后的帧；返回的数组在下一次调用时会被覆盖，调用方不能长期持有"""
+        if self.shape != frame.shape:
+            self._allocate(frame.shape)
+        buffers = self.buffers
+
+        work = frame
+        if buffers["small"] is not None:
+            work = cv2.resize(frame, buffers["work_size"], dst=buffers["small"], interpolation=cv2.INTER_AREA)
+
+        accumulator = buffers["accumulator"]
+        average = buffers["average"]
+        if not self.primed:
+            accumulator[...] = work
+            self.primed = True
+        else:
+            # 当前帧与上一次平均结果差异大的像素视为运动
+            cv2.absdiff(work, average, dst=buffers["diff"])
+            cv2.cvtColor(buffers["diff"], cv2.COLOR_BGR2GRAY, dst=buffers["diff_gray"])
+            reset_mask = buffers["reset_mask"]
+            cv2.threshold(buffers["diff_gray"], self.reset_threshold, 255, cv2.THRESH_BINARY, dst=reset_mask)
+
+            if motion_mask is not None:
+                if motion_mask.shape == reset_mask.shape:
+                    cv2.bitwise_or(reset_mask, motion_mask, dst=reset_mask)
+                else:
+                    cv2.resize(motion_mask, buffers["work_size"], dst=buffers["motion_mask"],
+                               interpolation=cv2.INTER_NEAREST)
+                    cv2.bitwise_or(reset_mask, buffers["motion_mask"], dst=reset_mask)
+
+            cv2.accumulateWeighted(work, accumulator, self.alpha)
+            # 运动区域用当前帧覆盖累加结果（权重为1的累加等于直接赋值）
+            cv2.accumulateWeighted(work, accumulator, 1.0, mask=reset_mask)
+
+        cv2.convertScaleAbs(accumulator, dst=average)
+
+        if buffers["output"] is None:
+            return average
+        return cv2.resize(average, (frame.shape[1], frame.shape[0]), dst=buffers["output"],
+                          interpolation=cv2.INTER_LINEAR)
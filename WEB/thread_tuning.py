@@ -0,0 +1,231 @@
+"""线程的CPU亲和性、调度优先级和OpenCV线程数配置
+
+树莓派只有4个核心，OpenCV内部线程池、捕获线程、健康检查、资源采样和每个HTTP请求线程原来都在
+同样的核心上竞争，systemd单元只设置了整个进程的 Nice=-10。ThreadTuner 按线程名把线程分配到角色，
+再按角色设置：
+  - CPU亲和性（CAMERA_CPU_AFFINITY），例如 "capture=3;analysis=2;http=0-1;*=0-2"
+  - 调度优先级（CAMERA_THREAD_PRIORITY），整数为nice值，"fifo:N"/"rr:N" 为实时调度，
+    例如 "capture=fifo:10;resource-monitor=10"；负nice值和实时调度需要 CAP_SYS_NICE
+  - 各处理阶段的OpenCV线程数（CAMERA_CV_THREADS），例如 "enhance=2;encode=1;analysis=1"
+
+角色就是线程名（capture、analysis、health、resource-monitor、h264 等），另有三个特殊角色：
+  - http:   主线程（accept）和werkzeug的请求线程；请求线程由主线程创建，继承它的设置
+  - native: 不是由Python创建的线程（OpenCV线程池、libcamera、PyAV），未设置时使用 "*"
+  - *:      其他未单独设置的线程
+
+Linux上新线程继承创建者的亲和性，OpenCV线程池的工作线程由第一个调用并行函数的线程创建，
+会继承该线程被限制的核心，所以 apply() 需要定期调用，把新出现的线程也按角色设置。
+
+cv2.setNumThreads 对整个进程生效，没有线程局部的版本：set_cv_stage() 在阶段开始时按该阶段的
+设置调整（与当前值相同时不调用），并发运行的阶段以最后设置的为准。
+"""
+
+import logging
+import os
+import threading
+from collections import deque
+
+import cv2
+
+logger = logging.getLogger(__name__)
+
+POLICIES = {"fifo": getattr(os, "SCHED_FIFO", None), "rr": getattr(os, "SCHED_RR", None)}
+POLICY_NAMES = {value: name for name, value in POLICIES.items() if value is not None}
+POLICY_NAMES[getattr(os, "SCHED_OTHER", 0)] = "other"
+
+
+def parse_cpu_list(text):
+    """解析 "0-1,3" 形式的核心列表"""
+    cpus = set()
+    for part in text.split(","):
+        part = part.strip()
+        if not part:
+            continue
+        if "-" in part:
+            first, last = part.split("-", 1)
+            cpus.update(range(int(first), int(last) + 1))
+        else:
+            cpus.add(int(part))
+    return cpus
+
+
+def format_cpu_list(cpus):
+    """把核心集合格式化为 "0-1,3" """
+    ranges = []
+    for cpu in sorted(cpus):
+        if ranges and cpu == ranges[-1][1] + 1:
+            ranges[-1][1] = cpu
+        else:
+            ranges.append([cpu, cpu])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in ranges)
+
+
+def parse_priority(text):
+    """整数为nice值，"fifo:N"/"rr:N" 为实时调度及其优先级，返回 (类型, 值)"""
+    text = text.strip().lower()
+    if ":" in text:
+        policy, value = text.split(":", 1)
+        if policy not in POLICIES:
+            raise ValueError(f"未知的调度策略: {policy}")
+        return policy, int(value)
+    return "nice", int(text)
+
+
+def parse_role_spec(spec, parse_value):
+    """解析 "角色=值;角色=值"，值用 parse_value 转换"""
+    table = {}
+    for item in (spec or "").split(";"):
+        if "=" not in item:
+            continue
+        role, value = item.split("=", 1)
+        table[role.strip()] = parse_value(value)
+    return table
+
+
+def list_native_threads():
+    """返回 {线程ID: 线程名}，包括不是由Python创建的线程"""
+    threads = {}
+    try:
+        for tid in os.listdir("/proc/self/task"):
+            try:
+                with open(f"/proc/self/task/{tid}/comm", 'r') as f:
+                    threads[int(tid)] = f.read().strip()
+            except OSError:
+                pass
+    except OSError:
+        pass
+    return threads
+
+
+class ThreadTuner:
+    """按角色设置线程的CPU亲和性和调度优先级，并按处理阶段设置OpenCV线程数"""
+
+    def __init__(self, affinity=None, priority=None, cv_threads=None):
+        self.affinity = affinity or {}
+        self.priority = priority or {}
+        self.cv_threads = cv_threads or {}
+        self.applied = {}            # 线程ID -> 已按其设置的角色
+        self.errors = deque(maxlen=20)
+        self.cv_current = None
+        self.lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls, environ=os.environ):
+        cv_spec = environ.get("CAMERA_CV_THREADS", "")
+        if cv_spec and "=" not in cv_spec:
+            # 单个数字对所有阶段生效
+            cv_spec = f"*={cv_spec}"
+        return cls(parse_role_spec(environ.get("CAMERA_CPU_AFFINITY", ""), parse_cpu_list),
+                   parse_role_spec(environ.get("CAMERA_THREAD_PRIORITY", ""), parse_priority),
+                   parse_role_spec(cv_spec, int))
+
+    @property
+    def enabled(self):
+        return bool(self.affinity or self.priority or self.cv_threads)
+
+    @staticmethod
+    def role_of(thread):
+        if thread is threading.main_thread() or "process_request_thread" in thread.name:
+            return "http"
+        return thread.name
+
+    @staticmethod
+    def _lookup(table, role):
+        if role in table:
+            return table[role]
+        return table.get("*")
+
+    def _record_error(self, role, tid, message):
+        self.errors.append({"role": role, "tid": tid, "error": message})
+        logger.warning(f"线程 {role} ({tid}) {message}")
+
+    def _apply_thread(self, tid, role):
+        cpus = self._lookup(self.affinity, role)
+        if cpus:
+            try:
+                os.sched_setaffinity(tid, cpus)
+            except (AttributeError, OSError, ValueError) as e:
+                self._record_error(role, tid, f"设置CPU亲和性 {format_cpu_list(cpus)} 失败: {e}")
+
+        priority = self._lookup(self.priority, role)
+        if priority is None:
+            return
+        kind, value = priority
+        try:
+            if kind == "nice":
+                os.setpriority(os.PRIO_PROCESS, tid, value)
+            else:
+                os.sched_setscheduler(tid, POLICIES[kind], os.sched_param(value))
+        except PermissionError:
+            self._record_error(role, tid, f"设置调度优先级 {kind}:{value} 失败: 权限不足（需要CAP_SYS_NICE）")
+        except (AttributeError, OSError, ValueError, TypeError) as e:
+            self._record_error(role, tid, f"设置调度优先级 {kind}:{value} 失败: {e}")
+
+    def apply(self):
+        """按角色设置尚未设置过的线程，可以定期调用以覆盖新创建的线程"""
+        if not (self.affinity or self.priority):
+            return
+        with self.lock:
+            python_threads = {t.native_id: self.role_of(t) for t in threading.enumerate() if t.native_id}
+            native_threads = list_native_threads()
+            for tid in native_threads:
+                role = python_threads.get(tid, "native")
+                if self.applied.get(tid) == role:
+                    continue
+                if role == "native" and "native" not in self.affinity and "native" not in self.priority:
+                    role_for_lookup = "*"
+                else:
+                    role_for_lookup = role
+                self._apply_thread(tid, role_for_lookup)
+                self.applied[tid] = role
+            # 清理已退出的线程
+            for tid in [tid for tid in self.applied if tid not in native_threads]:
+                del self.applied[tid]
+
+    def set_cv_stage(self, stage):
+        """处理阶段开始时调用，按该阶段的设置调整OpenCV线程数"""
+        threads = self._lookup(self.cv_threads, stage)
+        if threads is None or threads == self.cv_current:
+            return
+        cv2.setNumThreads(threads)
+        self.cv_current = threads
+
+    def settings(self):
+        return {
+            "affinity": {role: format_cpu_list(cpus) for role, cpus in self.affinity.items()},
+            "priority": {role: f"{kind}:{value}" if kind != "nice" else value
+                         for role, (kind, value) in self.priority.items()},
+            "cv_threads": dict(self.cv_threads)
+        }
+
+    def report(self):
+        """从内核读回各线程实际生效的亲和性和调度参数"""
+        python_threads = {t.native_id: t for t in threading.enumerate() if t.native_id}
+        threads = []
+        for tid, comm in sorted(list_native_threads().items()):
+            thread = python_threads.get(tid)
+            entry = {"tid": tid, "name": thread.name if thread is not None else comm,
+                     "role": self.role_of(thread) if thread is not None else "native"}
+            try:
+                entry["cpus"] = format_cpu_list(os.sched_getaffinity(tid))
+                policy = os.sched_getscheduler(tid)
+                entry["policy"] = POLICY_NAMES.get(policy, str(policy))
+                if entry["policy"] in POLICIES:
+                    entry["rt_priority"] = os.sched_getparam(tid).sched_priority
+                entry["nice"] = os.getpriority(os.PRIO_PROCESS, tid)
+            except (AttributeError, OSError):
+                # 线程在读取期间退出
+                continue
+            threads.append(entry)
+        try:
+            available = format_cpu_list(os.sched_getaffinity(0))
+        except (AttributeError, OSError):
+            available = None
+        return {
+            "cpu_count": os.cpu_count(),
+            "available_cpus": available,
+            "settings": self.settings(),
+            "cv_threads": cv2.getNumThreads(),
+            "threads": threads,
+            "errors": list(self.errors)
+        }